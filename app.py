@@ -1,14 +1,78 @@
 import streamlit as st
+import csv
+import io
 import os
+import sys
+import threading
+import time
+import uuid
 from datetime import date
-from src import db, logic
-from views import ingredients_view, recipes_view, planner_view, shopping_view
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from src import db, logic, profiling
+
+# Las vistas se importan al elegir su página por primera vez: un visitante en
+# modo lectura solo llega al planificador
+VISTAS = {
+    "📅 Planificador": "views.planner_view",
+    "📖 Recetas": "views.recipes_view",
+    "🍅 Ingredientes": "views.ingredients_view",
+    "🛒 Compra": "views.shopping_view",
+}
+
+
+def _ruta_hogar_sesion():
+    # Los callbacks y los fragmentos no pasan por el principio de app.py: la
+    # base de datos del hogar se toma de la sesión en cada llamada a db.py
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return None
+    return st.session_state.get("hogar_ruta")
+
+
+def _arrancar_mantenimiento():
+    from src import archive
+    archive.start_background_maintenance()
+
+
+def _generar_en(ruta, funcion, *args):
+    # Las descargas diferidas se generan en un hilo del servidor, fuera de la
+    # sesión: la base de datos se fija explícitamente
+    with db.using_db(ruta):
+        return funcion(*args)
+
 
 # 1. Inicialización y Configuración
+t_inicio = time.perf_counter()
+sesion_nueva = "sesion_id" not in st.session_state
+lap = profiling.laps("app")
 if not os.path.exists('data'): os.makedirs('data')
+
+# Hogar de la sesión (?hogar=... en la URL); sin él, la base de datos de siempre
+db.set_db_path_resolver(_ruta_hogar_sesion)
+hogar = st.query_params.get("hogar")
+st.session_state["hogar_ruta"] = None
+if hogar:
+    from src import households
+    try:
+        st.session_state["hogar_ruta"] = households.resolve(hogar)
+    except households.HouseholdError as e:
+        # Nunca se cae a otra base de datos: sería enseñar los datos de otro hogar
+        st.error(f"🏠 {e}")
+        st.stop()
 db.init_db()
+# Archivo de semanas antiguas y recuperación de espacio, en segundo plano. La
+# primera vez src.archive se importa en otro hilo, fuera del arranque en frío
+if "src.archive" in sys.modules:
+    sys.modules["src.archive"].start_background_maintenance()
+else:
+    threading.Thread(target=_arrancar_mantenimiento, name="arranque-mantenimiento", daemon=True).start()
 st.set_page_config(page_title="Planificador Pro V2", layout="wide", page_icon="🥑")
 
+# Identificador de sesión para la garantía read-your-writes de la cola de escrituras
+if "sesion_id" not in st.session_state:
+    st.session_state["sesion_id"] = uuid.uuid4().hex
+db.set_write_session(st.session_state["sesion_id"])
+lap("inicio")
+
 # 2. Gestión de Fechas
 if "fecha_global" not in st.session_state:
     st.session_state["fecha_global"] = logic.get_start_of_week(date.today())
@@ -22,9 +86,21 @@ def change_date(dias=0, nueva_fecha=None):
 st.sidebar.divider()
 st.sidebar.subheader("🔐 Acceso Editor")
 
-# Intentamos leer la clave desde Secrets, si no, usamos una por defecto para local
-clave_maestra = st.secrets.get("CLAVE_EDITOR")
+# Intentamos leer la clave desde Secrets: la del hogar (CLAVES_HOGARES) o, sin
+# hogar, la general
 password_usuario = st.sidebar.text_input("Código de edición", type="password", key="pwd_input")
+if hogar:
+    # Un hogar solo se abre con su propia clave, también para leer: la general
+    # (o ninguna) dejaría a cualquiera ver o editar los datos de otro hogar
+    clave_maestra = st.secrets.get("CLAVES_HOGARES", {}).get(hogar)
+    if clave_maestra is None:
+        st.error(f"🏠 El hogar {hogar} no tiene clave en CLAVES_HOGARES: no se puede abrir")
+        st.stop()
+    if password_usuario != clave_maestra:
+        st.info(f"🏠 Introduce el código del hogar {hogar} para ver sus datos")
+        st.stop()
+else:
+    clave_maestra = st.secrets.get("CLAVE_EDITOR")
 
 es_editor = (clave_maestra is not None) and (password_usuario == clave_maestra)
 
@@ -33,6 +109,8 @@ if es_editor:
 else:
     st.sidebar.warning("Modo Lectura")
 
+if hogar:
+    st.sidebar.caption(f"🏠 Hogar: {hogar}")
 st.sidebar.title("Navegación")
 if es_editor:
     opcion = st.sidebar.radio(
@@ -53,17 +131,152 @@ st.sidebar.divider()
 # --- MANTENIMIENTO (Solo visible para editores) ---
 if es_editor:
     with st.sidebar.expander("⚙️ Mantenimiento Avanzado"):
-        # Botón de Descarga
-        try:
-            with open("data/planner.db", "rb") as f:
-                st.download_button(
-                    label="📥 Copia de Seguridad (.db)",
-                    data=f,
-                    file_name=f"backup_planner_{date.today()}.db",
-                    mime="application/x-sqlite3"
-                )
-        except FileNotFoundError:
-            st.error("Archivo DB no encontrado")
+        # Solo los editores llegan aquí: no se importan en el arranque de los demás
+        from src import archive, backup, transfer
+        ruta_db = db.get_db_path()
+        # Botón de Descarga: la copia solo se genera al pulsarlo
+        st.download_button(
+            label="📥 Copia de Seguridad (.db.gz)",
+            data=lambda: _generar_en(ruta_db, backup.create_backup_bytes),
+            file_name=f"backup_{hogar or 'planner'}_{date.today()}.db.gz",
+            mime="application/gzip"
+        )
+
+        # Restaurar una copia (.db o .db.gz)
+        copia = st.file_uploader("Restaurar copia", type=["gz", "db"], key="upload_backup")
+        if copia is not None and st.button("♻️ Restaurar", key="btn_restore_backup"):
+            try:
+                backup.restore_backup(copia)
+            except backup.BackupError as e:
+                st.error(f"No se restauró la copia: {e}")
+            else:
+                st.success("Copia restaurada")
+
+        st.divider()
+        # Importación / exportación en bloque (CSV o JSON Lines)
+        tipo_io = st.selectbox("📦 Datos", list(transfer.COLUMNAS), key="io_tipo")
+        formato_io = st.radio("Formato", transfer.FORMATOS, horizontal=True, key="io_formato")
+        st.download_button(
+            label=f"📤 Exportar {tipo_io}",
+            data=lambda: _generar_en(ruta_db, transfer.export_bytes, tipo_io, formato_io),
+            file_name=f"{tipo_io}_{date.today()}.{formato_io}",
+            mime="text/csv" if formato_io == "csv" else "application/jsonl",
+            key="btn_export"
+        )
+        fichero_io = st.file_uploader(f"Importar {tipo_io}", type=list(transfer.FORMATOS), key="upload_import")
+        if fichero_io is not None and st.button("📥 Importar", key="btn_import"):
+            formato_fichero = "jsonl" if fichero_io.name.lower().endswith(".jsonl") else "csv"
+            try:
+                resultado = transfer.import_file(tipo_io, formato_fichero,
+                                                 io.TextIOWrapper(fichero_io, encoding="utf-8-sig", newline=""))
+            except (transfer.TransferError, UnicodeDecodeError, csv.Error) as e:
+                st.error(f"No se importó el fichero: {e}")
+            else:
+                st.success(f"{resultado['importadas']} de {resultado['filas']} filas importadas")
+                if resultado["total_errores"]:
+                    st.warning(f"{resultado['total_errores']} filas con errores")
+                    st.dataframe([{"Línea": linea, "Motivo": motivo} for linea, motivo in resultado["errores"]],
+                                 hide_index=True, use_container_width=True)
+
+        st.divider()
+        # Archivo de semanas antiguas (el hilo de mantenimiento lo hace solo cada cierto tiempo)
+        info_archivo = archive.get_archive_stats()
+        st.caption(f"🗄️ Archivo: {info_archivo['comidas']} comidas "
+                   f"({info_archivo['desde'] or '-'} a {info_archivo['hasta'] or '-'}), "
+                   f"{info_archivo['bytes'] / 1024:.0f} KiB · {info_archivo['paginas_libres']} páginas libres")
+        semanas_retencion = st.number_input("Semanas a conservar", min_value=1, max_value=520,
+                                            value=archive.RETENTION_WEEKS, key="retencion_semanas")
+        if st.button("🗄️ Archivar semanas antiguas", key="btn_archivar"):
+            resultado = archive.run_maintenance(int(semanas_retencion))
+            st.success(f"{resultado['comidas']} comidas y {resultado['compras']} casillas archivadas")
+        if not info_archivo["auto_vacuum_incremental"]:
+            # Una sola vez: el VACUUM completo bloquea la base de datos mientras dura
+            st.caption("El espacio libre solo se recupera por pasos con auto_vacuum incremental")
+            if st.button("🧹 Activar recuperación por pasos (VACUUM completo)", key="btn_auto_vacuum"):
+                if db.enable_incremental_vacuum():
+                    st.success("auto_vacuum incremental activado")
+                else:
+                    st.warning("No se pudo activar ahora: la base de datos está en uso")
+
+        st.divider()
+        # Lista de la compra materializada (compra_semanal)
+        if st.button("🔁 Verificar lista materializada", key="btn_verify_compra"):
+            diferencias = db.verify_weekly_shopping()
+            if diferencias:
+                db.rebuild_weekly_shopping()
+                st.warning(f"Se corrigieron {len(diferencias)} diferencias")
+            else:
+                st.success("La lista materializada está al día")
+
+        st.divider()
+        # Instrumentación de consultas (opcional)
+        # Es global (cierra los pools para cambiar el tipo de conexión): solo se
+        # toca al mover el interruptor, y este sigue el estado real si otra
+        # sesión lo cambió
+        if st.session_state.get("toggle_query_stats") != db.instrumentation.enabled:
+            st.session_state["toggle_query_stats"] = db.instrumentation.enabled
+        stats_activas = st.toggle("📊 Instrumentar consultas", key="toggle_query_stats",
+                                  on_change=lambda: db.set_query_stats_enabled(st.session_state["toggle_query_stats"]))
+        if stats_activas:
+            stats = db.get_query_stats()
+            st.caption("Funciones de db.py (por tiempo total)")
+            st.dataframe(stats["funciones"], hide_index=True, use_container_width=True)
+            st.caption("Sentencias SQL (por tiempo total)")
+            st.dataframe(stats["consultas"], hide_index=True, use_container_width=True)
+            st.caption(f"Consultas lentas (≥ {db.instrumentation.SLOW_QUERY_MS:g} ms)")
+            for lenta in reversed(stats["lentas"]):
+                st.code(f"{lenta['momento']} · {lenta['ms']} ms · {lenta['filas']} filas\n"
+                        f"{lenta['sql']}\n" + "\n".join(lenta["plan"]), language="sql")
+            if st.button("♻️ Reiniciar estadísticas", key="btn_reset_stats"):
+                db.reset_query_stats()
+                st.rerun()
+
+        # Arranque: primer render de cada sesión nueva frente al presupuesto
+        arranque = profiling.get_startup_report()
+        texto_arranque = (f"🚀 Arranque en frío: p50 {arranque['p50_ms']:g} ms, máx {arranque['max_ms']:g} ms "
+                          f"en {arranque['sesiones']} sesiones (presupuesto {arranque['presupuesto_ms']:g} ms)")
+        if arranque["dentro"]:
+            st.caption(texto_arranque)
+        else:
+            st.warning(texto_arranque)
+        if arranque["importaciones"]:
+            st.dataframe(arranque["importaciones"], hide_index=True, use_container_width=True)
+
+        # Caché de lecturas compartida entre sesiones
+        cache = db.get_read_cache_stats()
+        st.caption(f"🗃️ Caché de lecturas: {cache['aciertos']} aciertos, {cache['fallos']} fallos "
+                   f"({cache['tasa_aciertos']:.0%}), {cache['entradas']}/{cache['max_entradas']} entradas")
+        # Escrituras concurrentes: esperas por el bloqueo y conflictos de versión
+        bloqueos = db.get_lock_stats()
+        st.caption(f"🔒 Escrituras concurrentes: {bloqueos['reintentos']} reintentos, "
+                   f"{bloqueos['agotados']} abandonadas, {bloqueos['conflictos']} conflictos")
+
+        st.divider()
+        # Tiempos por vista y sección (histograma móvil)
+        st.caption("⏱️ Tiempos por rerun")
+        st.dataframe(profiling.get_summary(), hide_index=True, use_container_width=True)
+        if st.button("♻️ Reiniciar tiempos", key="btn_reset_tiempos"):
+            profiling.reset()
+            st.rerun()
+
+        # Perfilado con cProfile de las próximas N ejecuciones
+        n_perfil = st.number_input("Ejecuciones a perfilar", min_value=1, max_value=50, value=5,
+                                   key="perfil_n")
+        if st.button("🔬 Perfilar próximas ejecuciones", key="btn_perfilar"):
+            st.session_state["perfil"] = profiling.new_profiler()
+            st.session_state["perfil_restante"] = int(n_perfil)
+            st.rerun()
+        if st.session_state.get("perfil_restante", 0) > 0:
+            st.info(f"Perfilando... quedan {st.session_state['perfil_restante']} ejecuciones")
+        elif st.session_state.get("perfil") is not None:
+            perfil_listo = st.session_state["perfil"]
+            # Los ficheros solo se generan al pulsar, no en cada rerun
+            st.download_button("📥 Perfil (.pstats)", data=lambda: profiling.to_pstats_bytes(perfil_listo),
+                               file_name=f"perfil_{date.today()}.pstats", mime="application/octet-stream")
+            st.download_button("📥 Pilas colapsadas (.txt)", data=lambda: profiling.to_collapsed(perfil_listo),
+                               file_name=f"perfil_{date.today()}.collapsed.txt", mime="text/plain")
+            st.download_button("📥 Resumen por tiempo acumulado (.txt)", data=lambda: profiling.to_text(perfil_listo),
+                               file_name=f"perfil_{date.today()}.txt", mime="text/plain")
 
         st.divider()
         st.warning("Zona de Peligro")
@@ -74,14 +287,32 @@ if es_editor:
                 st.rerun()
 
 # 4. Enrutador (Router)
-if opcion == "📅 Planificador":
-    planner_view.show_planner_page(es_editor, change_date)
+lap("sidebar")
+# cProfile bajo demanda: envuelve la página de las próximas N ejecuciones de la
+# sesión. Se activa aquí, después de los st.stop() y st.rerun() de arriba, y
+# siempre se desactiva en el finally
+perfil = st.session_state.get("perfil") if st.session_state.get("perfil_restante", 0) > 0 else None
+if perfil is not None:
+    perfil.enable()
+try:
+    with profiling.span(f"vista.{opcion}"):
+        vista = profiling.import_module(VISTAS[opcion])
+        if opcion == "📅 Planificador":
+            vista.show_planner_page(es_editor, change_date)
 
-elif opcion == "📖 Recetas":
-    recipes_view.show_recipes_page(es_editor)
+        elif opcion == "📖 Recetas":
+            vista.show_recipes_page(es_editor)
 
-elif opcion == "🍅 Ingredientes":
-    ingredients_view.show_ingredients_page(es_editor)
+        elif opcion == "🍅 Ingredientes":
+            vista.show_ingredients_page(es_editor)
 
-elif opcion == "🛒 Compra":
-    shopping_view.show_shopping_list_page(change_date)
\ No newline at end of file
+        elif opcion == "🛒 Compra":
+            vista.show_shopping_list_page(change_date)
+finally:
+    # También se ejecuta si la vista sale con st.rerun()
+    lap("router")
+    if sesion_nueva:
+        profiling.record_cold_start((time.perf_counter() - t_inicio) * 1000)
+    if perfil is not None:
+        perfil.disable()
+        st.session_state["perfil_restante"] -= 1
@@ -0,0 +1,142 @@
+"""
+Escrituras concurrentes: varias sesiones editando a la vez la misma base de datos.
+
+    python -m benchmarks.concurrency [--sesiones 8] [--escrituras 200] [--celdas 20] [--cola] [--salida conc.json]
+
+Cada sesión es un hilo, como las de Streamlit en un mismo proceso. Repite lo
+que hace la interfaz: lee las versiones, cambia una celda del planificador
+(compare-and-set) y marca casillas de la compra. Las celdas son pocas a
+propósito, para que choquen. Con ``--cola`` las escrituras pasan por la cola
+de escrituras (db.enable_write_queue), que las aplica en grupos. Imprime:
+
+- escrituras confirmadas por segundo y latencia p50/p95 de cada escritura;
+- conflictos de versión, reintentos por bloqueo y escrituras abandonadas;
+- escrituras perdidas: la versión final de cada celda tiene que ser igual al
+  número de escrituras que se confirmaron sobre ella. Si no, alguna se pisó sin
+  conflicto. Sale con código 1 si hay alguna.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+from benchmarks import generate_data
+from benchmarks.run_benchmarks import _percentil
+from src import db, logic
+
+
+def _sesion(semilla, escrituras, celdas, recetas, ingredientes, semana, resultado):
+    rnd = random.Random(semilla)
+    db.set_write_session(f"bench-{semilla}")
+    latencias, confirmadas, conflictos, ocupada = [], {}, 0, 0
+    for _ in range(escrituras):
+        t = time.perf_counter()
+        try:
+            if rnd.random() < 0.7:
+                fecha, momento = rnd.choice(celdas)
+                version = db.get_plan_versions(fecha, fecha).get((str(fecha), momento), 0)
+                db.save_meal_plan(fecha, momento, rnd.choice(recetas), version=version)
+                confirmadas[(str(fecha), momento)] = confirmadas.get((str(fecha), momento), 0) + 1
+            else:
+                versiones = db.get_shopping_versions(semana)
+                cambios = {i: rnd.random() < 0.5 for i in rnd.sample(ingredientes, 3)}
+                conflictos += len(db.update_shopping_statuses(semana, cambios, versiones=versiones))
+        except db.ConflictError:
+            conflictos += 1
+        except db.DatabaseBusyError:
+            ocupada += 1
+        latencias.append((time.perf_counter() - t) * 1000)
+    resultado.update(latencias=latencias, confirmadas=confirmadas, conflictos=conflictos, ocupada=ocupada)
+
+
+def run(sesiones, escrituras, n_celdas, directorio, semilla=11, cola=False):
+    ruta = os.path.join(directorio, f"concurrencia_{sesiones}_{int(cola)}.db")
+    generate_data.generate(ruta, 300, 60, 1)
+    ruta_anterior = db.DB_PATH
+    db.DB_PATH = ruta
+    try:
+        recetas = [r for r, _ in db.get_all_recipes()]
+        ingredientes = [i for i, _, _ in db.get_all_ingredients()][:20]
+        # Semana sin planificar: las celdas empiezan vacías (versión 0)
+        semana = logic.get_start_of_week(date.today()) + timedelta(weeks=520)
+        rnd = random.Random(semilla)
+        celdas = [(semana + timedelta(days=rnd.randrange(7)), rnd.choice(logic.MOMENTOS)) for _ in range(n_celdas)]
+        antes = db.get_lock_stats()
+        if cola:
+            db.enable_write_queue()
+
+        resultados = [{} for _ in range(sesiones)]
+        hilos = [threading.Thread(target=_sesion, args=(semilla + k, escrituras, celdas, recetas,
+                                                        ingredientes, semana, resultados[k]))
+                 for k in range(sesiones)]
+        t0 = time.perf_counter()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        segundos = time.perf_counter() - t0
+        db.enable_write_queue(False)
+
+        confirmadas = {}
+        for r in resultados:
+            for celda, n in r["confirmadas"].items():
+                confirmadas[celda] = confirmadas.get(celda, 0) + n
+        finales = db.get_plan_versions(semana, semana + timedelta(days=6))
+        perdidas = sum(n - finales.get(celda, 0) for celda, n in confirmadas.items())
+        latencias = [ms for r in resultados for ms in r["latencias"]]
+        despues = db.get_lock_stats()
+    finally:
+        db.enable_write_queue(False)
+        db.close_all_connections()
+        db.invalidate_recipe_graph()
+        db.DB_PATH = ruta_anterior
+
+    return {
+        "sesiones": sesiones,
+        "cola": cola,
+        "escrituras": len(latencias),
+        "segundos": round(segundos, 3),
+        "escrituras_por_segundo": round(len(latencias) / segundos, 1),
+        "p50_ms": round(statistics.median(latencias), 3),
+        "p95_ms": round(_percentil(latencias, 95), 3),
+        "conflictos": sum(r["conflictos"] for r in resultados),
+        "reintentos": despues["reintentos"] - antes["reintentos"],
+        "abandonadas": sum(r["ocupada"] for r in resultados),
+        "perdidas": perdidas,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Escrituras concurrentes de varias sesiones")
+    parser.add_argument("--sesiones", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--escrituras", type=int, default=200, help="Escrituras por sesión")
+    parser.add_argument("--celdas", type=int, default=20, help="Celdas del planificador que se disputan")
+    parser.add_argument("--cola", action="store_true", help="Escribir a través de la cola de escrituras")
+    parser.add_argument("--salida", help="Fichero JSON con los resultados")
+    args = parser.parse_args(argv)
+
+    informe = []
+    print(f"{'sesiones':>8} {'escr/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'confl.':>7} "
+          f"{'reint.':>7} {'aband.':>7} {'perdidas':>9}")
+    with tempfile.TemporaryDirectory() as directorio:
+        for n in args.sesiones:
+            r = run(n, args.escrituras, args.celdas, directorio, cola=args.cola)
+            informe.append(r)
+            print(f"{n:>8} {r['escrituras_por_segundo']:>9.1f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} "
+                  f"{r['conflictos']:>7} {r['reintentos']:>7} {r['abandonadas']:>7} {r['perdidas']:>9}")
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(informe, f, indent=2, ensure_ascii=False)
+    if any(r["perdidas"] for r in informe):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Generador determinista de datos sintéticos para pruebas de rendimiento.
+
+    python -m benchmarks.generate_data --db data/bench.db --escala grande
+
+Crea una base de datos nueva con el esquema actual y la rellena con
+ingredientes, recetas (con 5-30 ingredientes cada una) y semanas planificadas
+por completo. Misma semilla => mismos datos.
+"""
+import argparse
+import os
+import random
+from datetime import date, timedelta
+
+from src import db
+
+MOMENTOS = ["Desayuno", "Media Mañana", "Comida", "Media Tarde", "Cena", "Compra General"]
+CATEGORIAS = [
+    "🥦 Frutería", "🥩 Carnicería", "🧀 Charcuteria", "🐟 Pescaderia", "🥛 Frescos", "🥖 Panadería",
+    "🥫 Despensa", "🧼 Limpieza", "❄️ Congelados", "Otros"
+]
+
+# {nombre: (ingredientes, recetas, años planificados)}
+ESCALAS = {
+    "pequena": (500, 100, 1),
+    "mediana": (5000, 1000, 5),
+    "grande": (20000, 5000, 10),
+}
+
+
+# Cantidad y unidad de un ingrediente en una receta (algunas sin indicar)
+_UNIDADES = [("g", 10, 500), ("kg", 0.1, 2), ("ml", 10, 500), ("l", 0.1, 2), ("ud", 1, 6)]
+
+
+def _cantidad(rnd):
+    if rnd.random() < 0.1:
+        return None, None
+    unidad, minimo, maximo = rnd.choice(_UNIDADES)
+    return round(rnd.uniform(minimo, maximo), 1), unidad
+
+
+def generate(db_path, n_ingredientes, n_recetas, anios, min_ings=5, max_ings=30,
+             inicio=date(2016, 1, 4), semilla=42):
+    """Crea y rellena ``db_path``. Devuelve un diccionario con lo generado."""
+    if os.path.exists(db_path):
+        raise FileExistsError(f"{db_path} ya existe: el generador solo trabaja sobre una base de datos nueva")
+    directorio = os.path.dirname(db_path)
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+
+    rnd = random.Random(semilla)
+    ruta_anterior = db.DB_PATH
+    db.DB_PATH = db_path
+    try:
+        db.init_db()
+        with db.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO ingredientes (id, nombre, categoria) VALUES (?, ?, ?)",
+                ((i, f"Ingrediente {i:06d}", rnd.choice(CATEGORIAS)) for i in range(1, n_ingredientes + 1)))
+
+            # La migración ya crea "Compra": las sintéticas van detrás
+            base = conn.execute("SELECT COALESCE(MAX(id), 0) FROM recetas").fetchone()[0]
+            ids_recetas = list(range(base + 1, base + n_recetas + 1))
+            conn.executemany(
+                "INSERT INTO recetas (id, nombre) VALUES (?, ?)",
+                ((rid, f"Receta {rid:06d}") for rid in ids_recetas))
+
+            ids_ingredientes = range(1, n_ingredientes + 1)
+            enlaces = 0
+            for rid in ids_recetas:
+                k = rnd.randint(min_ings, min(max_ings, n_ingredientes))
+                filas = [(rid, iid, *_cantidad(rnd)) for iid in rnd.sample(ids_ingredientes, k)]
+                conn.executemany("INSERT INTO receta_ingredientes (receta_id, ingrediente_id, cantidad, unidad) "
+                                 "VALUES (?, ?, ?, ?)", filas)
+                enlaces += len(filas)
+
+            dias = anios * 52 * 7
+            conn.executemany(
+                "INSERT INTO planificacion (fecha, momento, receta_id) VALUES (?, ?, ?)",
+                ((str(inicio + timedelta(days=d)), momento, rnd.choice(ids_recetas))
+                 for d in range(dias) for momento in MOMENTOS))
+        db.invalidate_recipe_graph()
+    finally:
+        db.DB_PATH = ruta_anterior
+
+    return {
+        "ingredientes": n_ingredientes,
+        "recetas": n_recetas,
+        "enlaces": enlaces,
+        "comidas": dias * len(MOMENTOS),
+        "inicio": str(inicio),
+        "fin": str(inicio + timedelta(days=dias - 1)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera una base de datos sintética para benchmarks")
+    parser.add_argument("--db", required=True, help="Ruta de la base de datos a crear (no debe existir)")
+    parser.add_argument("--escala", choices=ESCALAS.keys(), default="pequena")
+    parser.add_argument("--ingredientes", type=int, help="Sobrescribe el número de ingredientes de la escala")
+    parser.add_argument("--recetas", type=int, help="Sobrescribe el número de recetas de la escala")
+    parser.add_argument("--anios", type=int, help="Sobrescribe los años planificados de la escala")
+    parser.add_argument("--semilla", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    n_ing, n_rec, anios = ESCALAS[args.escala]
+    resumen = generate(
+        args.db,
+        args.ingredientes or n_ing,
+        args.recetas or n_rec,
+        args.anios or anios,
+        semilla=args.semilla,
+    )
+    for clave, valor in resumen.items():
+        print(f"{clave:>12}: {valor}")
+
+
+if __name__ == "__main__":
+    main()
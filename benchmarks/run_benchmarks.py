@@ -0,0 +1,279 @@
+"""
+Mide la latencia de las funciones públicas de src/db.py y src/logic.py y de la
+lista de la compra completa, sobre bases de datos sintéticas de varias escalas.
+
+    python -m benchmarks.run_benchmarks --escalas pequena mediana --salida bench.json
+
+Imprime p50/p95 por función y escribe un JSON para comparar versiones.
+"""
+import argparse
+import inspect
+import itertools
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import date, timedelta
+
+from benchmarks import generate_data
+from src import db, logic
+
+# Funciones que no tiene sentido medir en bucle (destructivas o de configuración)
+EXCLUIDAS = {
+    "close_all_connections", "configure_db", "get_connection", "transaction",
+    "reset_historical_data", "init_shopping_db", "reset_after_restore",
+    "set_query_stats_enabled", "get_query_stats", "reset_query_stats",
+    "get_read_cache_stats", "clear_read_cache", "set_read_cache_size",
+    "enable_write_queue", "set_write_session", "wait_for_own_writes", "flush_writes",
+    "get_lock_stats", "set_db_path_resolver", "using_db",
+}
+
+
+def _percentil(muestras, p):
+    ordenadas = sorted(muestras)
+    k = (len(ordenadas) - 1) * p / 100
+    f = int(k)
+    c = min(f + 1, len(ordenadas) - 1)
+    return ordenadas[f] + (ordenadas[c] - ordenadas[f]) * (k - f)
+
+
+class Contexto:
+    """Datos de apoyo para construir los argumentos de cada caso"""
+
+    def __init__(self, resumen, semilla=7):
+        self.rnd = random.Random(semilla)
+        self.contador = itertools.count()
+        self.inicio = date.fromisoformat(resumen["inicio"])
+        self.semanas = (date.fromisoformat(resumen["fin"]) - self.inicio).days // 7
+        self.recetas = [r for r, _ in db.get_all_recipes()]
+        self.ingredientes = [i for i, _, _ in db.get_all_ingredients()]
+
+    def semana(self):
+        return self.inicio + timedelta(days=7 * self.rnd.randrange(self.semanas))
+
+    def receta(self):
+        return self.rnd.choice(self.recetas)
+
+    def ingrediente(self):
+        return self.rnd.choice(self.ingredientes)
+
+    def ids_ingredientes(self, k=10):
+        return self.rnd.sample(self.ingredientes, k)
+
+    def nombre(self, prefijo):
+        return f"{prefijo} bench {next(self.contador)}"
+
+
+def _pipeline_compra_legacy(ctx):
+    ws = ctx.semana()
+    datos = db.get_plan_range_details(ws, ws + timedelta(days=6))
+    conteo = logic.aggregate_ingredients(logic.extract_ingredients_from_plan(datos, db))
+    estado = db.get_shopping_status(ws)
+    ids = {nombre: id_ing for id_ing, nombre, _ in db.get_all_ingredients()}
+    categorias = db.get_ingredients_categories()
+    return [(ing, categorias.get(ing, "Otros"), n, estado.get(ids.get(ing), False)) for ing, n in conteo.items()]
+
+
+def _pipeline_compra(ctx):
+    ws = ctx.semana()
+    return db.get_shopping_list(ws, ws + timedelta(days=6))
+
+
+def _pipeline_cantidades_anio(ctx, sumar=logic.aggregate_quantities):
+    # Un año de planificación: agrupado por receta en SQLite y sumado en Python (pandas o puro)
+    ws = ctx.semana()
+    return sumar(db.get_recipe_servings(ws, ws + timedelta(days=364)),
+                 db.get_recipe_links(), db.get_all_ingredients())
+
+
+def _casos():
+    """{nombre: función(ctx)} con los argumentos de cada llamada"""
+    return {
+        # --- db: lecturas ---
+        "db.init_db": lambda ctx: db.init_db(),
+        "db.get_all_ingredients": lambda ctx: db.get_all_ingredients(),
+        "db.get_ingredients_categories": lambda ctx: db.get_ingredients_categories(),
+        "db.get_all_recipes": lambda ctx: db.get_all_recipes(),
+        "db.get_recipe_ingredients": lambda ctx: db.get_recipe_ingredients(ctx.receta()),
+        "db.get_recipe_quantities": lambda ctx: db.get_recipe_quantities(ctx.receta()),
+        "db.get_recipe_links": lambda ctx: db.get_recipe_links(),
+        "db.get_recipe_servings": lambda ctx: db.get_recipe_servings(ctx.semana(), ctx.semana() + timedelta(days=364)),
+        "db.get_plan_range_servings": lambda ctx: db.get_plan_range_servings(
+            ctx.semana(), ctx.semana() + timedelta(days=6)),
+        # Búsqueda amplia (todo el catálogo coincide) y acotada (un prefijo numérico)
+        "db.search_ingredients": lambda ctx: db.search_ingredients("ingred"),
+        "db.search_recipes": lambda ctx: db.search_recipes(f"rec {ctx.rnd.randrange(1000):03d}"),
+        "db.get_ingredients_page": lambda ctx: db.get_ingredients_page(
+            (f"Ingrediente {ctx.ingrediente():06d}", 0), db.INGREDIENTS_PAGE_SIZE, generate_data.CATEGORIAS[0]),
+        "db.get_ingredients_count": lambda ctx: db.get_ingredients_count(
+            None, f"ingrediente {ctx.rnd.randrange(100):02d}"),
+        "db.get_recipe_graph": lambda ctx: db.get_recipe_graph(),
+        "db.invalidate_recipe_graph": lambda ctx: (db.invalidate_recipe_graph(), db.get_recipe_graph()),
+        "db.get_ingredient_usage": lambda ctx: db.get_ingredient_usage(ctx.ingrediente()),
+        "db.get_ingredient_usage_counts": lambda ctx: db.get_ingredient_usage_counts(),
+        "db.get_db_path": lambda ctx: db.get_db_path(),
+        "db.get_open_shards": lambda ctx: db.get_open_shards(),
+        "db.get_data_generation": lambda ctx: db.get_data_generation(),
+        "db.get_plan_generation": lambda ctx: db.get_plan_generation(),
+        "db.get_plan_range_details": lambda ctx: db.get_plan_range_details(
+            ctx.semana(), ctx.semana() + timedelta(days=6)),
+        "db.get_shopping_list": _pipeline_compra,
+        "db.get_shopping_aggregate": lambda ctx: db.get_shopping_aggregate(
+            ctx.semana(), ctx.semana() + timedelta(days=6)),
+        "db.get_shopping_status": lambda ctx: db.get_shopping_status(ctx.semana()),
+        "db.get_shopping_versions": lambda ctx: db.get_shopping_versions(ctx.semana()),
+        "db.get_plan_versions": lambda ctx: db.get_plan_versions(ctx.semana(), ctx.semana() + timedelta(days=27)),
+        "db.verify_weekly_shopping": lambda ctx: db.verify_weekly_shopping(),
+        "db.run_query": lambda ctx: db.run_query("SELECT COUNT(*) FROM planificacion", return_data=True),
+        # --- db: escrituras ---
+        "db.add_ingredient": lambda ctx: db.add_ingredient(ctx.nombre("Ingrediente")),
+        "db.update_ingredient": lambda ctx: db.update_ingredient(
+            ctx.ingrediente(), ctx.nombre("Ingrediente"), "Otros"),
+        "db.delete_ingredient": _crear_y_borrar_ingrediente,
+        "db.ensure_special_recipe": lambda ctx: db.ensure_special_recipe("Compra"),
+        "db.create_recipe": lambda ctx: db.create_recipe(ctx.nombre("Receta"), ctx.ids_ingredientes()),
+        "db.update_recipe": lambda ctx: db.update_recipe(
+            ctx.receta(), ctx.nombre("Receta"), ctx.ids_ingredientes()),
+        "db.delete_recipe": lambda ctx: _crear_y_borrar_receta(ctx),
+        "db.set_recipe_quantities": lambda ctx: db.set_recipe_quantities(
+            ctx.receta(), {i: (100.0, "g") for i in db.get_recipe_quantities(ctx.receta())}),
+        "db.save_meal_servings": lambda ctx: db.save_meal_servings(
+            ctx.semana() + timedelta(days=ctx.rnd.randrange(7)), "Cena", ctx.rnd.choice([1, 2, 4])),
+        "db.save_meal_plan": lambda ctx: db.save_meal_plan(
+            ctx.semana() + timedelta(days=ctx.rnd.randrange(7)), "Cena", ctx.receta()),
+        "db.update_shopping_status": lambda ctx: db.update_shopping_status(
+            ctx.semana(), ctx.ingrediente(), True),
+        "db.update_shopping_statuses": lambda ctx: db.update_shopping_statuses(
+            ctx.semana(), {i: True for i in ctx.ids_ingredientes()}),
+        "db.clear_shopping_status": lambda ctx: db.clear_shopping_status(ctx.semana()),
+        "db.rebuild_weekly_shopping": lambda ctx: db.rebuild_weekly_shopping(),
+        "db.incremental_vacuum": lambda ctx: db.incremental_vacuum(),
+        # --- logic ---
+        "logic.get_start_of_week": lambda ctx: logic.get_start_of_week(ctx.semana() + timedelta(days=3)),
+        "logic.get_month_of_week": lambda ctx: logic.get_month_of_week(ctx.semana()),
+        "logic.get_month_range": lambda ctx: logic.get_month_range(2020, ctx.rnd.randint(1, 12)),
+        "logic.get_planner_range": lambda ctx: logic.get_planner_range(ctx.semana(), "mes"),
+        "logic.shift_planner_range": lambda ctx: logic.shift_planner_range(ctx.semana(), "mes", 1),
+        "logic.extract_ingredients_from_plan": lambda ctx: logic.extract_ingredients_from_plan(
+            db.get_plan_range_details(ctx.semana(), ctx.semana() + timedelta(days=6)), db),
+        "logic.aggregate_ingredients": lambda ctx: logic.aggregate_ingredients(
+            [f"Ingrediente {ctx.ingrediente():06d}" for _ in range(500)]),
+        "logic.aggregate_quantities": _pipeline_cantidades_anio,
+        "logic.aggregate_quantities_plain": lambda ctx: _pipeline_cantidades_anio(
+            ctx, logic.aggregate_quantities_plain),
+        "logic.format_quantity": lambda ctx: logic.format_quantity(1234.5, "g"),
+        # --- lista de la compra completa ---
+        "pipeline.compra_semana_legacy": _pipeline_compra_legacy,
+        "pipeline.compra_semana": _pipeline_compra,
+    }
+
+
+def _crear_y_borrar_ingrediente(ctx):
+    nombre = ctx.nombre("Borrable")
+    db.add_ingredient(nombre)
+    iid = db.run_query("SELECT id FROM ingredientes WHERE nombre = ?", (nombre,), return_data=True)[0][0]
+    db.delete_ingredient(iid)
+
+
+def _crear_y_borrar_receta(ctx):
+    nombre = ctx.nombre("Receta")
+    db.create_recipe(nombre, ctx.ids_ingredientes(5))
+    rid = db.run_query("SELECT id FROM recetas WHERE nombre = ?", (nombre,), return_data=True)[0][0]
+    db.delete_recipe(rid)
+
+
+def _sin_caso(casos):
+    """Funciones públicas de db/logic que no tienen caso de benchmark"""
+    faltan = []
+    for modulo in (db, logic):
+        prefijo = modulo.__name__.split(".")[-1]
+        for nombre, obj in inspect.getmembers(modulo, inspect.isfunction):
+            if obj.__module__ != modulo.__name__ or nombre.startswith("_") or nombre in EXCLUIDAS:
+                continue
+            if f"{prefijo}.{nombre}" not in casos:
+                faltan.append(f"{prefijo}.{nombre}")
+    return faltan
+
+
+def run_scale(escala, repeticiones, directorio, cache_lecturas=False):
+    n_ing, n_rec, anios = generate_data.ESCALAS[escala]
+    ruta = os.path.join(directorio, f"bench_{escala}.db")
+    t0 = time.perf_counter()
+    resumen = generate_data.generate(ruta, n_ing, n_rec, anios)
+    resumen["segundos_generacion"] = round(time.perf_counter() - t0, 3)
+
+    ruta_anterior = db.DB_PATH
+    tam_cache = db.get_read_cache_stats()["max_entradas"]
+    db.DB_PATH = ruta
+    # Por defecto se mide SQLite, no la caché de lecturas
+    db.set_read_cache_size(tam_cache if cache_lecturas else 0)
+    try:
+        ctx = Contexto(resumen)
+        resultados = {}
+        for nombre, caso in _casos().items():
+            caso(ctx)  # calentamiento
+            muestras = []
+            for _ in range(repeticiones):
+                t = time.perf_counter()
+                caso(ctx)
+                muestras.append((time.perf_counter() - t) * 1000)
+            resultados[nombre] = {
+                "n": len(muestras),
+                "p50_ms": round(statistics.median(muestras), 4),
+                "p95_ms": round(_percentil(muestras, 95), 4),
+                "max_ms": round(max(muestras), 4),
+            }
+    finally:
+        db.close_all_connections()
+        db.invalidate_recipe_graph()
+        db.set_read_cache_size(tam_cache)
+        db.DB_PATH = ruta_anterior
+    return {"datos": resumen, "resultados": resultados}
+
+
+def _imprimir(escala, informe):
+    print(f"\n=== Escala: {escala} ({informe['datos']['ingredientes']} ingredientes, "
+          f"{informe['datos']['recetas']} recetas, {informe['datos']['comidas']} comidas) ===")
+    print(f"{'función':<40}{'p50 ms':>12}{'p95 ms':>12}")
+    for nombre, r in informe["resultados"].items():
+        print(f"{nombre:<40}{r['p50_ms']:>12.3f}{r['p95_ms']:>12.3f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de src/db.py y src/logic.py")
+    parser.add_argument("--escalas", nargs="+", choices=generate_data.ESCALAS.keys(), default=["pequena"])
+    parser.add_argument("--repeticiones", type=int, default=50)
+    parser.add_argument("--salida", help="Fichero JSON con los resultados")
+    parser.add_argument("--cache-lecturas", action="store_true",
+                        help="Medir con la caché de lecturas de db.py activa")
+    args = parser.parse_args(argv)
+
+    casos = _casos()
+    faltan = _sin_caso(casos)
+    if faltan:
+        print(f"Aviso: funciones públicas sin benchmark: {', '.join(faltan)}")
+
+    informe = {
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "repeticiones": args.repeticiones,
+        "escalas": {},
+    }
+    with tempfile.TemporaryDirectory() as directorio:
+        for escala in args.escalas:
+            informe["escalas"][escala] = run_scale(escala, args.repeticiones, directorio, args.cache_lecturas)
+            _imprimir(escala, informe["escalas"][escala])
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(informe, f, indent=2, ensure_ascii=False)
+        print(f"\nResultados guardados en {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
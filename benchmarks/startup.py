@@ -0,0 +1,108 @@
+"""
+Arranque en frío de la aplicación, medido en un proceso nuevo.
+
+    python -m benchmarks.startup [--presupuesto-ms 1000] [--top 15] [--salida arranque.json]
+
+Ejecuta el primer render de una sesión en modo lectura (AppTest sobre app.py,
+con una copia temporal de la base de datos de la aplicación: el arranque migra
+y mantiene la base de datos, y data/planner.db no se toca) bajo
+``python -X importtime`` y resume:
+
+- el tiempo del primer render frente al presupuesto (por defecto
+  profiling.STARTUP_BUDGET_MS), que es lo que paga cada sesión nueva;
+- el coste de importación agrupado por paquete raíz (suma de los tiempos
+  propios de sus módulos), para ver qué arrastra el arranque.
+
+Sale con código 1 si el primer render supera el presupuesto.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from src import profiling
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_HIJO = """
+import json, sys, time
+t0 = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+t1 = time.perf_counter()
+at = AppTest.from_file("app.py", default_timeout=120)
+at.secrets["CLAVE_EDITOR"] = "arranque"
+at.run()
+t2 = time.perf_counter()
+print(json.dumps({
+    "importar_streamlit_ms": (t1 - t0) * 1000,
+    "primer_render_ms": (t2 - t1) * 1000,
+    "errores": [str(e.value) for e in at.exception],
+    "pandas_cargado": "pandas" in sys.modules,
+}))
+"""
+
+
+def parse_importtime(texto):
+    """{paquete raíz: ms} sumando el tiempo propio de cada módulo (salida de -X importtime)"""
+    por_paquete = {}
+    for linea in texto.splitlines():
+        if not linea.startswith("import time:") or "self [us]" in linea:
+            continue
+        _, propio, _, nombre = (parte.strip() for parte in linea.replace("import time:", "|", 1).split("|"))
+        raiz = nombre.split(".")[0]
+        por_paquete[raiz] = por_paquete.get(raiz, 0.0) + int(propio) / 1000
+    return por_paquete
+
+
+def measure():
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, "planner.db")
+        original = os.path.join(RAIZ, "data", "planner.db")
+        if os.path.exists(original):
+            shutil.copyfile(original, ruta)
+        entorno = dict(os.environ, FOODCALENDAR_DB_PATH=ruta)
+        proceso = subprocess.run([sys.executable, "-X", "importtime", "-c", _HIJO], cwd=RAIZ,
+                                 env=entorno, capture_output=True, text=True)
+    ultima = proceso.stdout.strip().splitlines()[-1] if proceso.stdout.strip() else ""
+    try:
+        resultado = json.loads(ultima)
+    except ValueError:
+        raise RuntimeError(f"El render de prueba falló:\n{proceso.stderr[-2000:]}")
+    resultado["importaciones_ms"] = parse_importtime(proceso.stderr)
+    return resultado
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Arranque en frío de app.py frente a un presupuesto")
+    parser.add_argument("--presupuesto-ms", type=float, default=profiling.STARTUP_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--salida", help="Fichero JSON con los resultados")
+    args = parser.parse_args(argv)
+
+    resultado = measure()
+    resultado["presupuesto_ms"] = args.presupuesto_ms
+    importaciones = sorted(resultado["importaciones_ms"].items(), key=lambda kv: -kv[1])
+
+    print(f"{'paquete':<30} {'ms':>9}")
+    for paquete, ms in importaciones[:args.top]:
+        print(f"{paquete:<30} {ms:>9.1f}")
+    print(f"{'(total importaciones)':<30} {sum(ms for _, ms in importaciones):>9.1f}")
+    print()
+    print(f"importar streamlit: {resultado['importar_streamlit_ms']:.0f} ms")
+    print(f"primer render:      {resultado['primer_render_ms']:.0f} ms "
+          f"(presupuesto {args.presupuesto_ms:g} ms, pandas cargado: {resultado['pandas_cargado']})")
+    for error in resultado["errores"]:
+        print(f"error en el render: {error}", file=sys.stderr)
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+    if resultado["errores"] or resultado["primer_render_ms"] > args.presupuesto_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+"""
+Uso sin interfaz: tareas programadas, mantenimiento y planificación por script.
+
+    python -m src plan --desde 2026-01-05 --semanas 2
+    python -m src plan --asignar 2026-01-05 Cena "Lentejas" --raciones 2
+    python -m src shopping-list --desde 2026-01-05 --json
+    python -m src maintenance backup copia.db.gz
+    python -m src maintenance export recetas csv > recetas.csv
+    python -m src stats
+    python -m src --hogar garcia plan
+    python -m src households create garcia
+    python -m src households backup copias/
+
+Solo usa la biblioteca estándar (ni Streamlit ni pandas) y devuelve lo mismo
+que muestran las vistas.
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import date, timedelta
+
+from src import db, households, logic
+
+
+def _fecha(texto):
+    try:
+        return date.fromisoformat(texto)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"fecha no válida (AAAA-MM-DD): {texto}")
+
+
+def _entero(minimo):
+    def convertir(texto):
+        try:
+            valor = int(texto)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"no es un número entero: {texto}")
+        if valor < minimo:
+            raise argparse.ArgumentTypeError(f"tiene que ser {minimo} o más: {texto}")
+        return valor
+    return convertir
+
+
+def _rango(args):
+    # Como las vistas: semanas completas de lunes a domingo
+    inicio = logic.get_start_of_week(args.desde or date.today())
+    return inicio, inicio + timedelta(days=7 * getattr(args, "semanas", 1) - 1)
+
+
+def _emitir(args, filas, texto):
+    """Salida en JSON (lista de objetos) o en líneas de texto"""
+    if args.json:
+        json.dump(filas, sys.stdout, ensure_ascii=False, indent=1, default=str)
+        sys.stdout.write("\n")
+    else:
+        for linea in texto:
+            print(linea)
+
+
+# --- plan ---
+def cmd_plan(args):
+    if args.asignar:
+        fecha, momento, receta = args.asignar
+        fecha = _fecha(fecha)
+        if momento not in logic.MOMENTOS:
+            sys.exit(f"Momento desconocido: {momento} (válidos: {', '.join(logic.MOMENTOS)})")
+        receta_id = None
+        if receta:
+            ids = {nombre: id_rec for id_rec, nombre in db.get_all_recipes()}
+            if receta not in ids:
+                sys.exit(f"Receta desconocida: {receta}")
+            receta_id = ids[receta]
+        with db.transaction():
+            db.save_meal_plan(fecha, momento, receta_id)
+            if args.raciones is not None:
+                db.save_meal_servings(fecha, momento, args.raciones)
+        return
+
+    inicio, fin = _rango(args)
+    if args.archivo:
+        from src import archive
+        filas = [{"fecha": fecha, "momento": momento, "receta": receta, "raciones": raciones}
+                 for fecha, momento, receta, raciones in archive.get_archived_plan(inicio, fin)]
+        _emitir(args, filas, (f"{f['fecha']}  {f['momento']:<15} {f['receta']}" for f in filas))
+        return
+    raciones = db.get_plan_range_servings(inicio, fin)
+    orden = {momento: i for i, momento in enumerate(logic.MOMENTOS)}
+    filas = [{"fecha": fecha, "momento": momento, "receta": receta,
+              "raciones": raciones.get((fecha, momento), 1.0)}
+             for fecha, momento, _, receta in sorted(db.get_plan_range_details(inicio, fin),
+                                                     key=lambda r: (r[0], orden.get(r[1], 99)))]
+    _emitir(args, filas, (f"{f['fecha']}  {f['momento']:<15} {f['receta']}"
+                          + (f"  (x{f['raciones']:g})" if f["raciones"] != 1 else "") for f in filas))
+
+
+# --- shopping-list ---
+def cmd_shopping_list(args):
+    inicio, fin = _rango(args)
+    semana = inicio
+    if args.vaciar:
+        db.clear_shopping_status(semana)
+    if args.marcar:
+        ids = {nombre: id_ing for id_ing, nombre, _ in db.get_all_ingredients()}
+        desconocidos = [n for n in args.marcar if n not in ids]
+        if desconocidos:
+            sys.exit(f"Ingredientes desconocidos: {', '.join(desconocidos)}")
+        db.update_shopping_statuses(semana, {ids[n]: True for n in args.marcar})
+
+    agregado = db.get_shopping_aggregate(inicio, fin)
+    estado = db.get_shopping_status(semana)
+    cantidades = {}
+    for ing_id, _, _, _, total, unidad in logic.aggregate_quantities_plain(
+            db.get_recipe_servings(inicio, fin), db.get_recipe_links(), db.get_all_ingredients()):
+        texto = logic.format_quantity(total, unidad)
+        if texto:
+            cantidades.setdefault(ing_id, []).append(texto)
+
+    filas = [{"ingrediente": nombre, "categoria": categoria or "Otros", "veces": veces,
+              "cantidad": " + ".join(cantidades.get(ing_id, [])), "comprado": estado.get(ing_id, False)}
+             for ing_id, nombre, categoria, veces in agregado]
+
+    def texto():
+        categoria = None
+        for f in filas:
+            if f["categoria"] != categoria:
+                categoria = f["categoria"]
+                yield f"\n{categoria}"
+            detalle = f"x{f['veces']}" + (f" · {f['cantidad']}" if f["cantidad"] else "")
+            yield f"  [{'x' if f['comprado'] else ' '}] {f['ingrediente']} ({detalle})"
+        comprados = sum(f["comprado"] for f in filas)
+        yield f"\n{comprados} de {len(filas)} comprados ({inicio} a {fin})"
+
+    _emitir(args, filas, texto())
+
+
+# --- maintenance ---
+def cmd_maintenance(args):
+    accion = args.accion
+    if accion == "backup":
+        from src import backup
+        with open(args.fichero, "wb") as destino:
+            backup.create_backup(destino, comprimir=args.fichero.endswith(".gz"))
+    elif accion == "restore":
+        from src import backup
+        try:
+            with open(args.fichero, "rb") as origen:
+                backup.restore_backup(origen)
+        except backup.BackupError as e:
+            sys.exit(f"No se restauró la copia: {e}")
+    elif accion == "verify":
+        diferencias = db.verify_weekly_shopping()
+        if diferencias and args.reparar:
+            db.rebuild_weekly_shopping()
+        print(f"{len(diferencias)} diferencias en la lista materializada"
+              + (" (corregidas)" if diferencias and args.reparar else ""))
+        if diferencias and not args.reparar:
+            sys.exit(1)
+    elif accion == "integrity":
+        with db.get_connection() as conn:
+            resultado = [r[0] for r in conn.execute("PRAGMA integrity_check")]
+        print("\n".join(resultado))
+        if resultado != ["ok"]:
+            sys.exit(1)
+    elif accion == "vacuum":
+        if args.completo:
+            # De paso deja la base de datos con auto_vacuum incremental
+            if not db.enable_incremental_vacuum():
+                with db.get_connection() as conn:
+                    conn.execute("VACUUM")
+        else:
+            from src import archive
+            print(f"{archive.reclaim_space()} pasos de incremental_vacuum")
+            if not archive.get_archive_stats()["auto_vacuum_incremental"]:
+                print("Sin auto_vacuum incremental: activarlo una vez con 'maintenance vacuum --completo'")
+    elif accion == "archive":
+        from src import archive
+        resultado = archive.run_maintenance(archive.RETENTION_WEEKS if args.semanas is None else args.semanas)
+        print(f"{resultado['comidas']} comidas y {resultado['compras']} casillas archivadas en "
+              f"{archive.archive_path()} ({resultado['pasos_vacuum']} pasos de incremental_vacuum)")
+    elif accion == "export":
+        from src import transfer
+        transfer.write_export(args.tipo, args.formato, sys.stdout, args.desde, args.hasta)
+    elif accion == "import":
+        from src import transfer
+        formato = args.formato or ("jsonl" if args.fichero.endswith(".jsonl") else "csv")
+        with open(args.fichero, encoding="utf-8-sig", newline="") as origen:
+            resultado = transfer.import_file(args.tipo, formato, origen)
+        for linea, motivo in resultado["errores"]:
+            print(f"línea {linea}: {motivo}", file=sys.stderr)
+        print(f"{resultado['importadas']} de {resultado['filas']} filas importadas, "
+              f"{resultado['total_errores']} con errores")
+        if resultado["total_errores"]:
+            sys.exit(1)
+
+
+# --- stats ---
+def cmd_stats(args):
+    with db.get_connection() as conn:
+        filas = {tabla: conn.execute(f"SELECT COUNT(*) FROM {tabla}").fetchone()[0]
+                 for tabla in ("ingredientes", "recetas", "receta_ingredientes", "planificacion",
+                               "compras_estado")}
+        primera, ultima = conn.execute("SELECT MIN(fecha), MAX(fecha) FROM planificacion").fetchone()
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+    datos = {
+        "ruta": db.get_db_path(),
+        "bytes": os.path.getsize(db.get_db_path()),
+        "version_esquema": version,
+        "filas": filas,
+        "plan_desde": primera,
+        "plan_hasta": ultima,
+    }
+    _emitir(args, datos, [f"{db.get_db_path()} ({datos['bytes'] / 1024:.0f} KiB, esquema v{version})",
+                          *(f"  {tabla:<20} {n}" for tabla, n in filas.items()),
+                          f"  plan: {primera or '-'} a {ultima or '-'}"])
+
+
+# --- households ---
+def cmd_households(args):
+    accion = args.accion
+    try:
+        if accion == "create":
+            for hogar in args.hogares:
+                print(f"{hogar}: {households.create_household(hogar)}")
+        elif accion == "list":
+            filas = households.list_households()
+            _emitir(args, filas, (f"{h['hogar']:<24} v{h['version_esquema']:<3} {h['bytes'] / 1024:>9.0f} KiB  "
+                                  f"{h['ruta']}" for h in filas))
+        elif accion == "migrate":
+            for hogar, (antes, despues) in households.migrate_households().items():
+                print(f"{hogar}: v{antes} -> v{despues}" if antes != despues else f"{hogar}: v{despues} (al día)")
+        elif accion == "backup":
+            for hogar, ruta in households.backup_households(args.directorio, args.hogares or None).items():
+                print(f"{hogar}: {ruta}")
+    except households.HouseholdError as e:
+        sys.exit(str(e))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m src", description="Planificador de comidas sin interfaz")
+    parser.add_argument("--db", help=f"Base de datos (por defecto {db.DB_PATH})")
+    parser.add_argument("--hogar", help="Hogar (ver 'households'): usa su base de datos en lugar de --db")
+    subs = parser.add_subparsers(dest="comando", required=True)
+
+    def con_rango(p, semanas=True):
+        p.add_argument("--desde", type=_fecha, help="Una fecha de la (primera) semana (por defecto, hoy)")
+        if semanas:
+            p.add_argument("--semanas", type=_entero(1), default=1)
+        p.add_argument("--json", action="store_true", help="Salida en JSON")
+
+    p = subs.add_parser("plan", help="Ver o asignar comidas")
+    con_rango(p)
+    p.add_argument("--asignar", nargs=3, metavar=("FECHA", "MOMENTO", "RECETA"),
+                   help='Asigna una receta ("" para vaciar la celda)')
+    p.add_argument("--raciones", type=float)
+    p.add_argument("--archivo", action="store_true", help="Consulta las semanas archivadas")
+    p.set_defaults(func=cmd_plan)
+
+    p = subs.add_parser("shopping-list", help="Lista de la compra de la semana")
+    con_rango(p, semanas=False)
+    p.add_argument("--marcar", nargs="+", metavar="INGREDIENTE", help="Marca ingredientes como comprados")
+    p.add_argument("--vaciar", action="store_true", help="Desmarca toda la semana")
+    p.set_defaults(func=cmd_shopping_list)
+
+    p = subs.add_parser("maintenance", help="Copias, verificación, importación y exportación")
+    acciones = p.add_subparsers(dest="accion", required=True)
+    a = acciones.add_parser("backup", help="Copia consistente (.db o .db.gz)")
+    a.add_argument("fichero")
+    a = acciones.add_parser("restore", help="Restaura una copia (.db o .db.gz)")
+    a.add_argument("fichero")
+    a = acciones.add_parser("verify", help="Comprueba la lista de la compra materializada")
+    a.add_argument("--reparar", action="store_true")
+    acciones.add_parser("integrity", help="PRAGMA integrity_check")
+    a = acciones.add_parser("vacuum", help="Devuelve el espacio libre por pasos")
+    a.add_argument("--completo", action="store_true",
+                   help="VACUUM completo, que además activa la recuperación por pasos (bloquea la base de datos)")
+    a = acciones.add_parser("archive", help="Mueve las semanas antiguas al archivo")
+    a.add_argument("--semanas", type=_entero(0), default=None,
+                   help="Semanas a conservar (por defecto RETENTION_WEEKS; 0 no archiva, solo recupera espacio)")
+    a = acciones.add_parser("export", help="Exporta a la salida estándar")
+    a.add_argument("tipo", choices=("ingredientes", "recetas", "plan"))
+    a.add_argument("formato", choices=("csv", "jsonl"))
+    a.add_argument("--desde", type=_fecha)
+    a.add_argument("--hasta", type=_fecha)
+    a = acciones.add_parser("import", help="Importa un fichero CSV o JSON Lines")
+    a.add_argument("tipo", choices=("ingredientes", "recetas", "plan"))
+    a.add_argument("fichero")
+    a.add_argument("--formato", choices=("csv", "jsonl"))
+    p.set_defaults(func=cmd_maintenance)
+
+    p = subs.add_parser("stats", help="Tamaño y contenido de la base de datos")
+    p.add_argument("--json", action="store_true", help="Salida en JSON")
+    p.set_defaults(func=cmd_stats)
+
+    p = subs.add_parser("households", help="Hogares: una base de datos por hogar")
+    acciones = p.add_subparsers(dest="accion", required=True)
+    a = acciones.add_parser("create", help="Crea hogares nuevos con el esquema al día")
+    a.add_argument("hogares", nargs="+", metavar="HOGAR")
+    a = acciones.add_parser("list", help="Hogares, versión del esquema y tamaño")
+    a.add_argument("--json", action="store_true", help="Salida en JSON")
+    acciones.add_parser("migrate", help="Aplica las migraciones pendientes a todos los hogares")
+    a = acciones.add_parser("backup", help="Copia .db.gz de cada hogar en un directorio")
+    a.add_argument("directorio")
+    a.add_argument("--hogares", nargs="+", metavar="HOGAR", help="Solo estos (por defecto, todos)")
+    p.set_defaults(func=cmd_households)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.comando == "households":
+        # Trabaja sobre los ficheros de los hogares, no sobre la base de datos por defecto
+        args.func(args)
+        return
+    if args.hogar:
+        try:
+            db.DB_PATH = households.resolve(args.hogar)
+        except households.HouseholdError as e:
+            sys.exit(str(e))
+    elif args.db:
+        db.DB_PATH = args.db
+    directorio = os.path.dirname(db.DB_PATH)
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+    db.init_db()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
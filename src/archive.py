@@ -0,0 +1,273 @@
+"""
+Archivo de semanas antiguas y recuperación de espacio por pasos.
+
+Las semanas anteriores al corte de retención (``RETENTION_WEEKS`` semanas
+antes de la actual) se copian a una base de datos aparte, compacta y con los
+nombres ya resueltos, y después se borran de la principal. Se hace por lotes
+de ``BATCH_WEEKS`` semanas: cada lote es una transacción corta, y como la
+copia usa INSERT OR REPLACE, repetir un lote interrumpido no duplica nada.
+
+El espacio que dejan los borrados se devuelve al sistema con
+db.incremental_vacuum en pasos pequeños, con pausas entre ellos, desde un
+hilo en segundo plano: nunca hay un VACUUM completo que bloquee a los usuarios.
+"""
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+
+from src import db, logic, migrations
+
+RETENTION_WEEKS = int(os.environ.get("FOODCALENDAR_RETENTION_WEEKS", "52"))
+BATCH_WEEKS = 4
+VACUUM_PAGES_PER_STEP = 64
+VACUUM_PAUSE = 0.05
+MAINTENANCE_INTERVAL = float(os.environ.get("FOODCALENDAR_MAINTENANCE_INTERVAL_S", "3600"))
+
+_ESQUEMA = [
+    '''CREATE TABLE IF NOT EXISTS plan_archivado
+       (fecha TEXT, momento TEXT, receta TEXT, raciones REAL,
+        PRIMARY KEY (fecha, momento)) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS compras_archivadas
+       (semana_inicio TEXT, ingrediente TEXT, comprado INTEGER,
+        PRIMARY KEY (semana_inicio, ingrediente)) WITHOUT ROWID''',
+]
+_EPOCH = date.fromisoformat(migrations.WEEK_EPOCH)
+
+
+def archive_path():
+    """El archivo vive junto a la base de datos activa: planner.db -> planner_archivo.db"""
+    return os.path.splitext(db.get_db_path())[0] + "_archivo.db"
+
+
+def _open_archive(crear=True):
+    ruta = archive_path()
+    if not crear and not os.path.exists(ruta):
+        return None
+    conn = sqlite3.connect(ruta)
+    for sql in _ESQUEMA:
+        conn.execute(sql)
+    return conn
+
+
+def cutoff(semanas=RETENTION_WEEKS, hoy=None):
+    """Lunes a partir del cual se conserva la planificación en la base de datos activa"""
+    return logic.get_start_of_week(hoy or date.today()) - timedelta(weeks=semanas)
+
+
+def _week_number(fecha):
+    # Como la columna compras_estado.semana
+    return (fecha - _EPOCH).days // 7
+
+
+def _week_start(numero):
+    return _EPOCH + timedelta(weeks=numero)
+
+
+def archive_before(corte, batch_weeks=BATCH_WEEKS):
+    """
+    Mueve al archivo la planificación y las casillas de la compra de las
+    semanas anteriores a ``corte`` (se redondea al lunes). Devuelve
+    {"comidas": n, "compras": m, "lotes": k}.
+    """
+    corte = logic.get_start_of_week(corte)
+    semana_corte = _week_number(corte)
+    resultado = {"comidas": 0, "compras": 0, "lotes": 0}
+    db.flush_writes()
+    archivo = None   # el fichero solo se crea si hay algo que archivar
+    try:
+        while True:
+            with db.get_connection() as conn:
+                primera_fecha = conn.execute("SELECT MIN(fecha) FROM planificacion WHERE fecha < ?",
+                                             (str(corte),)).fetchone()[0]
+                primera_semana = conn.execute("SELECT MIN(semana) FROM compras_estado WHERE semana < ?",
+                                              (semana_corte,)).fetchone()[0]
+            candidatas = []
+            if primera_fecha is not None:
+                candidatas.append(logic.get_start_of_week(date.fromisoformat(primera_fecha)))
+            if primera_semana is not None:
+                candidatas.append(_week_start(primera_semana))
+            if not candidatas:
+                return resultado
+
+            inicio = min(candidatas)
+            fin = min(inicio + timedelta(weeks=batch_weeks), corte)
+            rango_semanas = (_week_number(inicio), _week_number(fin))
+            # Lectura, copia y borrado con el bloqueo de escritura de la activa
+            # tomado (BEGIN IMMEDIATE): lo que otra sesión o la cola escriban en
+            # estas semanas espera y no se borra sin haberse copiado. La copia
+            # se confirma antes que el borrado; si algo falla entre medias, el
+            # siguiente intento copia lo mismo otra vez
+            with db.transaction() as conn:
+                comidas = conn.execute('''SELECT p.fecha, p.momento, r.nombre, p.raciones
+                                          FROM planificacion p LEFT JOIN recetas r ON r.id = p.receta_id
+                                          WHERE p.fecha >= ? AND p.fecha < ?''',
+                                       (str(inicio), str(fin))).fetchall()
+                compras = [(str(_week_start(semana)), nombre, comprado) for semana, nombre, comprado in conn.execute(
+                    '''SELECT ce.semana, i.nombre, ce.comprado
+                       FROM compras_estado ce JOIN ingredientes i ON i.id = ce.ingrediente_id
+                       WHERE ce.semana >= ? AND ce.semana < ?''', rango_semanas)]
+                if archivo is None:
+                    archivo = _open_archive()
+                with archivo:
+                    archivo.executemany("INSERT OR REPLACE INTO plan_archivado VALUES (?, ?, ?, ?)", comidas)
+                    archivo.executemany("INSERT OR REPLACE INTO compras_archivadas VALUES (?, ?, ?)", compras)
+                conn.execute("DELETE FROM planificacion WHERE fecha >= ? AND fecha < ?", (str(inicio), str(fin)))
+                conn.execute("DELETE FROM compras_estado WHERE semana >= ? AND semana < ?", rango_semanas)
+
+            resultado["comidas"] += len(comidas)
+            resultado["compras"] += len(compras)
+            resultado["lotes"] += 1
+    finally:
+        if archivo is not None:
+            archivo.close()
+
+
+def reclaim_space(max_pasos=None, paginas=VACUUM_PAGES_PER_STEP, pausa=VACUUM_PAUSE, parar=None):
+    """
+    Devuelve el espacio libre de la base de datos activa en pasos de ``paginas``
+    páginas, con ``pausa`` segundos entre pasos. Devuelve el número de pasos.
+    """
+    pasos = 0
+    anteriores = None
+    while max_pasos is None or pasos < max_pasos:
+        if parar is not None and parar.is_set():
+            break
+        libres = db.incremental_vacuum(paginas)
+        # Sin auto_vacuum incremental devuelve 0; y un paso que no libera nada
+        # (otra sesión ocupando páginas a la vez) tampoco sigue
+        if not libres or (anteriores is not None and libres >= anteriores):
+            break
+        anteriores = libres
+        pasos += 1
+        time.sleep(pausa)
+    if pasos:
+        # Las páginas libres no mueven la generación
+        _stats.pop(db.get_db_path(), None)
+    return pasos
+
+
+def run_maintenance(semanas=RETENTION_WEEKS, parar=None):
+    """Archiva lo anterior al corte (si ``semanas`` > 0) y recupera el espacio liberado"""
+    archivado = archive_before(cutoff(semanas)) if semanas > 0 else {"comidas": 0, "compras": 0, "lotes": 0}
+    archivado["pasos_vacuum"] = reclaim_space(parar=parar)
+    return archivado
+
+
+# --- Consultas sobre el archivo ---
+def get_archived_plan(start_date, end_date):
+    """[(fecha, momento, receta, raciones)...] archivadas en el rango"""
+    archivo = _open_archive(crear=False)
+    if archivo is None:
+        return []
+    try:
+        return archivo.execute('''SELECT fecha, momento, receta, raciones FROM plan_archivado
+                                  WHERE fecha BETWEEN ? AND ? ORDER BY fecha, momento''',
+                               (str(start_date), str(end_date))).fetchall()
+    finally:
+        archivo.close()
+
+
+def get_archived_shopping_status(semana_inicio):
+    """{ingrediente: comprado} de una semana archivada"""
+    archivo = _open_archive(crear=False)
+    if archivo is None:
+        return {}
+    try:
+        return {nombre: bool(comprado) for nombre, comprado in archivo.execute(
+            "SELECT ingrediente, comprado FROM compras_archivadas WHERE semana_inicio = ?",
+            (str(logic.get_start_of_week(semana_inicio)),))}
+    finally:
+        archivo.close()
+
+
+_stats = {}     # {ruta: (generacion, datos)}
+
+
+def get_archive_stats():
+    """
+    Tamaño y contenido del archivo, y páginas libres pendientes en la base
+    activa. Se recalcula solo cuando cambian los datos (archivar borra filas
+    de la activa) o tras devolver espacio.
+    """
+    generacion = db.get_data_generation()
+    guardado = _stats.get(db.get_db_path())
+    if guardado is not None and guardado[0] == generacion:
+        return guardado[1]
+    with db.get_connection() as conn:
+        libres = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        modo = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    datos = {"ruta": archive_path(), "bytes": 0, "comidas": 0, "desde": None, "hasta": None,
+             "paginas_libres": libres, "auto_vacuum_incremental": modo == 2}
+    archivo = _open_archive(crear=False)
+    if archivo is not None:
+        try:
+            datos["comidas"], datos["desde"], datos["hasta"] = archivo.execute(
+                "SELECT COUNT(*), MIN(fecha), MAX(fecha) FROM plan_archivado").fetchone()
+        finally:
+            archivo.close()
+        datos["bytes"] = os.path.getsize(archive_path())
+    _stats[db.get_db_path()] = (generacion, datos)
+    return datos
+
+
+# --- Hilo de mantenimiento ---
+_worker = None
+_worker_lock = threading.Lock()
+_stop = threading.Event()
+last_run = {}   # resultado y hora de la última pasada (para mostrarlo en la interfaz)
+
+
+def _maintain(semanas, ruta=None):
+    # Cada base de datos por separado: una que falle no deja sin mantenimiento
+    # a las demás. Antes se migra (un hogar puede llevar tiempo sin abrirse)
+    try:
+        with db.using_db(ruta or db.DB_PATH):
+            db.init_db()
+            resultado = run_maintenance(semanas, parar=_stop)
+        resultado["error"] = None
+    except Exception as e:
+        resultado = {"error": str(e)}
+    return resultado
+
+
+def _loop(intervalo, semanas):
+    from src import households
+
+    while not _stop.is_set():
+        resultado = _maintain(semanas)
+        # Cada hogar tiene su propio fichero (y su propio archivo)
+        try:
+            hogares, error_hogares = households.list_households(), None
+        except Exception as e:
+            hogares, error_hogares = [], str(e)
+        por_hogar = {}
+        for info in hogares:
+            if _stop.is_set():
+                break
+            por_hogar[info["hogar"]] = _maintain(semanas, info["ruta"])
+        last_run.clear()
+        last_run.update(resultado, hogares=por_hogar, error_hogares=error_hogares,
+                        momento=time.strftime("%Y-%m-%d %H:%M:%S"))
+        _stop.wait(intervalo)
+
+
+def start_background_maintenance(intervalo=MAINTENANCE_INTERVAL, semanas=RETENTION_WEEKS):
+    """Arranca (una sola vez por proceso) el hilo que archiva y recupera espacio cada ``intervalo`` s"""
+    global _worker
+    with _worker_lock:
+        if _worker is not None and _worker.is_alive():
+            return
+        _stop.clear()
+        _worker = threading.Thread(target=_loop, args=(intervalo, semanas), name="db-maintenance", daemon=True)
+        _worker.start()
+
+
+def stop_background_maintenance(timeout=5):
+    global _worker
+    with _worker_lock:
+        _stop.set()
+        if _worker is not None:
+            _worker.join(timeout)
+        _worker = None
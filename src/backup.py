@@ -0,0 +1,149 @@
+"""
+Copias de seguridad consistentes con la API de backup en línea de SQLite.
+
+La copia se hace por lotes de páginas desde una conexión del pool, sin bloquear
+a los escritores (en modo WAL los lectores no los bloquean, y entre lote y lote
+no se retiene ningún bloqueo). El resultado se comprime con gzip.
+
+La restauración descomprime a un fichero temporal, comprueba su integridad y
+solo entonces copia su contenido sobre la base de datos activa.
+"""
+import gzip
+import io
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from src import db, migrations
+
+PAGES_PER_STEP = 256
+SLEEP_BETWEEN_STEPS = 0.005
+CHUNK_SIZE = 1024 * 1024
+GZIP_MAGIC = b"\x1f\x8b"
+TABLAS_REQUERIDAS = {"ingredientes", "recetas", "receta_ingredientes", "planificacion"}
+
+
+class BackupError(Exception):
+    pass
+
+
+def _snapshot_to(path, pages=PAGES_PER_STEP, sleep=SLEEP_BETWEEN_STEPS):
+    destino = sqlite3.connect(path)
+    try:
+        with db.get_connection() as origen:
+            origen.backup(destino, pages=pages, sleep=sleep)
+    finally:
+        destino.close()
+
+
+def create_backup(dest_file, comprimir=True, pages=PAGES_PER_STEP, sleep=SLEEP_BETWEEN_STEPS):
+    """
+    Escribe en ``dest_file`` (objeto binario abierto) una copia consistente de la
+    base de datos, comprimida con gzip salvo que ``comprimir`` sea False.
+    La compresión se hace por bloques: en memoria solo hay un bloque cada vez.
+    """
+    fd, tmp = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        _snapshot_to(tmp, pages, sleep)
+        with open(tmp, "rb") as origen:
+            if comprimir:
+                with gzip.GzipFile(fileobj=dest_file, mode="wb", compresslevel=6) as gz:
+                    shutil.copyfileobj(origen, gz, CHUNK_SIZE)
+            else:
+                shutil.copyfileobj(origen, dest_file, CHUNK_SIZE)
+    finally:
+        os.remove(tmp)
+
+
+def create_backup_bytes(comprimir=True):
+    """Copia completa como bytes (para st.download_button con datos diferidos)"""
+    salida = io.BytesIO()
+    create_backup(salida, comprimir=comprimir)
+    return salida.getvalue()
+
+
+def check_database_file(path):
+    """Comprueba integridad y esquema de un fichero .db; lanza BackupError si no vale"""
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    except sqlite3.Error as e:
+        raise BackupError(f"No se puede abrir la copia: {e}")
+    try:
+        resultado = conn.execute("PRAGMA integrity_check").fetchall()
+        if resultado != [("ok",)]:
+            raise BackupError("La copia está dañada: " + "; ".join(r[0] for r in resultado[:5]))
+        tablas = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        faltan = TABLAS_REQUERIDAS - tablas
+        if faltan:
+            raise BackupError(f"La copia no es del planificador (faltan tablas: {', '.join(sorted(faltan))})")
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version > migrations.SCHEMA_VERSION:
+            raise BackupError(f"La copia es de una versión más nueva del esquema ({version})")
+        if conn.execute("PRAGMA foreign_key_check").fetchone() is not None:
+            raise BackupError("La copia tiene referencias rotas entre tablas")
+    except sqlite3.DatabaseError as e:
+        raise BackupError(f"La copia no es una base de datos SQLite válida: {e}")
+    finally:
+        conn.close()
+
+
+def restore_backup(src_file):
+    """
+    Restaura desde ``src_file`` (objeto binario abierto, .db o .db.gz).
+    Solo se toca la base de datos activa si la copia supera las comprobaciones.
+    """
+    fd, tmp = tempfile.mkstemp(suffix=".db")
+    try:
+        cabecera = src_file.read(2)
+        with os.fdopen(fd, "wb") as destino:
+            if cabecera == GZIP_MAGIC:
+                resto = io.BufferedReader(_Prefixed(cabecera, src_file))
+                try:
+                    with gzip.GzipFile(fileobj=resto, mode="rb") as gz:
+                        shutil.copyfileobj(gz, destino, CHUNK_SIZE)
+                except (OSError, EOFError) as e:
+                    raise BackupError(f"El fichero comprimido está dañado: {e}")
+            else:
+                destino.write(cabecera)
+                shutil.copyfileobj(src_file, destino, CHUNK_SIZE)
+
+        check_database_file(tmp)
+
+        # Se vacía la cola de escrituras y se copia página a página sobre la base
+        # activa: las demás conexiones ven el cambio de forma atómica
+        db.flush_writes()
+        origen = sqlite3.connect(tmp)
+        try:
+            with db.get_connection() as conn:
+                origen.backup(conn)
+        finally:
+            origen.close()
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    # Copias antiguas: se llevan al esquema actual y se descartan las cachés
+    db.reset_after_restore()
+
+
+class _Prefixed(io.RawIOBase):
+    """Fichero de solo lectura que antepone unos bytes ya leídos"""
+
+    def __init__(self, prefijo, resto):
+        self._prefijo = prefijo
+        self._resto = resto
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._prefijo:
+            n = min(len(buffer), len(self._prefijo))
+            buffer[:n] = self._prefijo[:n]
+            self._prefijo = self._prefijo[n:]
+            return n
+        datos = self._resto.read(len(buffer))
+        buffer[:len(datos)] = datos
+        return len(datos)
@@ -1,200 +1,1043 @@
+import atexit
+import functools
+import os
+import random
+import re
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import date
 
-DB_PATH = 'data/planner.db'
+from src import instrumentation, migrations
+from src.graph import RecipeGraph
+from src.read_cache import ReadCache
+from src.write_queue import WriteQueue
+
+DB_PATH = os.environ.get("FOODCALENDAR_DB_PATH", 'data/planner.db')
+
+# --- GESTIÓN DE CONEXIONES ---
+# Perfiles de PRAGMAs que se aplican una sola vez al abrir cada conexión del pool
+DB_PROFILES = {
+    "default": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16000,       # ~16 MB (valor negativo = KiB)
+        "mmap_size": 64 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+    "safe": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "cache_size": -8000,
+        "mmap_size": 0,
+        "temp_store": "DEFAULT",
+    },
+    "fast": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "cache_size": -64000,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+}
+
+DB_PROFILE = os.environ.get("FOODCALENDAR_DB_PROFILE", "default")
+POOL_SIZE = int(os.environ.get("FOODCALENDAR_DB_POOL_SIZE", "4"))
+# Con varios hogares (src/households.py) cada uno tiene su fichero: como mucho
+# MAX_OPEN_SHARDS pools abiertos a la vez, se cierra el menos usado
+MAX_OPEN_SHARDS = int(os.environ.get("FOODCALENDAR_MAX_OPEN_SHARDS", "16"))
+
+# Varias sesiones escriben a la vez: SQLite espera hasta BUSY_TIMEOUT_MS a que
+# se libere el bloqueo de escritura y, si sigue ocupado, se reintenta hasta
+# LOCK_RETRIES veces con espera exponencial (con algo de azar para que los
+# hilos no vuelvan a chocar a la vez). Agotados los reintentos, DatabaseBusyError
+BUSY_TIMEOUT_MS = int(os.environ.get("FOODCALENDAR_BUSY_TIMEOUT_MS", "2000"))
+LOCK_RETRIES = int(os.environ.get("FOODCALENDAR_LOCK_RETRIES", "4"))
+LOCK_BACKOFF_S = 0.05
+LOCK_BACKOFF_MAX_S = 1.0
+
+_pools = OrderedDict()   # LRU {ruta: ConnectionPool}
+_pools_lock = threading.Lock()
+_local = threading.local()
+_path_resolver = None
+
+
+def get_db_path():
+    """
+    Base de datos de la llamada actual: la fijada con using_db() en este hilo,
+    si no la que diga el resolutor (la del hogar de la sesión) y si no DB_PATH.
+    """
+    ruta = getattr(_local, "db_path", None)
+    if ruta is None and _path_resolver is not None:
+        ruta = _path_resolver()
+    return ruta or DB_PATH
+
+
+def set_db_path_resolver(resolver):
+    """
+    ``resolver()`` devuelve la ruta de la base de datos del contexto actual
+    (o None para DB_PATH). La interfaz lo usa para que callbacks y fragmentos,
+    que no pasan por el principio de app.py, escriban en el hogar de su sesión.
+    """
+    global _path_resolver
+    _path_resolver = resolver
+
+
+@contextmanager
+def using_db(ruta):
+    """Todas las llamadas a db.py del bloque (en este hilo) van a ``ruta``"""
+    anterior = getattr(_local, "db_path", None)
+    if getattr(_local, "conn", None) is not None and ruta != get_db_path():
+        raise RuntimeError("No se puede cambiar de base de datos con una conexión prestada")
+    _local.db_path = ruta
+    try:
+        yield ruta
+    finally:
+        _local.db_path = anterior
+
+
+def _open_connection(path, profile):
+    # check_same_thread=False: las conexiones del pool pasan de un hilo a otro
+    # (Streamlit ejecuta cada rerun en un hilo distinto), pero nunca se usan
+    # desde dos hilos a la vez.
+    factory = instrumentation.InstrumentedConnection if instrumentation.enabled else sqlite3.Connection
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False, factory=factory)
+    conn.execute("PRAGMA foreign_keys = ON")
+    # Los triggers de compra_semanal deben verse también en los borrados
+    # implícitos de INSERT OR REPLACE
+    conn.execute("PRAGMA recursive_triggers = ON")
+    for pragma, value in DB_PROFILES[profile].items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+    return conn
+
+
+class ConnectionPool:
+    """Pool acotado de conexiones reutilizables a un mismo fichero SQLite"""
+
+    def __init__(self, path, profile="default", size=4):
+        if profile not in DB_PROFILES:
+            raise ValueError(f"Perfil de base de datos desconocido: {profile}")
+        self.path = path
+        self.profile = profile
+        self.size = max(1, size)
+        self._idle = []
+        self._all = []
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise sqlite3.ProgrammingError("El pool de conexiones está cerrado")
+                if self._idle:
+                    return self._idle.pop()
+                if len(self._all) < self.size:
+                    conn = _open_connection(self.path, self.profile)
+                    self._all.append(conn)
+                    return conn
+                self._cond.wait()
+
+    def release(self, conn):
+        # Una conexión nunca vuelve al pool con una transacción a medias
+        if conn.in_transaction:
+            conn.rollback()
+        with self._cond:
+            if self._closed:
+                conn.close()
+                return
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            for conn in self._idle:
+                conn.close()
+            self._all = [c for c in self._all if c not in self._idle]
+            self._idle = []
+            self._cond.notify_all()
+
+
+def _get_pool():
+    ruta = get_db_path()
+    with _pools_lock:
+        pool = _pools.get(ruta)
+        if pool is None:
+            pool = ConnectionPool(ruta, DB_PROFILE, POOL_SIZE)
+            _pools[ruta] = pool
+        _pools.move_to_end(ruta)
+        cerrar = [_pools.popitem(last=False) for _ in range(len(_pools) - max(1, MAX_OPEN_SHARDS))]
+    for ruta_vieja, pool_viejo in cerrar:
+        _evict_shard(ruta_vieja, pool_viejo)
+    return pool
+
+
+def _evict_shard(ruta, pool):
+    # Las conexiones prestadas se cierran al devolverse. Lo que se cacheó de
+    # este fichero deja de valer: sin vigilante, otro proceso podría cambiarlo
+    pool.close()
+    with _watchers_lock:
+        vigilante = _watchers.pop(ruta, None)
+    if vigilante is not None:
+        vigilante[0].close()
+    _recipe_graphs.pop(ruta, None)
+    _bump_generation(ruta=ruta)
+
+
+def get_open_shards():
+    """Rutas con pool abierto, de la menos a la más usada recientemente"""
+    with _pools_lock:
+        return list(_pools)
+
+
+@contextmanager
+def get_connection():
+    """
+    Presta una conexión del pool durante el bloque ``with``.
+    Las llamadas anidadas en el mismo hilo reutilizan la misma conexión.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        yield conn
+        return
+
+    # Read-your-writes: si esta sesión tiene escrituras en cola, se esperan
+    if _write_queue is not None:
+        wait_for_own_writes()
+
+    while True:
+        pool = _get_pool()
+        try:
+            conn = pool.acquire()
+            break
+        except sqlite3.ProgrammingError:
+            # El pool se cerró (desalojado del LRU) antes de conseguir conexión:
+            # con más ficheros activos que MAX_OPEN_SHARDS puede pasar varias veces
+            continue
+    _local.conn = conn
+    try:
+        yield conn
+    finally:
+        _local.conn = None
+        pool.release(conn)
+
+
+class DatabaseBusyError(sqlite3.OperationalError):
+    """El bloqueo de escritura siguió ocupado tras todos los reintentos: la escritura no se hizo"""
+
+
+class ConflictError(Exception):
+    """
+    Escritura compare-and-set rechazada: otra sesión cambió la fila desde que
+    se leyó. ``actual`` es el valor que tiene ahora y ``version`` su versión.
+    """
+
+    def __init__(self, mensaje, actual=None, version=0):
+        super().__init__(mensaje)
+        self.actual = actual
+        self.version = version
+
+
+_lock_stats = {"reintentos": 0, "agotados": 0, "conflictos": 0}
+_lock_stats_lock = threading.Lock()
+
+
+def _count_lock_stat(nombre):
+    with _lock_stats_lock:
+        _lock_stats[nombre] += 1
+
+
+def get_lock_stats():
+    """Reintentos por bloqueo, escrituras abandonadas y conflictos de versión desde el arranque"""
+    with _lock_stats_lock:
+        return dict(_lock_stats)
+
+
+def _is_busy(error):
+    mensaje = str(error).lower()
+    return "locked" in mensaje or "busy" in mensaje
+
+
+def _retry_busy(accion):
+    """Ejecuta ``accion()`` reintentando con espera exponencial mientras la base de datos esté bloqueada"""
+    for intento in range(LOCK_RETRIES + 1):
+        try:
+            return accion()
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e):
+                raise
+            if intento == LOCK_RETRIES:
+                _count_lock_stat("agotados")
+                raise DatabaseBusyError(f"Base de datos ocupada tras {LOCK_RETRIES} reintentos: {e}") from e
+            _count_lock_stat("reintentos")
+            time.sleep(min(LOCK_BACKOFF_MAX_S, LOCK_BACKOFF_S * 2 ** intento) * random.uniform(0.5, 1))
+
+
+# Contador de generación: sube cada vez que se confirma una transacción que
+# ha modificado filas. Las cachés lo usan para saber si sus datos siguen valiendo.
+# El de planificación no sube cuando lo único que cambia es compras_estado
+# (marcar casillas de la compra), así que las cachés de planificación, recetas
+# y agregados sobreviven a toda una sesión de compra.
+# Hay un par por fichero: escribir en un hogar no invalida las cachés de otro
+_generations = {}   # {ruta: [generacion, generacion_plan]}
+_generation_lock = threading.Lock()
+
+# Cambios hechos por otros procesos (otra instancia, scripts): se detectan con
+# PRAGMA data_version sobre una conexión aparte, como mucho cada N segundos
+EXTERNAL_CHECK_SECONDS = float(os.environ.get("FOODCALENDAR_EXTERNAL_CHECK_S", "1"))
+_watchers = {}      # {ruta: [conexion, data_version, ultima_comprobacion]}
+_watchers_lock = threading.Lock()
+
+
+def _watcher_changed():
+    # Llamar con _watchers_lock: True si alguien ha confirmado cambios desde la última vez
+    ruta = get_db_path()
+    vigilante = _watchers.get(ruta)
+    try:
+        if vigilante is None:
+            conn = sqlite3.connect(ruta, check_same_thread=False)
+            version = conn.execute("PRAGMA data_version").fetchone()[0]
+            _watchers[ruta] = [conn, version, time.monotonic()]
+            return False
+        version = vigilante[0].execute("PRAGMA data_version").fetchone()[0]
+    except sqlite3.Error:
+        return False
+    vigilante[2] = time.monotonic()
+    if version == vigilante[1]:
+        return False
+    vigilante[1] = version
+    return True
+
+
+def _check_external_changes():
+    with _watchers_lock:
+        vigilante = _watchers.get(get_db_path())
+        if vigilante is not None and time.monotonic() - vigilante[2] < EXTERNAL_CHECK_SECONDS:
+            return
+        cambiado = _watcher_changed()
+    if cambiado:
+        _external_change()
+
+
+def _external_change():
+    # Otro proceso confirmó cambios: ni la caché ni el índice en memoria valen.
+    # El índice se descarta entero (quien lo esté leyendo sigue con el suyo)
+    _recipe_graphs.pop(get_db_path(), None)
+    _bump_generation()
+
+
+def _commit_own(conn):
+    """
+    COMMIT de este proceso sin que el vigilante lo confunda con un cambio
+    externo. Se llama con el bloqueo de escritura tomado, así que nadie más
+    puede confirmar entre la primera comprobación y el COMMIT. Devuelve True
+    si antes había cambios externos sin ver.
+    """
+    with _watchers_lock:
+        externo = _watcher_changed()
+        conn.commit()
+        # Un COMMIT ajeno justo entre estas dos líneas se tomaría por propio;
+        # el siguiente cambio de cualquiera lo corrige
+        _watcher_changed()
+    return externo
+
+
+def get_data_generation():
+    _check_external_changes()
+    return _generations.get(get_db_path(), (0, 0))[0]
+
+
+def get_plan_generation():
+    _check_external_changes()
+    return _generations.get(get_db_path(), (0, 0))[1]
+
+
+def _bump_generation(plan=True, ruta=None):
+    with _generation_lock:
+        contadores = _generations.setdefault(ruta or get_db_path(), [0, 0])
+        contadores[0] += 1
+        if plan:
+            contadores[1] += 1
+
+
+def _in_transaction():
+    return getattr(_local, "tx_depth", 0) > 0
+
+
+@contextmanager
+def transaction(immediate=True):
+    """
+    Unidad de trabajo: todas las funciones de db.py llamadas dentro del bloque
+    comparten la conexión y se confirman con un único COMMIT (un solo fsync) al
+    salir. Si el bloque lanza una excepción se deshace todo.
+
+        with db.transaction():
+            db.update_recipe(...)
+            db.save_meal_plan(...)
+
+    Los bloques anidados se convierten en SAVEPOINTs, de modo que un fallo
+    interno solo deshace su propia parte.
+    """
+    with get_connection() as conn:
+        depth = getattr(_local, "tx_depth", 0)
+        if depth == 0:
+            if conn.in_transaction:
+                conn.commit()
+            # IMMEDIATE reserva el bloqueo de escritura desde el principio: con
+            # él tomado, nada del bloque puede fallar por "database is locked"
+            _retry_busy(lambda: conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN"))
+            cambios_previos = conn.total_changes
+            _local.status_changes = 0
+        else:
+            conn.execute(f"SAVEPOINT tx_{depth}")
+        _local.tx_depth = depth + 1
+        try:
+            yield conn
+        except BaseException:
+            if depth == 0:
+                conn.rollback()
+                # El índice en memoria pudo recibir cambios de pasos ya deshechos
+                _recipe_graph().clear()
+            else:
+                conn.execute(f"ROLLBACK TO tx_{depth}")
+                conn.execute(f"RELEASE tx_{depth}")
+            raise
+        else:
+            if depth == 0:
+                cambios = conn.total_changes - cambios_previos
+                if cambios:
+                    if _commit_own(conn):
+                        _external_change()
+                    else:
+                        _bump_generation(plan=cambios > _local.status_changes)
+                else:
+                    conn.commit()
+            else:
+                conn.execute(f"RELEASE tx_{depth}")
+        finally:
+            _local.tx_depth = depth
+
+
+def _atomic():
+    # Cada función de escritura es atómica por sí sola; dentro de
+    # db.transaction() se une a la transacción abierta. IMMEDIATE: una
+    # transacción diferida que lee y luego escribe puede encontrarse el
+    # bloqueo tomado sin que SQLite espere (SQLITE_BUSY inmediato)
+    return transaction()
+
+
+def configure_db(profile=None, pool_size=None):
+    """Cambia el perfil de PRAGMAs y/o el tamaño del pool (cierra los pools abiertos)"""
+    global DB_PROFILE, POOL_SIZE
+    if profile is not None:
+        if profile not in DB_PROFILES:
+            raise ValueError(f"Perfil de base de datos desconocido: {profile}")
+        DB_PROFILE = profile
+    if pool_size is not None:
+        POOL_SIZE = pool_size
+    close_all_connections()
+
+
+def close_all_connections():
+    """Cierra todas las conexiones abiertas (llamar al apagar la aplicación)"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+    with _watchers_lock:
+        for conn, _, _ in _watchers.values():
+            conn.close()
+        _watchers.clear()
+
+
+atexit.register(close_all_connections)
+
+
+# --- COLA DE ESCRITURAS (opcional) ---
+# Un único hilo escritor aplica en grupos las escrituras frecuentes de la
+# interfaz (celdas del planificador, casillas de la compra) para que los
+# reruns no esperen al COMMIT.
+_write_queue = None
+_session_writes = {}    # {sesion: última secuencia encolada por esa sesión}
+_session_lock = threading.Lock()
+
+
+def _apply_write_batch(operaciones):
+    # Cada operación lleva delante la base de datos de quien la encoló: una
+    # transacción por fichero. Un conflicto de compare-and-set no escribe nada
+    # y no estropea el grupo: se devuelve como resultado de esa operación
+    por_ruta = {}
+    for posicion, (funcion, (ruta, *args)) in enumerate(operaciones):
+        por_ruta.setdefault(ruta, []).append((posicion, funcion, args))
+    resultados = [None] * len(operaciones)
+    for ruta, lote in por_ruta.items():
+        with using_db(ruta), transaction():
+            for posicion, funcion, args in lote:
+                try:
+                    resultados[posicion] = funcion(*args)
+                except ConflictError as e:
+                    resultados[posicion] = e
+    return resultados
+
+
+def enable_write_queue(activo=True, max_batch=200, max_delay_ms=20):
+    """Activa (o desactiva, vaciándola antes) la cola de escrituras"""
+    global _write_queue
+    if activo and _write_queue is None:
+        _write_queue = WriteQueue(_apply_write_batch, max_batch=max_batch, max_delay_ms=max_delay_ms)
+    elif not activo and _write_queue is not None:
+        cola, _write_queue = _write_queue, None
+        cola.stop()
+
+
+def set_write_session(sesion_id):
+    """Identifica la sesión del hilo actual (un rerun de Streamlit) para read-your-writes"""
+    _local.session = sesion_id
+
+
+def wait_for_own_writes(timeout=None):
+    """Espera a que se confirmen las escrituras encoladas por la sesión actual"""
+    cola = _write_queue
+    sesion = getattr(_local, "session", None)
+    if cola is None or sesion is None or threading.current_thread() is cola.thread:
+        return True
+    with _session_lock:
+        secuencia = _session_writes.get(sesion)
+    if secuencia is None:
+        return True
+    return cola.wait_for(secuencia, timeout)
+
+
+def flush_writes(timeout=None):
+    """Barrera explícita: espera a que se confirme todo lo encolado (de cualquier sesión)"""
+    cola = _write_queue
+    return True if cola is None else cola.flush(timeout)
+
+
+def _enqueue(clave, funcion, args, futuro=None):
+    """
+    Encola la escritura si la cola está activa; devuelve False si hay que
+    hacerla ya. Con ``clave`` None no se agrupa con ninguna otra.
+    """
+    cola = _write_queue
+    if cola is None or _in_transaction() or threading.current_thread() is cola.thread:
+        return False
+    ruta = get_db_path()
+    sesion = getattr(_local, "session", None)
+    # Solo se agrupan las escrituras de una misma sesión: si la de otra
+    # sustituyera a la suya, esta daría por confirmada una escritura que aún
+    # está en cola y dejaría de leer lo que escribió
+    clave = (ruta, sesion) + (clave if clave is not None else (object(),))
+    secuencia = cola.submit(clave, funcion, (ruta,) + tuple(args), futuro)
+    if sesion is not None:
+        with _session_lock:
+            _session_writes[sesion] = secuencia
+    return True
+
+
+def _write_with_result(funcion, args, clave=None):
+    """
+    Escritura cuyo resultado hace falta (compare-and-set): con la cola activa
+    se aplica en un grupo del hilo escritor, junto a las de las demás sesiones,
+    y se espera a su COMMIT; el conflicto llega por el Future. Sin cola, ya.
+    Con ``clave`` se agrupa como en _enqueue (ambos Future reciben el resultado).
+    """
+    futuro = Future()
+    if not _enqueue(clave, funcion, args, futuro):
+        return funcion(*args)
+    return futuro.result()
+
+
+def _stop_write_queue():
+    enable_write_queue(False)
+
+
+# Se registra después de close_all_connections: atexit lo ejecuta antes
+atexit.register(_stop_write_queue)
+
+if os.environ.get("FOODCALENDAR_WRITE_QUEUE", "") == "1":
+    enable_write_queue()
+
+
+def set_query_stats_enabled(activo, slow_query_ms=None):
+    """
+    Activa/desactiva la instrumentación de consultas (ver src/instrumentation.py).
+    Las conexiones se reabren para usar (o dejar de usar) el cursor instrumentado.
+    """
+    if slow_query_ms is not None:
+        instrumentation.SLOW_QUERY_MS = slow_query_ms
+    if instrumentation.enabled != activo:
+        instrumentation.enabled = activo
+        close_all_connections()
+
+
+def get_query_stats():
+    return instrumentation.get_stats()
+
+
+def reset_query_stats():
+    instrumentation.reset_stats()
+
+
+# --- CACHÉ DE LECTURAS ---
+# Lecturas frecuentes compartidas por todas las sesiones. La clave incluye los
+# argumentos y la entrada vale mientras no cambie la generación de datos (o la
+# de planificación, para lo que no depende de compras_estado).
+_read_cache = ReadCache()
+
+
+def _cached(func=None, plan=True):
+    if func is None:
+        return functools.partial(_cached, plan=plan)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # Dentro de una transacción se ven cambios aún sin confirmar: se lee directamente
+        if _in_transaction():
+            return func(*args, **kwargs)
+        # Read-your-writes: las escrituras en cola de esta sesión aún no han subido la generación
+        if _write_queue is not None:
+            wait_for_own_writes()
+        generacion = get_plan_generation() if plan else get_data_generation()
+        clave = ((get_db_path(), func.__name__) + tuple(str(a) for a in args)
+                 + tuple(f"{k}={v}" for k, v in sorted(kwargs.items())))
+        return _read_cache.get_or_load(clave, generacion, lambda: func(*args, **kwargs))
+    return wrapper
+
+
+def get_read_cache_stats():
+    """Aciertos, fallos y ocupación de la caché de lecturas"""
+    return _read_cache.stats()
+
+
+def clear_read_cache(reset_stats=False):
+    _read_cache.clear(reset_stats)
+
+
+def set_read_cache_size(max_entries):
+    """Tamaño máximo de la caché de lecturas (0 la desactiva)"""
+    _read_cache.resize(max_entries)
+
+
+# --- ÍNDICE EN MEMORIA RECETA <-> INGREDIENTE ---
+_recipe_graphs = {}     # {ruta: RecipeGraph}, uno por fichero abierto
+
+
+def _recipe_graph():
+    # Sin cargar: para actualizarlo en sitio tras una escritura
+    ruta = get_db_path()
+    grafo = _recipe_graphs.get(ruta)
+    if grafo is None:
+        grafo = _recipe_graphs.setdefault(ruta, RecipeGraph())
+    return grafo
+
+
+def get_recipe_graph():
+    """Devuelve el índice receta<->ingrediente, cargándolo la primera vez"""
+    _check_external_changes()
+    grafo = _recipe_graph()
+    if not grafo.loaded:
+        with get_connection() as conn:
+            grafo.load(conn)
+    return grafo
+
+
+def invalidate_recipe_graph():
+    """Fuerza a recargar el índice en el próximo acceso (p.ej. tras escribir fuera de db.py)"""
+    _recipe_graph().clear()
+
+
+def get_ingredient_usage(ingrediente_id):
+    """Nombres de las recetas que usan el ingrediente (lo que arrastraría un borrado)"""
+    return get_recipe_graph().ingredient_recipe_names(ingrediente_id)
+
+
+def get_ingredient_usage_counts():
+    """Devuelve {ingrediente_id: número de recetas que lo usan}"""
+    return get_recipe_graph().usage_counts()
+
+
+# Rutas cuyo esquema ya se ha comprobado en este proceso
+_schema_ready = set()
+_schema_lock = threading.Lock()
 
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    # Habilitar foreign keys
-    c.execute("PRAGMA foreign_keys = ON")
-
-    # 1. Tabla de Ingredientes Únicos
-    c.execute('''CREATE TABLE IF NOT EXISTS ingredientes
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  categoria TEXT DEFAULT 'Otros',
-                  nombre TEXT UNIQUE)''')
-
-    # 2. Tabla de Recetas
-    c.execute('''CREATE TABLE IF NOT EXISTS recetas
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                  nombre TEXT UNIQUE)''')
-
-    # 3. Tabla Intermedia (Muchos a Muchos)
-    c.execute('''CREATE TABLE IF NOT EXISTS receta_ingredientes
-                 (receta_id INTEGER, 
-                  ingrediente_id INTEGER,
-                  FOREIGN KEY(receta_id) REFERENCES recetas(id) ON DELETE CASCADE,
-                  FOREIGN KEY(ingrediente_id) REFERENCES ingredientes(id) ON DELETE CASCADE,
-                  PRIMARY KEY (receta_id, ingrediente_id))''')
-
-    # 4. Tabla de Planificación (Calendario)
-    c.execute('''CREATE TABLE IF NOT EXISTS planificacion
-                 (fecha TEXT, 
-                  momento TEXT, 
-                  receta_id INTEGER,
-                  FOREIGN KEY(receta_id) REFERENCES recetas(id) ON DELETE SET NULL,
-                  PRIMARY KEY (fecha, momento))''')
-
-    conn.commit()
-    conn.close()
+    """
+    Deja el esquema al día aplicando las migraciones pendientes.
+    Solo consulta la base de datos la primera vez por proceso; las siguientes
+    llamadas (una por rerun de Streamlit) no hacen nada.
+    """
+    ruta = get_db_path()
+    if ruta in _schema_ready:
+        return
+    with _schema_lock:
+        if ruta in _schema_ready:
+            return
+        with get_connection() as conn:
+            # Una base de datos nueva (sin tablas) nace con auto_vacuum
+            # incremental: el VACUUM de un fichero vacío es inmediato. En una
+            # existente no se hace aquí, bloquearía la petición: ver
+            # enable_incremental_vacuum
+            if not conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone():
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.execute("VACUUM")
+            migrations.migrate(conn)
+        _schema_ready.add(ruta)
+
+
+def enable_incremental_vacuum():
+    """
+    Pasa la base de datos a auto_vacuum=INCREMENTAL, para poder devolver el
+    espacio libre por pasos (incremental_vacuum). En una base de datos
+    existente requiere un VACUUM completo, que bloquea a todas las sesiones
+    mientras reescribe el fichero: solo se hace a petición, una vez
+    (``python -m src maintenance vacuum --completo`` o el botón de
+    mantenimiento). Devuelve True si se hizo.
+    """
+    with get_connection() as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        try:
+            conn.execute("VACUUM")
+        except sqlite3.OperationalError as e:
+            # Otro proceso la está usando: habrá que volver a pedirlo
+            print(f"No se pudo activar auto_vacuum incremental: {e}")
+            return False
+    # No cambia datos, pero sí lo que muestra archive.get_archive_stats (cacheado por generación)
+    _bump_generation(plan=False)
+    return True
+
+
+def reset_after_restore():
+    """
+    Tras sustituir el contenido de la base de datos (restaurar una copia):
+    vuelve a comprobar el esquema y descarta todo lo que había en memoria.
+    """
+    _schema_ready.discard(get_db_path())
+    init_db()
+    _recipe_graph().clear()
+    _bump_generation()
 
 
 def run_query(query, params=(), return_data=False):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("PRAGMA foreign_keys = ON")
     try:
-        c.execute(query, params)
-        conn.commit()
+        # Las lecturas no abren transacción: en WAL nunca esperan a un escritor
         if return_data:
-            return c.fetchall()
+            with get_connection() as conn:
+                return conn.execute(query, params).fetchall()
+        with _atomic() as conn:
+            conn.execute(query, params)
+    except DatabaseBusyError:
+        # Una escritura que no se pudo hacer no se calla
+        raise
     except Exception as e:
         print(f"Error DB: {e}")
-    finally:
-        conn.close()
 
 
 # --- GESTIÓN DE INGREDIENTES ---
 def add_ingredient(nombre, categoria="Otros"):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
     try:
-        c.execute("INSERT INTO ingredientes (nombre, categoria) VALUES (?, ?)", (nombre, categoria))
-        conn.commit()
+        with _atomic() as conn:
+            c = conn.execute("INSERT INTO ingredientes (nombre, categoria) VALUES (?, ?)", (nombre, categoria))
+        _recipe_graph().set_ingredient(c.lastrowid, nombre, categoria)
         return True
     except sqlite3.IntegrityError:
         return False
-    finally:
-        conn.close()
 
 
+@_cached
 def get_all_ingredients():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    # Importante: Pedimos ID, nombre y categoria
-    c.execute("SELECT id, nombre, categoria FROM ingredientes ORDER BY nombre ASC")
-    res = c.fetchall()
-    conn.close()
-    return res
+    with get_connection() as conn:
+        c = conn.cursor()
+        # Importante: Pedimos ID, nombre y categoria
+        c.execute("SELECT id, nombre, categoria FROM ingredientes ORDER BY nombre ASC")
+        return c.fetchall()
+
+INGREDIENTS_PAGE_SIZE = 50
+
+
+def _prefix_range(texto):
+    """
+    Límites [desde, hasta) de 'empieza por texto' para comparar con COLLATE
+    NOCASE, que solo pliega las letras ASCII (como hacía LIKE)
+    """
+    desde = "".join(ch.lower() if ch.isascii() else ch for ch in texto)
+    siguiente = chr(ord(desde[-1]) + 1)
+    # Para NOCASE 'A'-'Z' valen 'a'-'z': el siguiente de '@' no es 'A' sino '['
+    if "A" <= siguiente <= "Z":
+        siguiente = "["
+    return desde, desde[:-1] + siguiente
+
+
+def _ingredients_filter(categoria, prefijo):
+    condiciones, params = [], []
+    if categoria:
+        condiciones.append("categoria = ?")
+        params.append(categoria)
+    if prefijo:
+        # Un rango y no LIKE: con la colación por defecto LIKE no usa índices
+        condiciones.append("nombre COLLATE NOCASE >= ? AND nombre COLLATE NOCASE < ?")
+        params.extend(_prefix_range(prefijo))
+    return " AND ".join(condiciones) or "1", params
+
+
+@_cached
+def get_ingredients_count(categoria=None, prefijo=None):
+    """Ingredientes que cumplen el filtro (cacheado: no se cuenta en cada cambio de página)"""
+    filtro, params = _ingredients_filter(categoria, prefijo)
+    with get_connection() as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM ingredientes WHERE {filtro}", params).fetchone()[0]
+
 
+@_cached
+def get_ingredients_page(despues=None, limite=INGREDIENTS_PAGE_SIZE, categoria=None, prefijo=None):
+    """
+    Una página del listado de ingredientes ordenado por (nombre, id), paginado
+    por clave: ``despues`` es el (nombre, id) de la última fila de la página
+    anterior (None para la primera). Filtros opcionales por categoría y por
+    principio del nombre (sin distinguir mayúsculas).
+    Devuelve ([(id, nombre, categoria)...], total de filas que cumplen el filtro).
+    """
+    filtro, params = _ingredients_filter(categoria, prefijo)
+    if despues is not None:
+        filtro += " AND (nombre, id) > (?, ?)"
+        params = params + list(despues)
+    with get_connection() as conn:
+        filas = conn.execute(f"""SELECT id, nombre, categoria FROM ingredientes WHERE {filtro}
+                                 ORDER BY nombre, id LIMIT ?""", params + [limite]).fetchall()
+    return filas, get_ingredients_count(categoria, prefijo)
+
+
+@_cached
 def get_ingredients_categories():
     """Devuelve un diccionario con el nombre del ingrediente y su categoría"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    # Intentamos obtener nombre y categoria
-    try:
-        c.execute("SELECT nombre, categoria FROM ingredientes")
-        # Si la categoría es None o vacía, le ponemos "Otros"
-        res = {row[0]: (row[1] if row[1] else "Otros") for row in c.fetchall()}
-    except sqlite3.OperationalError:
-        # Si la columna no existe aún, devolvemos "Otros" para todos
-        c.execute("SELECT nombre FROM ingredientes")
-        res = {row[0]: "Otros" for row in c.fetchall()}
-    conn.close()
-    return res
+    with get_connection() as conn:
+        c = conn.cursor()
+        # Intentamos obtener nombre y categoria
+        try:
+            c.execute("SELECT nombre, categoria FROM ingredientes")
+            # Si la categoría es None o vacía, le ponemos "Otros"
+            return {row[0]: (row[1] if row[1] else "Otros") for row in c.fetchall()}
+        except sqlite3.OperationalError:
+            # Si la columna no existe aún, devolvemos "Otros" para todos
+            c.execute("SELECT nombre FROM ingredientes")
+            return {row[0]: "Otros" for row in c.fetchall()}
 
 def delete_ingredient(ingrediente_id):
     run_query("DELETE FROM ingredientes WHERE id=?", (ingrediente_id,))
+    _recipe_graph().remove_ingredient(ingrediente_id)
 
 def update_ingredient(ing_id, new_name, new_cat):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
     try:
-        c.execute(
-            "UPDATE ingredientes SET nombre = ?, categoria = ? WHERE id = ?",
-            (new_name, new_cat, ing_id)
-        )
-        conn.commit()
+        with _atomic() as conn:
+            conn.execute(
+                "UPDATE ingredientes SET nombre = ?, categoria = ? WHERE id = ?",
+                (new_name, new_cat, ing_id)
+            )
+        _recipe_graph().set_ingredient(ing_id, new_name, new_cat)
         return True
     except sqlite3.Error:
         return False
-    finally:
-        conn.close()
 
 # --- GESTIÓN DE RECETAS ---
 def ensure_special_recipe(nombre_especial):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    # Verificamos si existe
-    c.execute("SELECT id FROM recetas WHERE nombre = ?", (nombre_especial,))
-    if not c.fetchone():
-        # Si no existe, la creamos vacía (sin ingredientes inicialmente)
-        c.execute("INSERT INTO recetas (nombre) VALUES (?)", (nombre_especial,))
-        conn.commit()
-    conn.close()
+    # Comprobación en memoria: la migración ya crea "Compra", así que en el
+    # caso normal no se toca SQLite
+    if nombre_especial in get_recipe_graph().recipes.values():
+        return
+    with _atomic() as conn:
+        c = conn.cursor()
+        # Verificamos si existe
+        c.execute("SELECT id FROM recetas WHERE nombre = ?", (nombre_especial,))
+        row = c.fetchone()
+        if not row:
+            # Si no existe, la creamos vacía (sin ingredientes inicialmente)
+            c.execute("INSERT INTO recetas (nombre) VALUES (?)", (nombre_especial,))
+    if row:
+        _recipe_graph().set_recipe(row[0], nombre_especial)
+    else:
+        _recipe_graph().set_recipe(c.lastrowid, nombre_especial, [])
 
-def create_recipe(nombre_receta, lista_ids_ingredientes):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+def create_recipe(nombre_receta, lista_ids_ingredientes, cantidades=None):
+    """``cantidades`` opcional: {ingrediente_id: (cantidad, unidad)}"""
     try:
-        # 1. Crear Receta
-        c.execute("INSERT INTO recetas (nombre) VALUES (?)", (nombre_receta,))
-        receta_id = c.lastrowid
-
-        # 2. Asociar ingredientes
-        for ing_id in lista_ids_ingredientes:
-            c.execute("INSERT INTO receta_ingredientes (receta_id, ingrediente_id) VALUES (?, ?)",
-                      (receta_id, ing_id))
-        conn.commit()
+        with _atomic() as conn:
+            c = conn.cursor()
+            # 1. Crear Receta
+            c.execute("INSERT INTO recetas (nombre) VALUES (?)", (nombre_receta,))
+            receta_id = c.lastrowid
+
+            # 2. Asociar ingredientes (una sola llamada para todas las filas)
+            c.executemany("INSERT INTO receta_ingredientes (receta_id, ingrediente_id) VALUES (?, ?)",
+                          [(receta_id, ing_id) for ing_id in lista_ids_ingredientes])
+            if cantidades:
+                set_recipe_quantities(receta_id, cantidades)
+        _recipe_graph().set_recipe(receta_id, nombre_receta, lista_ids_ingredientes)
         return True
     except Exception as e:
         print(e)
         return False
-    finally:
-        conn.close()
 
 
 def delete_recipe(receta_id):
     # Al borrar receta, el ON DELETE CASCADE borrará las relaciones en receta_ingredientes
     run_query("DELETE FROM recetas WHERE id=?", (receta_id,))
+    _recipe_graph().remove_recipe(receta_id)
 
 
-def update_recipe(receta_id, nuevo_nombre, lista_ids_ingredientes):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("PRAGMA foreign_keys = ON")
+def update_recipe(receta_id, nuevo_nombre, lista_ids_ingredientes, cantidades=None):
+    """``cantidades`` opcional: {ingrediente_id: (cantidad, unidad)}"""
     try:
-        # 1. Actualizar el nombre de la receta
-        c.execute("UPDATE recetas SET nombre = ? WHERE id = ?", (nuevo_nombre, receta_id))
+        with _atomic() as conn:
+            c = conn.cursor()
+            # 1. Actualizar el nombre de la receta
+            c.execute("UPDATE recetas SET nombre = ? WHERE id = ?", (nuevo_nombre, receta_id))
 
-        # 2. Eliminar ingredientes antiguos de esta receta
-        c.execute("DELETE FROM receta_ingredientes WHERE receta_id = ?", (receta_id,))
+            # 2. Solo se quitan/añaden los ingredientes que cambian: los que se
+            # quedan conservan su cantidad
+            actuales = {row[0] for row in c.execute(
+                "SELECT ingrediente_id FROM receta_ingredientes WHERE receta_id = ?", (receta_id,))}
+            nuevos = set(lista_ids_ingredientes)
+            c.executemany("DELETE FROM receta_ingredientes WHERE receta_id = ? AND ingrediente_id = ?",
+                          [(receta_id, ing_id) for ing_id in actuales - nuevos])
 
-        # 3. Insertar los nuevos ingredientes seleccionados
-        for ing_id in lista_ids_ingredientes:
-            c.execute("INSERT INTO receta_ingredientes (receta_id, ingrediente_id) VALUES (?, ?)",
-                      (receta_id, ing_id))
-
-        conn.commit()
+            # 3. Insertar los nuevos ingredientes seleccionados
+            c.executemany("INSERT INTO receta_ingredientes (receta_id, ingrediente_id) VALUES (?, ?)",
+                          [(receta_id, ing_id) for ing_id in nuevos - actuales])
+            if cantidades:
+                set_recipe_quantities(receta_id, cantidades)
+        _recipe_graph().set_recipe(receta_id, nuevo_nombre, lista_ids_ingredientes)
         return True
     except Exception as e:
         print(f"Error al actualizar: {e}")
         return False
-    finally:
-        conn.close()
 
+@_cached
 def get_all_recipes():
     return run_query("SELECT id, nombre FROM recetas ORDER BY nombre", return_data=True)
 
 
 def get_recipe_ingredients(receta_id):
-    query = '''
-        SELECT i.nombre 
-        FROM ingredientes i
-        JOIN receta_ingredientes ri ON i.id = ri.ingrediente_id
-        WHERE ri.receta_id = ?
-    '''
-    data = run_query(query, (receta_id,), return_data=True)
-    return [row[0] for row in data]
+    # Se sirve desde el índice en memoria, sin consultar SQLite
+    return get_recipe_graph().recipe_ingredient_names(receta_id)
+
+
+def get_recipe_quantities(receta_id):
+    """Devuelve {ingrediente_id: (cantidad, unidad)} de una receta (None si no se indicó)"""
+    data = run_query("SELECT ingrediente_id, cantidad, unidad FROM receta_ingredientes WHERE receta_id = ?",
+                     (receta_id,), return_data=True)
+    return {ing_id: (cantidad, unidad) for ing_id, cantidad, unidad in data or []}
+
+
+def set_recipe_quantities(receta_id, cantidades):
+    """Guarda cantidad y unidad ({ingrediente_id: (cantidad, unidad)}) de ingredientes ya asociados"""
+    with _atomic() as conn:
+        conn.executemany(
+            "UPDATE receta_ingredientes SET cantidad = ?, unidad = ? WHERE receta_id = ? AND ingrediente_id = ?",
+            [(cantidad, unidad, receta_id, ing_id) for ing_id, (cantidad, unidad) in cantidades.items()])
+
+
+@_cached
+def get_recipe_links():
+    """Todos los enlaces receta-ingrediente con cantidad: [(receta_id, ingrediente_id, cantidad, unidad)...]"""
+    return run_query("SELECT receta_id, ingrediente_id, cantidad, unidad FROM receta_ingredientes",
+                     return_data=True)
+
+
+# --- BÚSQUEDA ---
+SEARCH_LIMIT = 50
+
+
+def _match_expression(texto):
+    """'tom  frit' -> '"tom"* "frit"*': todas las palabras, cada una como prefijo"""
+    return " ".join(f'"{palabra}"*' for palabra in re.findall(r"\w+", texto or ""))
+
+
+def _search(tabla, texto, limite):
+    expresion = _match_expression(texto)
+    if not expresion:
+        # Sin texto: los primeros por orden alfabético
+        return run_query(f"SELECT id, nombre FROM {tabla} ORDER BY nombre LIMIT ?",
+                         (limite,), return_data=True)
+    # Más relevantes primero (bm25); a igualdad, los nombres más cortos
+    return run_query(f"""SELECT t.id, t.nombre FROM {tabla}_fts f JOIN {tabla} t ON t.id = f.rowid
+                         WHERE {tabla}_fts MATCH ? ORDER BY f.rank, length(t.nombre), t.nombre LIMIT ?""",
+                     (expresion, limite), return_data=True)
+
+
+@_cached
+def search_recipes(texto, limite=SEARCH_LIMIT):
+    """Recetas cuyo nombre contiene palabras que empiezan por las de ``texto``
+    (sin distinguir mayúsculas ni tildes): [(id, nombre)...], como mucho ``limite``"""
+    return _search("recetas", texto, limite)
+
+
+@_cached
+def search_ingredients(texto, limite=SEARCH_LIMIT):
+    """Como search_recipes, sobre los ingredientes: [(id, nombre)...]"""
+    return _search("ingredientes", texto, limite)
 
 
 # --- GESTIÓN PLANIFICACIÓN ---
-def save_meal_plan(fecha, momento, receta_id):
-    run_query("INSERT OR REPLACE INTO planificacion (fecha, momento, receta_id) VALUES (?, ?, ?)",
+def save_meal_plan(fecha, momento, receta_id, version=None):
+    """
+    Asigna una receta a una celda del planificador. Con ``version`` (la que se
+    leyó con get_plan_versions; 0 si la celda no existía) es compare-and-set:
+    solo se escribe si nadie ha cambiado la celda desde entonces, y si no lanza
+    ConflictError. Devuelve la versión nueva de la celda (None sin ``version``).
+    """
+    if version is not None:
+        return _write_with_result(_compare_and_set_plan, (fecha, momento, "receta_id", receta_id, version))
+    # Con la cola activa, cambios repetidos de la misma celda se agrupan en uno
+    if not _enqueue(("plan", str(fecha), momento), _save_meal_plan_now, (fecha, momento, receta_id)):
+        _save_meal_plan_now(fecha, momento, receta_id)
+
+
+def _save_meal_plan_now(fecha, momento, receta_id):
+    # UPSERT en lugar de INSERT OR REPLACE: actualiza la fila en sitio y los
+    # triggers de compra_semanal ven un único UPDATE
+    run_query('''INSERT INTO planificacion (fecha, momento, receta_id) VALUES (?, ?, ?)
+                 ON CONFLICT (fecha, momento) DO UPDATE SET receta_id = excluded.receta_id''',
               (str(fecha), momento, receta_id))
 
 
+def _compare_and_set_plan(fecha, momento, columna, valor, version):
+    fecha = str(fecha)
+    with transaction() as conn:
+        c = conn.execute(f"""UPDATE planificacion SET {columna} = ?, version = version + 1
+                             WHERE fecha = ? AND momento = ? AND version = ?""",
+                         (valor, fecha, momento, version))
+        if c.rowcount:
+            return version + 1
+        fila = conn.execute(f"SELECT {columna}, version FROM planificacion WHERE fecha = ? AND momento = ?",
+                            (fecha, momento)).fetchone()
+        if fila is None and version == 0 and columna == "receta_id":
+            conn.execute("INSERT INTO planificacion (fecha, momento, receta_id) VALUES (?, ?, ?)",
+                         (fecha, momento, valor))
+            return 1
+    _count_lock_stat("conflictos")
+    actual, version_actual = fila if fila is not None else (None, 0)
+    raise ConflictError(f"{fecha} {momento} cambió mientras se editaba", actual, version_actual)
+
+
+@_cached
+def get_plan_versions(start_date, end_date):
+    """{(fecha, momento): version} de las celdas del rango (las que no están valen 0)"""
+    data = run_query("SELECT fecha, momento, version FROM planificacion WHERE fecha BETWEEN ? AND ?",
+                     (str(start_date), str(end_date)), return_data=True)
+    return {(fecha, momento): version for fecha, momento, version in data or []}
+
+
+@_cached
 def get_plan_range_details(start_date, end_date):
     # Esta query es más compleja porque hace JOINs para traer nombres
     query = '''
@@ -205,58 +1048,326 @@ def get_plan_range_details(start_date, end_date):
     '''
     return run_query(query, (str(start_date), str(end_date)), return_data=True)
 
+def save_meal_servings(fecha, momento, raciones, version=None):
+    """
+    Raciones de una comida ya planificada (multiplica las cantidades de su receta).
+    ``version`` como en save_meal_plan.
+    """
+    if version is not None:
+        return _write_with_result(_compare_and_set_plan, (fecha, momento, "raciones", raciones, version))
+    run_query("UPDATE planificacion SET raciones = ? WHERE fecha = ? AND momento = ?",
+              (raciones, str(fecha), momento))
+
+
+@_cached
+def get_plan_range_servings(start_date, end_date):
+    """Devuelve {(fecha, momento): raciones} de las comidas planificadas en el rango"""
+    data = run_query("SELECT fecha, momento, raciones FROM planificacion "
+                     "WHERE fecha BETWEEN ? AND ? AND receta_id IS NOT NULL",
+                     (str(start_date), str(end_date)), return_data=True)
+    return {(fecha, momento): raciones for fecha, momento, raciones in data or []}
+
+
+@_cached
+def get_recipe_servings(start_date, end_date):
+    """
+    Comidas y raciones por receta en el rango: [(receta_id, comidas, raciones)...].
+    Agrupado en SQLite, así que el resultado tiene como mucho una fila por receta
+    aunque el rango sea de años.
+    """
+    return run_query('''SELECT receta_id, COUNT(*), SUM(raciones) FROM planificacion
+                        WHERE fecha BETWEEN ? AND ? AND receta_id IS NOT NULL
+                        GROUP BY receta_id''', (str(start_date), str(end_date)), return_data=True)
+
+
 # --- GESTIÓN DE LA LISTA DE LA COMPRA ---
+def _covers_whole_weeks(start_date, end_date):
+    inicio = date.fromisoformat(str(start_date))
+    fin = date.fromisoformat(str(end_date))
+    return inicio.weekday() == 0 and fin.weekday() == 6 and inicio <= fin
+
+
+# Agregado de la compra: desde la tabla materializada (semanas completas) o
+# sobre la planificación. {columna} y {join} añaden (o no) el estado de compras_estado.
+_SHOPPING_WEEKS_SQL = '''
+    SELECT i.id, i.nombre,
+           COALESCE(NULLIF(i.categoria, ''), 'Otros') AS categoria,
+           SUM(cs.veces) AS veces{columna}
+    FROM compra_semanal cs
+    JOIN ingredientes i ON i.id = cs.ingrediente_id{join}
+    WHERE cs.semana_inicio BETWEEN ? AND ?
+    GROUP BY i.id
+    ORDER BY categoria, i.nombre
+'''
+_SHOPPING_PLAN_SQL = '''
+    SELECT i.id, i.nombre,
+           COALESCE(NULLIF(i.categoria, ''), 'Otros') AS categoria,
+           COUNT(*) AS veces{columna}
+    FROM planificacion p
+    JOIN receta_ingredientes ri ON ri.receta_id = p.receta_id
+    JOIN ingredientes i ON i.id = ri.ingrediente_id{join}
+    WHERE p.fecha BETWEEN ? AND ?
+    GROUP BY i.id
+    ORDER BY categoria, i.nombre
+'''
+_SHOPPING_STATUS_COLUMN = ",\n           COALESCE(MAX(ce.comprado), 0) AS comprado"
+_SHOPPING_STATUS_JOIN = """
+    LEFT JOIN compras_estado ce
+           ON ce.semana = ? AND ce.ingrediente_id = i.id"""
+
+
+_WEEK_EPOCH = date.fromisoformat(migrations.WEEK_EPOCH)
+
+
+def _week_number(fecha):
+    """Semana (entero) de una fecha, como la columna compras_estado.semana"""
+    return (date.fromisoformat(str(fecha)) - _WEEK_EPOCH).days // 7
+
+
+def _shopping_sql(start_date, end_date, con_estado):
+    # Si el rango son semanas completas (de lunes a domingo) se lee de la tabla
+    # materializada compra_semanal, cuyo coste no depende del número de comidas
+    plantilla = _SHOPPING_WEEKS_SQL if _covers_whole_weeks(start_date, end_date) else _SHOPPING_PLAN_SQL
+    if con_estado:
+        return plantilla.format(columna=_SHOPPING_STATUS_COLUMN, join=_SHOPPING_STATUS_JOIN)
+    return plantilla.format(columna="", join="")
+
+
+def get_shopping_list(start_date, end_date, semana_inicio=None):
+    """
+    Lista de la compra agregada para un rango de fechas en una sola consulta.
+    Devuelve [(ingrediente, categoria, veces, comprado)...] ordenado por categoría y nombre.
+    El estado 'comprado' se toma de la semana ``semana_inicio`` (por defecto, ``start_date``).
+    """
+    if semana_inicio is None:
+        semana_inicio = start_date
+    query = _shopping_sql(start_date, end_date, con_estado=True)
+    data = run_query(query, (_week_number(semana_inicio), str(start_date), str(end_date)), return_data=True)
+    return [(nombre, cat, veces, bool(comprado)) for _, nombre, cat, veces, comprado in data or []]
+
+
+def get_shopping_aggregate(start_date, end_date):
+    """
+    Igual que get_shopping_list pero sin el estado de compra y con el id del
+    ingrediente: [(ingrediente_id, ingrediente, categoria, veces)...].
+    Solo depende de la planificación, así que se puede cachear con get_plan_generation().
+    """
+    query = _shopping_sql(start_date, end_date, con_estado=False)
+    return run_query(query, (str(start_date), str(end_date)), return_data=True) or []
+
+
+def rebuild_weekly_shopping():
+    """Recalcula desde cero la tabla materializada compra_semanal"""
+    with _atomic() as conn:
+        for sql in migrations.REBUILD_WEEKLY_SHOPPING:
+            conn.execute(sql)
+
+
+def verify_weekly_shopping():
+    """
+    Compara compra_semanal con el cálculo directo sobre la planificación.
+    Devuelve [(semana, ingrediente_id, veces_materializadas, veces_reales)...]
+    con las diferencias (lista vacía si todo cuadra).
+    """
+    query = '''
+        WITH real AS (
+            SELECT date(p.fecha, 'weekday 0', '-6 days') AS semana, ri.ingrediente_id, COUNT(*) AS veces
+            FROM planificacion p
+            JOIN receta_ingredientes ri ON ri.receta_id = p.receta_id
+            GROUP BY 1, 2
+        )
+        SELECT cs.semana_inicio, cs.ingrediente_id, cs.veces, COALESCE(r.veces, 0)
+        FROM compra_semanal cs
+        LEFT JOIN real r ON r.semana = cs.semana_inicio AND r.ingrediente_id = cs.ingrediente_id
+        WHERE r.veces IS NULL OR r.veces != cs.veces
+        UNION ALL
+        SELECT r.semana, r.ingrediente_id, 0, r.veces
+        FROM real r
+        WHERE NOT EXISTS (SELECT 1 FROM compra_semanal cs
+                          WHERE cs.semana_inicio = r.semana AND cs.ingrediente_id = r.ingrediente_id)
+    '''
+    return run_query(query, return_data=True) or []
+
 def init_shopping_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    # Tabla para guardar el estado (tachado/no tachado) de los ingredientes por semana
-    c.execute('''CREATE TABLE IF NOT EXISTS compras_estado
-                 (semana_inicio TEXT, 
-                  ingrediente_nombre TEXT, 
-                  comprado BOOLEAN,                  
-                  PRIMARY KEY (semana_inicio, ingrediente_nombre))''')
-    conn.commit()
-    conn.close()
+    """Compatibilidad: la tabla compras_estado la crean ahora las migraciones"""
+    init_db()
 
+@_cached(plan=False)
 def get_shopping_status(semana_inicio):
-    """Devuelve un diccionario {ingrediente: True/False} para la semana dada"""
-    query = "SELECT ingrediente_nombre, comprado FROM compras_estado WHERE semana_inicio = ?"
-    data = run_query(query, (str(semana_inicio),), return_data=True)
+    """Devuelve un diccionario {ingrediente_id: True/False} para la semana dada"""
+    query = "SELECT ingrediente_id, comprado FROM compras_estado WHERE semana = ?"
+    data = run_query(query, (_week_number(semana_inicio),), return_data=True)
     return {row[0]: bool(row[1]) for row in data}
 
-def update_shopping_status(semana_inicio, ingrediente, estado):
+@_cached(plan=False)
+def get_shopping_versions(semana_inicio):
+    """{ingrediente_id: version} de las casillas de la semana (las que no están valen 0)"""
+    data = run_query("SELECT ingrediente_id, version FROM compras_estado WHERE semana = ?",
+                     (_week_number(semana_inicio),), return_data=True)
+    return dict(data or [])
+
+
+def _write_status(query, params, many=False):
+    # Escritura que solo toca compras_estado: se descuenta para que no suba
+    # la generación de planificación
+    with _atomic() as conn:
+        antes = conn.total_changes
+        if many:
+            conn.executemany(query, params)
+        else:
+            conn.execute(query, params)
+        _local.status_changes += conn.total_changes - antes
+
+
+_UPSERT_STATUS = '''INSERT INTO compras_estado (semana, ingrediente_id, comprado) VALUES (?, ?, ?)
+                    ON CONFLICT (semana, ingrediente_id) DO UPDATE SET comprado = excluded.comprado'''
+
+
+def update_shopping_status(semana_inicio, ingrediente_id, estado):
     """Guarda si un ingrediente está comprado o no"""
-    query = '''INSERT OR REPLACE INTO compras_estado 
-               (semana_inicio, ingrediente_nombre, comprado) 
-               VALUES (?, ?, ?)'''
-    run_query(query, (str(semana_inicio), ingrediente, estado))
+    clave = ("compra", str(semana_inicio), ingrediente_id)
+    if not _enqueue(clave, _update_shopping_status_now, (semana_inicio, ingrediente_id, estado)):
+        _update_shopping_status_now(semana_inicio, ingrediente_id, estado)
+
+
+def _update_shopping_status_now(semana_inicio, ingrediente_id, estado):
+    try:
+        _write_status(_UPSERT_STATUS, (_week_number(semana_inicio), ingrediente_id, estado))
+    except DatabaseBusyError:
+        raise
+    except Exception as e:
+        print(f"Error en DB: {e}")
+
+
+def update_shopping_statuses(semana_inicio, cambios, versiones=None):
+    """
+    Guarda varias casillas de golpe ({ingrediente_id: estado}) en una sola transacción.
+
+    Con ``versiones`` ({ingrediente_id: version}, de get_shopping_versions) cada
+    casilla solo se escribe si nadie la ha cambiado desde entonces; las demás se
+    guardan igualmente. Devuelve los ingrediente_id en conflicto (lista vacía si
+    no hay ninguno o sin ``versiones``).
+    """
+    if not cambios:
+        return []
+    if versiones is not None:
+        # Una sola casilla (un clic en la lista): misma clave que update_shopping_status
+        clave = ("compra", str(semana_inicio), *cambios) if len(cambios) == 1 else None
+        return _write_with_result(_compare_and_set_statuses, (semana_inicio, cambios, versiones), clave)
+    if _write_queue is not None and not _in_transaction():
+        for ingrediente_id, estado in cambios.items():
+            update_shopping_status(semana_inicio, ingrediente_id, estado)
+        return []
+    semana = _week_number(semana_inicio)
+    filas = [(semana, ingrediente_id, estado) for ingrediente_id, estado in cambios.items()]
+    try:
+        _write_status(_UPSERT_STATUS, filas, many=True)
+    except DatabaseBusyError:
+        raise
+    except Exception as e:
+        print(f"Error en DB: {e}")
+    return []
+
+
+_CAS_STATUS = '''INSERT INTO compras_estado (semana, ingrediente_id, comprado, version) VALUES (?, ?, ?, ?)
+                 ON CONFLICT (semana, ingrediente_id)
+                 DO UPDATE SET comprado = excluded.comprado, version = excluded.version'''
+
+
+def _compare_and_set_statuses(semana_inicio, cambios, versiones):
+    semana = _week_number(semana_inicio)
+    with transaction() as conn:
+        # Con el bloqueo de escritura ya tomado, nadie las cambia entre la lectura y la escritura
+        actuales = {ing_id: (bool(comprado), version) for ing_id, comprado, version in conn.execute(
+            "SELECT ingrediente_id, comprado, version FROM compras_estado WHERE semana = ?", (semana,))}
+        filas, conflictos = [], []
+        for ingrediente_id, estado in cambios.items():
+            comprado, version = actuales.get(ingrediente_id, (False, 0))
+            if version == versiones.get(ingrediente_id, 0):
+                filas.append((semana, ingrediente_id, estado, version + 1))
+            elif comprado != bool(estado):
+                # Si otra sesión la dejó igual que se quería, no es un conflicto
+                conflictos.append(ingrediente_id)
+        if filas:
+            _write_status(_CAS_STATUS, filas, many=True)
+    for _ in conflictos:
+        _count_lock_stat("conflictos")
+    return conflictos
 
 def clear_shopping_status(semana_inicio):
     """Elimina todos los registros de 'comprado' para una semana concreta"""
-    query = "DELETE FROM compras_estado WHERE semana_inicio = ?"
-    run_query(query, (str(semana_inicio),))
+    # También pasa por la cola para respetar el orden con las casillas pendientes
+    if not _enqueue(("compra_vaciar", str(semana_inicio)), _clear_shopping_status_now, (semana_inicio,)):
+        _clear_shopping_status_now(semana_inicio)
 
 
-def reset_historical_data():
-    conn = sqlite3.connect(DB_PATH)
-    # Importante: Cambiamos el nivel de aislamiento a None para que VACUUM funcione
-    conn.isolation_level = None
-    c = conn.cursor()
+def _clear_shopping_status_now(semana_inicio):
     try:
-        # 1. Borramos los datos (Esto sí requiere una transacción manual o auto)
-        c.execute("BEGIN")
-        c.execute("DELETE FROM planificacion")
-        c.execute("DELETE FROM compras_estado")
-        c.execute("COMMIT")
+        # Se desmarcan en lugar de borrarse: así conservan su versión y una
+        # sesión que aún las ve marcadas no puede pisar el vaciado sin enterarse
+        _write_status("UPDATE compras_estado SET comprado = 0 WHERE semana = ? AND comprado != 0",
+                      (_week_number(semana_inicio),))
+    except DatabaseBusyError:
+        raise
+    except Exception as e:
+        print(f"Error en DB: {e}")
+
+
+def incremental_vacuum(paginas=64):
+    """
+    Devuelve al sistema hasta ``paginas`` páginas libres del fichero, en una
+    transacción corta (no bloquea como un VACUUM completo). Devuelve cuántas
+    páginas libres quedan; 0 si la base de datos no tiene auto_vacuum
+    incremental (sus páginas libres solo se recuperan con un VACUUM completo,
+    ver enable_incremental_vacuum). Dentro de db.transaction() no hace nada.
+    """
+    with get_connection() as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+        libres = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if not libres or _in_transaction():
+            return libres
+        try:
+            # executescript: el módulo sqlite3 solo avanzaría el PRAGMA un paso
+            # (una página); así se ejecuta entero
+            _retry_busy(lambda: conn.executescript(f"BEGIN IMMEDIATE; PRAGMA incremental_vacuum({int(paginas)});"))
+        except BaseException:
+            conn.rollback()
+            raise
+        # No cambia datos: no sube la generación (salvo cambios externos sin ver)
+        if _commit_own(conn):
+            _external_change()
+        return conn.execute("PRAGMA freelist_count").fetchone()[0]
 
-        # 2. Ahora ejecutamos VACUUM fuera de la transacción
-        c.execute("VACUUM")
+
+def reset_historical_data():
+    try:
+        # Borramos los datos en una única transacción. Sin VACUUM: el espacio
+        # liberado se devuelve por pasos con incremental_vacuum (src/archive.py)
+        with _atomic() as conn:
+            conn.execute("DELETE FROM planificacion")
+            conn.execute("DELETE FROM compras_estado")
 
         return True
+    except DatabaseBusyError:
+        raise
     except Exception as e:
-        if conn:
-            c.execute("ROLLBACK")
         print(f"Error detallado en DB: {e}")
         return False
-    finally:
-        conn.close()
\ No newline at end of file
+
+
+# --- INSTRUMENTACIÓN ---
+# Todas las funciones públicas de datos se envuelven para contar llamadas y
+# tiempos cuando la instrumentación está activa (sin coste apreciable si no)
+_NO_INSTRUMENTAR = {
+    "get_connection", "transaction", "configure_db", "close_all_connections",
+    "enable_write_queue", "set_write_session", "wait_for_own_writes", "flush_writes",
+    "set_query_stats_enabled", "get_query_stats", "reset_query_stats", "get_data_generation",
+    "get_plan_generation", "get_read_cache_stats", "clear_read_cache", "set_read_cache_size",
+    "get_lock_stats", "get_db_path", "set_db_path_resolver", "using_db", "get_open_shards",
+}
+
+for _nombre, _obj in list(globals().items()):
+    if (callable(_obj) and not _nombre.startswith("_") and _nombre not in _NO_INSTRUMENTAR
+            and getattr(_obj, "__module__", None) == __name__ and not isinstance(_obj, type)):
+        globals()[_nombre] = instrumentation.instrument_function(_nombre, _obj)
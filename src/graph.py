@@ -0,0 +1,103 @@
+import threading
+
+
+class RecipeGraph:
+    """
+    Índice en memoria, bidireccional, de la relación receta <-> ingrediente.
+    Se carga una sola vez desde SQLite y las funciones de escritura de db.py
+    lo mantienen al día (write-through) o lo invalidan.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    # --- CARGA E INVALIDACIÓN ---
+    def clear(self):
+        with self._lock:
+            self.loaded = False
+            self.recipes = {}           # {receta_id: nombre}
+            self.ingredients = {}       # {ingrediente_id: (nombre, categoria)}
+            self.recipe_to_ings = {}    # {receta_id: {ingrediente_id, ...}}
+            self.ing_to_recipes = {}    # {ingrediente_id: {receta_id, ...}}
+
+    def load(self, conn):
+        """Lee las tres tablas en bloque y reconstruye ambos índices"""
+        with self._lock:
+            self.clear()
+            c = conn.cursor()
+            for rid, nombre in c.execute("SELECT id, nombre FROM recetas"):
+                self.recipes[rid] = nombre
+                self.recipe_to_ings[rid] = set()
+            for iid, nombre, cat in c.execute("SELECT id, nombre, categoria FROM ingredientes"):
+                self.ingredients[iid] = (nombre, cat if cat else "Otros")
+                self.ing_to_recipes[iid] = set()
+            for rid, iid in c.execute("SELECT receta_id, ingrediente_id FROM receta_ingredientes"):
+                self.recipe_to_ings.setdefault(rid, set()).add(iid)
+                self.ing_to_recipes.setdefault(iid, set()).add(rid)
+            self.loaded = True
+
+    # --- ACTUALIZACIONES (write-through) ---
+    def set_recipe(self, receta_id, nombre, ingrediente_ids=None):
+        """Alta o modificación de una receta; si se pasan ids, sustituyen a los anteriores"""
+        with self._lock:
+            if not self.loaded:
+                return
+            self.recipes[receta_id] = nombre
+            if ingrediente_ids is None:
+                self.recipe_to_ings.setdefault(receta_id, set())
+                return
+            for iid in self.recipe_to_ings.get(receta_id, ()):
+                self.ing_to_recipes.get(iid, set()).discard(receta_id)
+            nuevos = set(ingrediente_ids)
+            self.recipe_to_ings[receta_id] = nuevos
+            for iid in nuevos:
+                self.ing_to_recipes.setdefault(iid, set()).add(receta_id)
+
+    def remove_recipe(self, receta_id):
+        with self._lock:
+            if not self.loaded:
+                return
+            self.recipes.pop(receta_id, None)
+            for iid in self.recipe_to_ings.pop(receta_id, ()):
+                self.ing_to_recipes.get(iid, set()).discard(receta_id)
+
+    def set_ingredient(self, ingrediente_id, nombre, categoria):
+        with self._lock:
+            if not self.loaded:
+                return
+            self.ingredients[ingrediente_id] = (nombre, categoria if categoria else "Otros")
+            self.ing_to_recipes.setdefault(ingrediente_id, set())
+
+    def remove_ingredient(self, ingrediente_id):
+        # Equivalente en memoria del ON DELETE CASCADE de receta_ingredientes
+        with self._lock:
+            if not self.loaded:
+                return
+            self.ingredients.pop(ingrediente_id, None)
+            for rid in self.ing_to_recipes.pop(ingrediente_id, ()):
+                self.recipe_to_ings.get(rid, set()).discard(ingrediente_id)
+
+    # --- CONSULTAS ---
+    def recipe_ingredient_ids(self, receta_id):
+        with self._lock:
+            return set(self.recipe_to_ings.get(receta_id, ()))
+
+    def recipe_ingredient_names(self, receta_id):
+        with self._lock:
+            return sorted(self.ingredients[iid][0] for iid in self.recipe_to_ings.get(receta_id, ())
+                          if iid in self.ingredients)
+
+    def ingredient_recipe_ids(self, ingrediente_id):
+        with self._lock:
+            return set(self.ing_to_recipes.get(ingrediente_id, ()))
+
+    def ingredient_recipe_names(self, ingrediente_id):
+        with self._lock:
+            return sorted(self.recipes[rid] for rid in self.ing_to_recipes.get(ingrediente_id, ())
+                          if rid in self.recipes)
+
+    def usage_counts(self):
+        """Devuelve {ingrediente_id: número de recetas que lo usan}"""
+        with self._lock:
+            return {iid: len(rids) for iid, rids in self.ing_to_recipes.items()}
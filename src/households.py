@@ -0,0 +1,135 @@
+"""
+Varios hogares en un mismo servidor: un fichero SQLite (shard) por hogar.
+
+Cada hogar tiene un identificador corto (``garcia``, ``piso-3b``) y su base de
+datos en ``<directorio>/<hogar>.db``. Los directorios se indican en
+FOODCALENDAR_HOUSEHOLDS_DIRS, separados por ``os.pathsep``, para repartir los
+hogares entre discos. Un hogar nuevo va al directorio que le toque por hash de
+su identificador; uno que ya existe se busca en todos.
+
+db.py no sabe nada de hogares: solo de rutas. Aquí se resuelve la ruta y se
+usa db.using_db() (o el resolutor de sesión de app.py) para dirigir a ella
+todas las llamadas. Los pools abiertos están acotados por db.MAX_OPEN_SHARDS.
+
+Sin hogar (la instalación de siempre) se usa db.DB_PATH.
+"""
+import os
+import re
+import sqlite3
+import zlib
+from contextlib import contextmanager
+
+from src import db, migrations
+
+HOUSEHOLDS_DIRS = [d for d in os.environ.get("FOODCALENDAR_HOUSEHOLDS_DIRS",
+                                             os.path.join("data", "hogares")).split(os.pathsep) if d]
+_ID = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+_SUFIJO_ARCHIVO = "_archivo.db"
+
+
+class HouseholdError(Exception):
+    pass
+
+
+def validate_id(hogar):
+    """El identificador acaba en un nombre de fichero: solo minúsculas, dígitos, - y _"""
+    if not isinstance(hogar, str) or not _ID.match(hogar):
+        raise HouseholdError(f"Identificador de hogar no válido: {hogar!r} (a-z, 0-9, - y _; hasta 64)")
+    # <hogar>_archivo.db es el archivo de semanas antiguas de <hogar> (archive.archive_path)
+    if (hogar + ".db").endswith(_SUFIJO_ARCHIVO):
+        raise HouseholdError(f"Identificador de hogar no válido: {hogar!r} (no puede acabar en _archivo)")
+    return hogar
+
+
+def shard_path(hogar):
+    """Ruta del fichero del hogar (exista o no)"""
+    validate_id(hogar)
+    for directorio in HOUSEHOLDS_DIRS:
+        ruta = os.path.join(directorio, f"{hogar}.db")
+        if os.path.exists(ruta):
+            return ruta
+    directorio = HOUSEHOLDS_DIRS[zlib.crc32(hogar.encode()) % len(HOUSEHOLDS_DIRS)]
+    return os.path.join(directorio, f"{hogar}.db")
+
+
+def exists(hogar):
+    return os.path.exists(shard_path(hogar))
+
+
+def resolve(hogar):
+    """Ruta del fichero de un hogar que ya existe (HouseholdError si no)"""
+    ruta = shard_path(hogar)
+    if not os.path.exists(ruta):
+        raise HouseholdError(f"El hogar {hogar} no existe")
+    return ruta
+
+
+@contextmanager
+def use_household(hogar):
+    """Las llamadas a db.py del bloque (en este hilo) van al fichero del hogar"""
+    with db.using_db(resolve(hogar)) as ruta:
+        yield ruta
+
+
+def create_household(hogar):
+    """Crea el fichero del hogar con el esquema al día. Devuelve su ruta"""
+    ruta = shard_path(hogar)
+    if os.path.exists(ruta):
+        raise HouseholdError(f"El hogar {hogar} ya existe ({ruta})")
+    os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+    with db.using_db(ruta):
+        db.init_db()
+    return ruta
+
+
+def _schema_version(ruta):
+    # Conexión aparte y de solo lectura: listar no abre pools ni mueve el LRU
+    conn = sqlite3.connect(f"file:{ruta}?mode=ro", uri=True)
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def list_households():
+    """[{hogar, ruta, bytes, version_esquema}...] de todos los directorios, por identificador"""
+    hogares = []
+    for directorio in HOUSEHOLDS_DIRS:
+        if not os.path.isdir(directorio):
+            continue
+        for nombre in os.listdir(directorio):
+            hogar = nombre[:-3]
+            if not nombre.endswith(".db") or nombre.endswith(_SUFIJO_ARCHIVO) or not _ID.match(hogar):
+                continue
+            ruta = os.path.join(directorio, nombre)
+            hogares.append({"hogar": hogar, "ruta": ruta, "bytes": os.path.getsize(ruta),
+                            "version_esquema": _schema_version(ruta)})
+    return sorted(hogares, key=lambda h: h["hogar"])
+
+
+def migrate_households():
+    """Lleva todos los hogares al esquema actual. Devuelve {hogar: (version_antes, version_despues)}"""
+    resultado = {}
+    for info in list_households():
+        if info["version_esquema"] < migrations.SCHEMA_VERSION:
+            with db.using_db(info["ruta"]):
+                db.init_db()
+        resultado[info["hogar"]] = (info["version_esquema"], _schema_version(info["ruta"]))
+    return resultado
+
+
+def backup_households(directorio, hogares=None):
+    """
+    Copia consistente (.db.gz, ver src/backup.py) de cada hogar en ``directorio``.
+    Devuelve {hogar: ruta de la copia}.
+    """
+    from src import backup
+
+    os.makedirs(directorio, exist_ok=True)
+    copias = {}
+    for hogar in hogares or [h["hogar"] for h in list_households()]:
+        destino = os.path.join(directorio, f"{hogar}.db.gz")
+        with use_household(hogar), open(destino, "wb") as f:
+            backup.create_backup(f)
+        copias[hogar] = destino
+    return copias
@@ -0,0 +1,174 @@
+"""
+Instrumentación opcional de la capa de datos.
+
+Cuando está activa registra, por cada función pública de db.py y por cada
+sentencia SQL: número de llamadas, tiempo total y máximo y filas devueltas.
+Las sentencias que superan ``SLOW_QUERY_MS`` se guardan en un registro de
+consultas lentas junto con su EXPLAIN QUERY PLAN.
+
+Se activa con la variable de entorno FOODCALENDAR_QUERY_STATS=1 o con
+db.set_query_stats_enabled(True). Desactivada no añade coste a las consultas.
+"""
+import functools
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+enabled = os.environ.get("FOODCALENDAR_QUERY_STATS", "") == "1"
+SLOW_QUERY_MS = float(os.environ.get("FOODCALENDAR_SLOW_QUERY_MS", "50"))
+SLOW_LOG_SIZE = 100
+
+_lock = threading.Lock()
+_functions = {}     # {nombre: [llamadas, total_ms, max_ms, filas]}
+_statements = {}    # {sql_normalizado: [llamadas, total_ms, max_ms, filas]}
+_slow_log = deque(maxlen=SLOW_LOG_SIZE)
+
+_SPACES = re.compile(r"\s+")
+
+
+def _normalize(sql):
+    return _SPACES.sub(" ", sql).strip()
+
+
+def _record(tabla, clave, ms, filas):
+    with _lock:
+        stats = tabla.get(clave)
+        if stats is None:
+            tabla[clave] = [1, ms, ms, filas]
+        else:
+            stats[0] += 1
+            stats[1] += ms
+            stats[2] = max(stats[2], ms)
+            stats[3] += filas
+
+
+def _count_rows(resultado):
+    if isinstance(resultado, (list, dict, set, tuple)):
+        return len(resultado)
+    return 0
+
+
+# --- FUNCIONES ---
+def instrument_function(nombre, func):
+    """Envuelve ``func`` para que cuente llamadas y tiempos cuando la instrumentación está activa"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not enabled:
+            return func(*args, **kwargs)
+        t0 = time.perf_counter()
+        resultado = func(*args, **kwargs)
+        _record(_functions, nombre, (time.perf_counter() - t0) * 1000, _count_rows(resultado))
+        return resultado
+    return wrapper
+
+
+# --- SENTENCIAS SQL ---
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor que mide cada sentencia; las filas y el tiempo de fetch se suman a la última"""
+
+    _last = None
+
+    def _measure(self, metodo, sql, params):
+        t0 = time.perf_counter()
+        resultado = metodo(self, sql, params)
+        ms = (time.perf_counter() - t0) * 1000
+        self._last = (_normalize(sql), sql, params, ms)
+        _record(_statements, self._last[0], ms, 0)
+        if ms >= SLOW_QUERY_MS:
+            self._log_slow(0)
+        return resultado
+
+    def execute(self, sql, params=()):
+        return self._measure(sqlite3.Cursor.execute, sql, params)
+
+    def executemany(self, sql, seq_params):
+        return self._measure(sqlite3.Cursor.executemany, sql, seq_params)
+
+    def _fetched(self, filas, ms):
+        if self._last is None:
+            return
+        clave, sql, params, ms_previo = self._last
+        ms_total = ms_previo + ms
+        self._last = (clave, sql, params, ms_total)
+        with _lock:
+            stats = _statements.get(clave)
+            if stats is None:   # se reiniciaron las estadísticas entre execute y fetch
+                return
+            stats[1] += ms
+            stats[2] = max(stats[2], ms_total)
+            stats[3] += filas
+        if ms_previo < SLOW_QUERY_MS <= ms_total:
+            self._log_slow(filas)
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        filas = super().fetchall()
+        self._fetched(len(filas), (time.perf_counter() - t0) * 1000)
+        return filas
+
+    def fetchone(self):
+        t0 = time.perf_counter()
+        fila = super().fetchone()
+        self._fetched(1 if fila is not None else 0, (time.perf_counter() - t0) * 1000)
+        return fila
+
+    def _log_slow(self, filas):
+        clave, sql, params, ms = self._last
+        plan = []
+        if isinstance(params, (tuple, list, dict)):
+            try:
+                plan = [row[-1] for row in
+                        sqlite3.Cursor.execute(self.connection.cursor(sqlite3.Cursor),
+                                               "EXPLAIN QUERY PLAN " + sql, params)]
+            except sqlite3.Error:
+                pass
+        with _lock:
+            _slow_log.append({
+                "sql": clave,
+                "params": repr(params)[:200],
+                "ms": round(ms, 3),
+                "filas": filas,
+                "plan": plan,
+                "momento": time.strftime("%H:%M:%S"),
+            })
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_params):
+        return self.cursor().executemany(sql, seq_params)
+
+
+# --- CONSULTA Y RESET ---
+def _as_rows(tabla):
+    filas = [
+        {"nombre": nombre, "llamadas": n, "total_ms": round(total, 3),
+         "media_ms": round(total / n, 3) if n else 0.0, "max_ms": round(maximo, 3), "filas": filas}
+        for nombre, (n, total, maximo, filas) in tabla.items()
+    ]
+    return sorted(filas, key=lambda r: r["total_ms"], reverse=True)
+
+
+def get_stats():
+    """Devuelve {'funciones': [...], 'consultas': [...], 'lentas': [...]}, ordenado por tiempo total"""
+    with _lock:
+        return {
+            "funciones": _as_rows(_functions),
+            "consultas": _as_rows(_statements),
+            "lentas": list(_slow_log),
+        }
+
+
+def reset_stats():
+    with _lock:
+        _functions.clear()
+        _statements.clear()
+        _slow_log.clear()
@@ -1,11 +1,73 @@
-from datetime import timedelta
+from datetime import date, timedelta
 from collections import Counter
 
 
+# Unidades admitidas: unidad -> (unidad base, factor). Las cantidades se suman
+# siempre en la unidad base (gramos, mililitros o unidades)
+UNIDADES = {
+    "g": ("g", 1.0),
+    "kg": ("g", 1000.0),
+    "mg": ("g", 0.001),
+    "ml": ("ml", 1.0),
+    "cl": ("ml", 10.0),
+    "l": ("ml", 1000.0),
+    "ud": ("ud", 1.0),
+}
+
+
+# Momentos del día del planificador, en el orden en que se muestran
+MOMENTOS = ["Desayuno", "Media Mañana", "Comida", "Media Tarde", "Cena", "Compra General"]
+
+
+# Horizontes del planificador: número de semanas, o "mes" para el mes natural
+PLANNER_HORIZONS = {
+    "1 semana": 1,
+    "2 semanas": 2,
+    "4 semanas": 4,
+    "Mes": "mes",
+}
+
+
 def get_start_of_week(date_obj):
     return date_obj - timedelta(days=date_obj.weekday())
 
 
+def get_month_of_week(start_of_week):
+    """Mes al que pertenece una semana: el de su jueves (criterio ISO)"""
+    jueves = start_of_week + timedelta(days=3)
+    return jueves.year, jueves.month
+
+
+def get_month_range(year, month):
+    """Lunes de la primera y domingo de la última semana cuyo jueves cae en el mes"""
+    primero = date(year, month, 1)
+    siguiente = date(year + (month == 12), month % 12 + 1, 1)
+    # Si el día 1 cae de viernes a domingo, esa semana pertenece al mes anterior
+    inicio = get_start_of_week(primero)
+    if primero.weekday() > 3:
+        inicio += timedelta(days=7)
+    fin = get_start_of_week(siguiente)
+    if siguiente.weekday() > 3:
+        fin += timedelta(days=7)
+    return inicio, fin - timedelta(days=1)
+
+
+def get_planner_range(start_of_week, horizonte):
+    """Devuelve (inicio, fin) del rango que muestra el planificador"""
+    if horizonte == "mes":
+        return get_month_range(*get_month_of_week(start_of_week))
+    return start_of_week, start_of_week + timedelta(days=7 * horizonte - 1)
+
+
+def shift_planner_range(start_of_week, horizonte, pasos):
+    """Lunes inicial del rango desplazado ``pasos`` rangos adelante/atrás"""
+    if horizonte == "mes":
+        year, month = get_month_of_week(start_of_week)
+        indice = year * 12 + (month - 1) + pasos
+        return get_month_range(indice // 12, indice % 12 + 1)[0]
+    return start_of_week + timedelta(days=7 * horizonte * pasos)
+
+
 def extract_ingredients_from_plan(plan_data, db_module):
     """
     plan_data ahora viene como [(fecha, momento, receta_id, receta_nombre)...]
@@ -25,4 +87,105 @@ def extract_ingredients_from_plan(plan_data, db_module):
 
 
 def aggregate_ingredients(ingredient_list):
-    return Counter(ingredient_list)
\ No newline at end of file
+    return Counter(ingredient_list)
+
+
+def aggregate_quantities(recipe_servings, recipe_links, ingredients):
+    """
+    Suma de cantidades para la lista de la compra, vectorizada con pandas/NumPy.
+
+    - ``recipe_servings``: [(receta_id, comidas, raciones)...] (db.get_recipe_servings)
+    - ``recipe_links``: [(receta_id, ingrediente_id, cantidad, unidad)...] (db.get_recipe_links)
+    - ``ingredients``: [(ingrediente_id, nombre, categoria)...] (db.get_all_ingredients)
+
+    Devuelve [(ingrediente_id, nombre, categoria, veces, cantidad, unidad_base)...]
+    ordenado por categoría y nombre. Un ingrediente sin cantidad en alguna receta
+    aparece con cantidad None; si se usa con unidades de distinto tipo (g y ud),
+    sale una fila por cada tipo.
+    """
+    import numpy as np
+    import pandas as pd
+
+    if not recipe_servings or not recipe_links:
+        return []
+    receta_ids, comidas, raciones = (np.asarray(col) for col in zip(*recipe_servings))
+    enlace_receta, enlace_ing, cantidad, unidad = zip(*recipe_links)
+
+    # Cada enlace con las comidas y raciones de su receta en el rango (-1: no planificada)
+    pos = pd.Index(receta_ids).get_indexer(enlace_receta)
+    usados = pos >= 0
+    if not usados.any():
+        return []
+
+    # Normalización de unidades: se resuelve una vez por unidad distinta (son
+    # pocas) y se reparte a las filas con sus códigos. Una unidad desconocida
+    # ("taza") se suma tal cual, sin convertir.
+    codigos, unidades = pd.factorize(np.asarray(unidad, dtype=object))
+    unidades = [u.strip().lower() for u in unidades.tolist()] + [""]   # el código -1 (sin unidad) cae en el último
+    bases, factores = zip(*(UNIDADES.get(u, (u, 1.0)) for u in unidades))
+    codigos_base, bases = pd.factorize(pd.Series(bases))
+    bases = bases.tolist()
+
+    pos = pos[usados]
+    ing = np.asarray(enlace_ing)[usados]
+    base = codigos_base[codigos][usados]
+    total = np.asarray(cantidad, dtype=float)[usados] * np.asarray(factores)[codigos][usados] * raciones[pos]
+
+    # Suma por (ingrediente, unidad base), con ambos codificados en un solo entero
+    claves, grupo = np.unique(ing.astype(np.int64) * len(bases) + base, return_inverse=True)
+    grupo = grupo.ravel()
+    veces = np.bincount(grupo, weights=comidas[pos])
+    suma = np.bincount(grupo, weights=np.nan_to_num(total))
+    # Si alguna receta no indica cantidad, el total no sería fiable
+    sin_cantidad = np.bincount(grupo, weights=np.isnan(total)) > 0
+
+    # Nombres y orden (categoría, nombre): el resultado ya es pequeño, basta con Python
+    nombres = {ing_id: (nombre, categoria or "Otros") for ing_id, nombre, categoria in ingredients}
+    rango = {ing_id: k for k, ing_id in enumerate(sorted(nombres, key=lambda i: (nombres[i][1], nombres[i][0])))}
+    filas = []
+    for clave, n, q, nulo in zip(claves.tolist(), veces.tolist(), suma.tolist(), sin_cantidad.tolist()):
+        ing_id, b = divmod(clave, len(bases))
+        if ing_id in nombres:
+            nombre, categoria = nombres[ing_id]
+            filas.append((ing_id, nombre, categoria, int(n), None if nulo else q, bases[b] or None))
+    filas.sort(key=lambda f: (rango[f[0]], f[5] or ""))
+    return filas
+
+
+def aggregate_quantities_plain(recipe_servings, recipe_links, ingredients):
+    """
+    Mismo resultado que aggregate_quantities, en Python puro: sin importar
+    pandas ni NumPy (CLI y scripts, donde pesa más el arranque que la suma).
+    """
+    planificadas = {receta_id: (comidas, raciones) for receta_id, comidas, raciones in recipe_servings}
+    grupos = {}   # {(ingrediente_id, unidad_base): [veces, suma, sin_cantidad]}
+    for receta_id, ing_id, cantidad, unidad in recipe_links:
+        uso = planificadas.get(receta_id)
+        if uso is None:
+            continue
+        u = (unidad or "").strip().lower()
+        base, factor = UNIDADES.get(u, (u, 1.0))
+        grupo = grupos.setdefault((ing_id, base), [0, 0.0, False])
+        grupo[0] += uso[0]
+        if cantidad is None:
+            grupo[2] = True
+        else:
+            grupo[1] += cantidad * factor * uso[1]
+
+    nombres = {ing_id: (nombre, categoria or "Otros") for ing_id, nombre, categoria in ingredients}
+    filas = [(ing_id, *nombres[ing_id], int(veces), None if nulo else suma, base or None)
+             for (ing_id, base), (veces, suma, nulo) in grupos.items() if ing_id in nombres]
+    filas.sort(key=lambda f: (f[2], f[1], f[5] or ""))
+    return filas
+
+
+def format_quantity(cantidad, unidad_base):
+    """'1.5 kg', '750 g', '3 ud'... (cadena vacía si no hay cantidad)"""
+    if cantidad is None:
+        return ""
+    if unidad_base == "g" and cantidad >= 1000:
+        cantidad, unidad_base = cantidad / 1000, "kg"
+    elif unidad_base == "ml" and cantidad >= 1000:
+        cantidad, unidad_base = cantidad / 1000, "l"
+    texto = f"{cantidad:.2f}".rstrip("0").rstrip(".")
+    return f"{texto} {unidad_base}" if unidad_base else texto
@@ -0,0 +1,304 @@
+"""
+Migraciones del esquema de la base de datos.
+
+Cada migración sube ``PRAGMA user_version`` en uno. ``migrate`` solo aplica las
+que faltan, dentro de una transacción, así que en una base de datos ya al día
+se reduce a leer un entero de la cabecera del fichero.
+"""
+
+
+def _m001_base_schema(c):
+    # 1. Tabla de Ingredientes Únicos
+    c.execute('''CREATE TABLE IF NOT EXISTS ingredientes
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  categoria TEXT DEFAULT 'Otros',
+                  nombre TEXT UNIQUE)''')
+    # Bases de datos antiguas se crearon sin la columna categoria
+    columnas = [row[1] for row in c.execute("PRAGMA table_info(ingredientes)")]
+    if "categoria" not in columnas:
+        c.execute("ALTER TABLE ingredientes ADD COLUMN categoria TEXT DEFAULT 'Otros'")
+
+    # 2. Tabla de Recetas
+    c.execute('''CREATE TABLE IF NOT EXISTS recetas
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  nombre TEXT UNIQUE)''')
+
+    # 3. Tabla Intermedia (Muchos a Muchos)
+    c.execute('''CREATE TABLE IF NOT EXISTS receta_ingredientes
+                 (receta_id INTEGER,
+                  ingrediente_id INTEGER,
+                  FOREIGN KEY(receta_id) REFERENCES recetas(id) ON DELETE CASCADE,
+                  FOREIGN KEY(ingrediente_id) REFERENCES ingredientes(id) ON DELETE CASCADE,
+                  PRIMARY KEY (receta_id, ingrediente_id))''')
+
+    # 4. Tabla de Planificación (Calendario)
+    c.execute('''CREATE TABLE IF NOT EXISTS planificacion
+                 (fecha TEXT,
+                  momento TEXT,
+                  receta_id INTEGER,
+                  FOREIGN KEY(receta_id) REFERENCES recetas(id) ON DELETE SET NULL,
+                  PRIMARY KEY (fecha, momento))''')
+
+    # 5. Estado (tachado/no tachado) de la lista de la compra por semana
+    c.execute('''CREATE TABLE IF NOT EXISTS compras_estado
+                 (semana_inicio TEXT,
+                  ingrediente_nombre TEXT,
+                  comprado BOOLEAN,
+                  PRIMARY KEY (semana_inicio, ingrediente_nombre))''')
+
+
+def _m002_secondary_indexes(c):
+    # ON DELETE CASCADE al borrar un ingrediente busca por ingrediente_id
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_receta_ingredientes_ingrediente
+                 ON receta_ingredientes (ingrediente_id)''')
+    # ON DELETE SET NULL al borrar una receta busca por receta_id
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_planificacion_receta
+                 ON planificacion (receta_id)''')
+    # Índice cubriente para el rango de fechas de get_plan_range_details:
+    # la consulta se resuelve sin tocar la tabla
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_planificacion_fecha_cubriente
+                 ON planificacion (fecha, momento, receta_id)''')
+
+
+def _m003_special_recipes(c):
+    # Receta especial "Compra" (lista general), antes creada en cada render de recetas
+    c.execute("INSERT OR IGNORE INTO recetas (nombre) VALUES ('Compra')")
+
+
+# Lunes de la semana de una fecha 'YYYY-MM-DD' (el domingo pertenece a la semana anterior)
+def _week_of(col):
+    return f"date({col}, 'weekday 0', '-6 days')"
+
+
+# Recalcula desde cero la lista de la compra materializada
+REBUILD_WEEKLY_SHOPPING = [
+    "DELETE FROM compra_semanal",
+    f'''INSERT INTO compra_semanal (semana_inicio, ingrediente_id, veces)
+        SELECT {_week_of("p.fecha")}, ri.ingrediente_id, COUNT(*)
+        FROM planificacion p
+        JOIN receta_ingredientes ri ON ri.receta_id = p.receta_id
+        GROUP BY 1, 2''',
+]
+
+
+def _m004_weekly_shopping(c):
+    # Lista de la compra materializada: (semana, ingrediente) -> veces.
+    # Los triggers la mantienen al día de forma incremental.
+    c.execute('''CREATE TABLE IF NOT EXISTS compra_semanal
+                 (semana_inicio TEXT NOT NULL,
+                  ingrediente_id INTEGER NOT NULL,
+                  veces INTEGER NOT NULL,
+                  PRIMARY KEY (semana_inicio, ingrediente_id)) WITHOUT ROWID''')
+
+    # --- planificacion: una comida más/menos suma/resta sus ingredientes en su semana ---
+    suma_nueva = f'''
+        INSERT INTO compra_semanal (semana_inicio, ingrediente_id, veces)
+            SELECT {_week_of("NEW.fecha")}, ri.ingrediente_id, 1
+            FROM receta_ingredientes ri WHERE ri.receta_id = NEW.receta_id
+            ON CONFLICT (semana_inicio, ingrediente_id) DO UPDATE SET veces = veces + 1;'''
+    resta_vieja = f'''
+        UPDATE compra_semanal SET veces = veces - 1
+            WHERE semana_inicio = {_week_of("OLD.fecha")}
+              AND ingrediente_id IN (SELECT ingrediente_id FROM receta_ingredientes
+                                     WHERE receta_id = OLD.receta_id);
+        DELETE FROM compra_semanal
+            WHERE semana_inicio = {_week_of("OLD.fecha")} AND veces <= 0;'''
+
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_plan_compra_ins
+                  AFTER INSERT ON planificacion WHEN NEW.receta_id IS NOT NULL
+                  BEGIN {suma_nueva} END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_plan_compra_del
+                  AFTER DELETE ON planificacion WHEN OLD.receta_id IS NOT NULL
+                  BEGIN {resta_vieja} END""")
+    # Cubre también el ON DELETE SET NULL al borrar una receta
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_plan_compra_upd
+                  AFTER UPDATE OF fecha, receta_id ON planificacion
+                  BEGIN {resta_vieja} {suma_nueva} END""")
+
+    # --- receta_ingredientes: un ingrediente más/menos en una receta afecta a
+    # todas las semanas en las que está planificada ---
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_receta_ing_compra_ins
+                  AFTER INSERT ON receta_ingredientes
+                  BEGIN
+                    INSERT INTO compra_semanal (semana_inicio, ingrediente_id, veces)
+                        SELECT {_week_of("p.fecha")}, NEW.ingrediente_id, COUNT(*)
+                        FROM planificacion p WHERE p.receta_id = NEW.receta_id
+                        GROUP BY 1
+                        ON CONFLICT (semana_inicio, ingrediente_id) DO UPDATE SET veces = veces + excluded.veces;
+                  END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_receta_ing_compra_del
+                  AFTER DELETE ON receta_ingredientes
+                  BEGIN
+                    UPDATE compra_semanal SET veces = veces - (
+                            SELECT COUNT(*) FROM planificacion p
+                            WHERE p.receta_id = OLD.receta_id
+                              AND {_week_of("p.fecha")} = compra_semanal.semana_inicio)
+                        WHERE ingrediente_id = OLD.ingrediente_id
+                          AND semana_inicio IN (SELECT {_week_of("fecha")} FROM planificacion
+                                                WHERE receta_id = OLD.receta_id);
+                    DELETE FROM compra_semanal
+                        WHERE ingrediente_id = OLD.ingrediente_id AND veces <= 0;
+                  END""")
+
+    # --- ingredientes: al borrar uno desaparece de todas las semanas ---
+    c.execute("""CREATE TRIGGER IF NOT EXISTS trg_ingrediente_compra_del
+                 AFTER DELETE ON ingredientes
+                 BEGIN
+                   DELETE FROM compra_semanal WHERE ingrediente_id = OLD.id;
+                 END""")
+
+    # Bases de datos existentes: se rellena con la planificación actual
+    for sql in REBUILD_WEEKLY_SHOPPING:
+        c.execute(sql)
+
+
+# Semanas como enteros: número de semanas desde el lunes 1970-01-05
+WEEK_EPOCH = "1970-01-05"
+
+
+def _week_number(col):
+    return f"CAST((julianday({col}) - julianday('{WEEK_EPOCH}')) / 7 AS INTEGER)"
+
+
+def _m005_integer_shopping_status(c):
+    # compras_estado pasa de (semana TEXT, nombre TEXT) a enteros con clave
+    # foránea: filas más pequeñas, JOIN por id y sobrevive a renombrar
+    c.execute("ALTER TABLE compras_estado RENAME TO compras_estado_v4")
+    c.execute('''CREATE TABLE compras_estado
+                 (semana INTEGER NOT NULL,
+                  ingrediente_id INTEGER NOT NULL
+                      REFERENCES ingredientes(id) ON DELETE CASCADE,
+                  comprado INTEGER NOT NULL DEFAULT 0,
+                  PRIMARY KEY (semana, ingrediente_id)) WITHOUT ROWID''')
+    # Las casillas de ingredientes que ya no existen se descartan
+    c.execute(f'''INSERT OR REPLACE INTO compras_estado (semana, ingrediente_id, comprado)
+                  SELECT {_week_number("v.semana_inicio")}, i.id, COALESCE(v.comprado, 0)
+                  FROM compras_estado_v4 v
+                  JOIN ingredientes i ON i.nombre = v.ingrediente_nombre
+                  WHERE v.semana_inicio IS NOT NULL''')
+    c.execute("DROP TABLE compras_estado_v4")
+    # ON DELETE CASCADE al borrar un ingrediente busca por ingrediente_id
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_compras_estado_ingrediente
+                 ON compras_estado (ingrediente_id)''')
+
+
+def _m006_quantities_and_servings(c):
+    # Cantidad y unidad por ingrediente de cada receta (NULL = sin indicar) y
+    # raciones por comida planificada. Los triggers de compra_semanal no miran
+    # estas columnas: siguen contando veces.
+    c.execute("ALTER TABLE receta_ingredientes ADD COLUMN cantidad REAL")
+    c.execute("ALTER TABLE receta_ingredientes ADD COLUMN unidad TEXT")
+    c.execute("ALTER TABLE planificacion ADD COLUMN raciones REAL NOT NULL DEFAULT 1")
+
+
+# Índices de texto completo sobre los nombres. unicode61 con remove_diacritics
+# ignora mayúsculas y tildes; prefix acelera las búsquedas "tom*".
+SEARCH_TABLES = {"ingredientes_fts": "ingredientes", "recetas_fts": "recetas"}
+
+
+def _m007_search_index(c):
+    for fts, tabla in SEARCH_TABLES.items():
+        c.execute(f"""CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                          nombre, content='{tabla}', content_rowid='id',
+                          tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')""")
+        # Sincronización con la tabla (patrón de tablas de contenido externo de FTS5)
+        c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_{fts}_ins AFTER INSERT ON {tabla}
+                      BEGIN
+                        INSERT INTO {fts} (rowid, nombre) VALUES (NEW.id, NEW.nombre);
+                      END""")
+        c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_{fts}_del AFTER DELETE ON {tabla}
+                      BEGIN
+                        INSERT INTO {fts} ({fts}, rowid, nombre) VALUES ('delete', OLD.id, OLD.nombre);
+                      END""")
+        c.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_{fts}_upd AFTER UPDATE OF nombre ON {tabla}
+                      BEGIN
+                        INSERT INTO {fts} ({fts}, rowid, nombre) VALUES ('delete', OLD.id, OLD.nombre);
+                        INSERT INTO {fts} (rowid, nombre) VALUES (NEW.id, NEW.nombre);
+                      END""")
+        c.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+
+def _m008_ingredients_category_index(c):
+    # Listado paginado por (nombre, id) filtrando por categoría
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_ingredientes_categoria_nombre
+                 ON ingredientes (categoria, nombre)''')
+
+
+def _m009_row_versions(c):
+    # Versión por fila para escrituras compare-and-set (db.save_meal_plan,
+    # db.update_shopping_statuses con versiones). 0 significa "la fila no
+    # existe", así que las filas nuevas empiezan en 1. Quien escribe sin
+    # comprobar versión también la sube, mediante los triggers
+    c.execute("ALTER TABLE planificacion ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+    c.execute("ALTER TABLE compras_estado ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS trg_plan_version
+                 AFTER UPDATE OF receta_id, raciones ON planificacion
+                 WHEN NEW.version = OLD.version
+                  AND (NEW.receta_id IS NOT OLD.receta_id OR NEW.raciones IS NOT OLD.raciones)
+                 BEGIN
+                   UPDATE planificacion SET version = OLD.version + 1
+                   WHERE fecha = NEW.fecha AND momento = NEW.momento;
+                 END""")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS trg_compras_version
+                 AFTER UPDATE OF comprado ON compras_estado
+                 WHEN NEW.version = OLD.version AND NEW.comprado IS NOT OLD.comprado
+                 BEGIN
+                   UPDATE compras_estado SET version = OLD.version + 1
+                   WHERE semana = NEW.semana AND ingrediente_id = NEW.ingrediente_id;
+                 END""")
+
+
+def _m010_ingredients_nocase_index(c):
+    # Filtro "empieza por" del listado sin distinguir mayúsculas: un rango sobre
+    # nombre COLLATE NOCASE usa este índice (LIKE con la colación BINARY no)
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_ingredientes_nombre_nocase
+                 ON ingredientes (nombre COLLATE NOCASE)''')
+
+
+# Lista ordenada: la posición N (desde 1) corresponde a user_version = N
+MIGRATIONS = [
+    _m001_base_schema,
+    _m002_secondary_indexes,
+    _m003_special_recipes,
+    _m004_weekly_shopping,
+    _m005_integer_shopping_status,
+    _m006_quantities_and_servings,
+    _m007_search_index,
+    _m008_ingredients_category_index,
+    _m009_row_versions,
+    _m010_ingredients_nocase_index,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """
+    Aplica las migraciones pendientes. Devuelve la lista de versiones aplicadas
+    (vacía si el esquema ya estaba al día).
+    """
+    if get_version(conn) >= SCHEMA_VERSION:
+        return []
+
+    conn.commit()
+    c = conn.cursor()
+    # IMMEDIATE: si dos procesos arrancan a la vez, solo uno migra
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        aplicadas = []
+        version = get_version(conn)
+        for numero, migracion in enumerate(MIGRATIONS, start=1):
+            if numero <= version:
+                continue
+            migracion(c)
+            aplicadas.append(numero)
+        c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+        return aplicadas
+    except Exception:
+        conn.rollback()
+        raise
@@ -0,0 +1,132 @@
+"""
+Caché acotada de rangos de planificación con precarga en segundo plano.
+
+Mientras el usuario mira un rango, los rangos vecinos se leen en un hilo aparte,
+de modo que navegar a la semana (o mes) anterior/siguiente se sirve desde memoria.
+Las entradas se marcan con el contador de generación de planificación de db.py
+y dejan de valer en cuanto se confirma una escritura que no sea solo marcar
+casillas de la compra.
+
+La misma caché guarda, aparte, el agregado de la lista de la compra y las
+cantidades sumadas por semana.
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from src import db, logic
+
+MAX_ENTRIES = 32
+# Con pocas recetas planificadas (una semana, un mes) la suma en Python puro es
+# más rápida que pandas y además no obliga a importarlo
+PANDAS_MIN_RECIPES = 200
+
+
+class PlanRangeCache:
+    def __init__(self, loader, max_entries=MAX_ENTRIES):
+        self._loader = loader
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # {(db_path, inicio, fin): (generacion, filas)}
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="plan-prefetch")
+
+    def _key(self, start_date, end_date):
+        return db.get_db_path(), str(start_date), str(end_date)
+
+    def _lookup(self, key):
+        with self._lock:
+            entrada = self._entries.get(key)
+            if entrada is None or entrada[0] != db.get_plan_generation():
+                return None
+            self._entries.move_to_end(key)
+            return entrada[1]
+
+    def _store(self, key, generacion, filas):
+        with self._lock:
+            self._entries[key] = (generacion, filas)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _load(self, key, start_date, end_date):
+        # La generación se lee ANTES de consultar: si llega una escritura
+        # mientras tanto, la entrada nace ya caducada
+        generacion = db.get_plan_generation()
+        filas = self._loader(start_date, end_date) or []
+        self._store(key, generacion, filas)
+        return filas
+
+    def get(self, start_date, end_date):
+        # Antes de mirar la caché: las escrituras en cola de esta sesión
+        # todavía no han subido la generación
+        db.wait_for_own_writes()
+        key = self._key(start_date, end_date)
+        filas = self._lookup(key)
+        if filas is None:
+            filas = self._load(key, start_date, end_date)
+        return filas
+
+    def prefetch(self, ranges):
+        """Encola la lectura en segundo plano de los rangos que aún no estén en caché"""
+        for start_date, end_date in ranges:
+            key = self._key(start_date, end_date)
+            with self._lock:
+                if key in self._pending:
+                    continue
+            if self._lookup(key) is not None:
+                continue
+            with self._lock:
+                self._pending.add(key)
+            self._executor.submit(self._prefetch_one, key, start_date, end_date)
+
+    def _prefetch_one(self, key, start_date, end_date):
+        try:
+            # En el hilo de precarga: la base de datos es la de quien la pidió
+            with db.using_db(key[0]):
+                self._load(key, start_date, end_date)
+        except Exception as e:
+            print(f"Error precargando {start_date}..{end_date}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _load_quantities(start_date, end_date):
+    raciones = db.get_recipe_servings(start_date, end_date)
+    sumar = logic.aggregate_quantities if len(raciones) >= PANDAS_MIN_RECIPES else logic.aggregate_quantities_plain
+    return sumar(raciones, db.get_recipe_links(), db.get_all_ingredients())
+
+
+_cache = PlanRangeCache(db.get_plan_range_details)
+_shopping_cache = PlanRangeCache(db.get_shopping_aggregate)
+_quantities_cache = PlanRangeCache(_load_quantities)
+
+
+def get_plan_range(start_date, end_date):
+    """Igual que db.get_plan_range_details, pero servido desde la caché si es posible"""
+    return _cache.get(start_date, end_date)
+
+
+def get_shopping_aggregate(start_date, end_date):
+    """Igual que db.get_shopping_aggregate, pero servido desde la caché si es posible"""
+    return _shopping_cache.get(start_date, end_date)
+
+
+def get_shopping_quantities(start_date, end_date):
+    """Cantidades sumadas del rango (ver logic.aggregate_quantities), cacheadas"""
+    return _quantities_cache.get(start_date, end_date)
+
+
+def prefetch(ranges):
+    _cache.prefetch(ranges)
+
+
+def clear():
+    _cache.clear()
+    _shopping_cache.clear()
+    _quantities_cache.clear()
@@ -0,0 +1,229 @@
+"""
+Medición ligera del tiempo de cada rerun.
+
+- ``span(nombre)``: context manager que mide un bloque.
+- ``laps(prefijo)``: cronómetro por tramos para medir secciones consecutivas de
+  una vista sin reindentar su código (cada llamada mide desde la anterior).
+- Cada nombre guarda un histograma móvil con las últimas ``WINDOW`` muestras.
+- Utilidades para exportar un cProfile como .pstats o como pilas colapsadas
+  (formato de flamegraph.pl / speedscope).
+- ``import_module(nombre)``: importación diferida que anota cuánto costó la
+  primera vez y qué paquetes nuevos arrastró; junto con ``record_cold_start``
+  forma el informe de arranque, comparado con ``STARTUP_BUDGET_MS``.
+
+No depende de Streamlit: app.py decide cuándo activar cada cosa.
+"""
+import cProfile
+import importlib
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import deque
+
+WINDOW = 500
+# Límites superiores (ms) de los cubos del histograma; el último es "más de"
+BUCKETS_MS = (10, 50, 100, 250, 500, 1000)
+
+# Presupuesto del primer render de una sesión nueva
+STARTUP_BUDGET_MS = float(os.environ.get("FOODCALENDAR_STARTUP_BUDGET_MS", "1000"))
+
+_lock = threading.Lock()
+_samples = {}   # {nombre: deque([ms, ...])}
+_imports = {}   # {modulo: (ms, [paquetes que arrastró])}
+_cold_starts = deque(maxlen=WINDOW)
+_process_start_ms = None   # primera sesión del proceso (módulos aún sin importar)
+
+
+def record(nombre, ms):
+    with _lock:
+        muestras = _samples.get(nombre)
+        if muestras is None:
+            muestras = _samples[nombre] = deque(maxlen=WINDOW)
+        muestras.append(ms)
+
+
+class span:
+    """Mide el bloque ``with`` (también si sale por excepción, p.ej. st.rerun())"""
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.nombre, (time.perf_counter() - self._t0) * 1000)
+        return False
+
+
+def laps(prefijo):
+    """
+    Devuelve una función ``lap(seccion)`` que registra ``prefijo.seccion`` con el
+    tiempo transcurrido desde la vuelta anterior (o desde la creación).
+    """
+    ultimo = [time.perf_counter()]
+
+    def lap(seccion):
+        ahora = time.perf_counter()
+        record(f"{prefijo}.{seccion}", (ahora - ultimo[0]) * 1000)
+        ultimo[0] = ahora
+
+    return lap
+
+
+def _percentile(ordenadas, p):
+    if not ordenadas:
+        return 0.0
+    return ordenadas[min(len(ordenadas) - 1, int(round((len(ordenadas) - 1) * p / 100)))]
+
+
+def get_summary():
+    """Resumen por nombre: n, p50, p95, max y recuento por cubo del histograma"""
+    with _lock:
+        copia = {nombre: sorted(m) for nombre, m in _samples.items()}
+    filas = []
+    for nombre, ordenadas in sorted(copia.items()):
+        fila = {
+            "nombre": nombre,
+            "n": len(ordenadas),
+            "p50_ms": round(_percentile(ordenadas, 50), 2),
+            "p95_ms": round(_percentile(ordenadas, 95), 2),
+            "max_ms": round(ordenadas[-1], 2) if ordenadas else 0.0,
+        }
+        anterior = 0
+        for limite in BUCKETS_MS:
+            fila[f"<{limite}ms"] = sum(1 for ms in ordenadas if anterior <= ms < limite)
+            anterior = limite
+        fila[f">={BUCKETS_MS[-1]}ms"] = sum(1 for ms in ordenadas if ms >= BUCKETS_MS[-1])
+        filas.append(fila)
+    return filas
+
+
+def reset():
+    with _lock:
+        _samples.clear()
+
+
+# --- Arranque ---
+def import_module(nombre):
+    """
+    importlib.import_module que, la primera vez, mide lo que tarda y anota los
+    paquetes de primer nivel que entran con él (p.ej. pandas, numpy).
+    """
+    modulo = sys.modules.get(nombre)
+    if modulo is not None:
+        return modulo
+    antes = set(sys.modules)
+    t0 = time.perf_counter()
+    modulo = importlib.import_module(nombre)
+    ms = (time.perf_counter() - t0) * 1000
+    # Paquetes nuevos por su nombre raíz (pandas); de los que ya estaban
+    # cargados, el submódulo concreto (src.plan_cache)
+    nuevos = set()
+    for m in set(sys.modules) - antes - {nombre}:
+        raiz = m.split(".")[0]
+        nuevos.add(m if raiz in antes else raiz)
+    nuevos = sorted(nuevos)
+    with _lock:
+        _imports.setdefault(nombre, (ms, nuevos))
+    return modulo
+
+
+def record_cold_start(ms):
+    """Primer render de una sesión; el primero del proceso se guarda aparte"""
+    global _process_start_ms
+    with _lock:
+        if _process_start_ms is None:
+            _process_start_ms = ms
+        _cold_starts.append(ms)
+
+
+def get_startup_report():
+    """
+    Informe de arranque: {"sesiones", "p50_ms", "max_ms", "proceso_ms",
+    "presupuesto_ms", "dentro", "importaciones": [{modulo, ms, arrastra}...]}
+    """
+    with _lock:
+        ordenadas = sorted(_cold_starts)
+        proceso = _process_start_ms
+        importaciones = sorted(_imports.items(), key=lambda kv: -kv[1][0])
+    p50 = _percentile(ordenadas, 50)
+    return {
+        "sesiones": len(ordenadas),
+        "p50_ms": round(p50, 1),
+        "max_ms": round(ordenadas[-1], 1) if ordenadas else 0.0,
+        "proceso_ms": round(proceso, 1) if proceso is not None else None,
+        "presupuesto_ms": STARTUP_BUDGET_MS,
+        "dentro": p50 <= STARTUP_BUDGET_MS,
+        "importaciones": [{"modulo": nombre, "ms": round(ms, 1), "arrastra": ", ".join(nuevos)}
+                          for nombre, (ms, nuevos) in importaciones],
+    }
+
+
+# --- cProfile ---
+def new_profiler():
+    return cProfile.Profile()
+
+
+def to_pstats_bytes(profiler):
+    """Contenido de un fichero .pstats (se abre con pstats.Stats, snakeviz, etc.)"""
+    profiler.create_stats()
+    return marshal.dumps(profiler.stats)
+
+
+def to_text(profiler, limite=40):
+    """Top de funciones por tiempo acumulado, como texto"""
+    salida = io.StringIO()
+    pstats.Stats(profiler, stream=salida).sort_stats("cumulative").print_stats(limite)
+    return salida.getvalue()
+
+
+def _label(func):
+    fichero, linea, nombre = func
+    return f"{nombre} ({fichero}:{linea})" if linea else nombre
+
+
+def to_collapsed(profiler, max_depth=64):
+    """
+    Pilas colapsadas ``a;b;c microsegundos`` reconstruidas a partir del grafo
+    llamador->llamado de cProfile. El tiempo de cada función se reparte entre
+    sus llamadores en proporción al tiempo acumulado de cada arista, así que
+    es una aproximación (cProfile no guarda pilas completas).
+    """
+    stats = pstats.Stats(profiler).stats
+    hijos = {}
+    for func, (_, _, _, _, llamadores) in stats.items():
+        for llamador, (_, _, _, ct_arista) in llamadores.items():
+            hijos.setdefault(llamador, []).append((func, ct_arista))
+
+    pesos = {}
+
+    def visitar(func, pila, fraccion):
+        _, _, tt, ct, _ = stats[func]
+        pila = pila + [_label(func)]
+        clave = ";".join(pila)
+        pesos[clave] = pesos.get(clave, 0.0) + tt * fraccion
+        if len(pila) >= max_depth:
+            return
+        for hijo, ct_arista in hijos.get(func, ()):
+            ct_hijo = stats[hijo][3]
+            if ct_hijo <= 0 or _label(hijo) in pila:
+                continue
+            fraccion_hijo = fraccion * min(1.0, ct_arista / ct_hijo)
+            # Ramas despreciables: evita recorrer todos los caminos de grafos grandes
+            if fraccion_hijo * stats[hijo][3] < 1e-6:
+                continue
+            visitar(hijo, pila, fraccion_hijo)
+
+    raices = [func for func, datos in stats.items() if not datos[4]]
+    for raiz in raices:
+        visitar(raiz, [], 1.0)
+
+    # Peso en microsegundos (enteros, como espera flamegraph.pl)
+    return "\n".join(f"{pila} {int(segundos * 1e6)}"
+                     for pila, segundos in sorted(pesos.items()) if segundos * 1e6 >= 1)
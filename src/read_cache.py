@@ -0,0 +1,75 @@
+"""
+Caché de lecturas compartida por todas las sesiones.
+
+Cada entrada se guarda con la generación de datos vigente cuando se leyó; si la
+generación ha cambiado desde entonces, la entrada no vale y se vuelve a leer.
+El tamaño está acotado (se descarta la entrada usada hace más tiempo) y se
+cuentan aciertos y fallos.
+
+Este módulo no conoce db.py: db.py decide qué funciones pasan por aquí y con
+qué contador de generación.
+"""
+import copy
+import os
+import threading
+from collections import OrderedDict
+
+MAX_ENTRIES = int(os.environ.get("FOODCALENDAR_READ_CACHE_SIZE", "256"))
+
+
+class ReadCache:
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # {clave: (generacion, valor)}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, clave, generacion, loader):
+        """
+        Devuelve el valor de ``clave`` si se leyó en la generación ``generacion``;
+        si no, llama a ``loader()`` y lo guarda. Se entrega una copia, para que
+        quien lo reciba pueda modificarlo sin afectar a otras sesiones.
+        """
+        if self.max_entries <= 0:
+            return loader()
+        with self._lock:
+            entrada = self._entries.get(clave)
+            if entrada is not None and entrada[0] == generacion:
+                self._entries.move_to_end(clave)
+                self.hits += 1
+                return copy.copy(entrada[1])
+            self.misses += 1
+        valor = loader()
+        # Un error de lectura (None) no se guarda
+        if valor is not None:
+            with self._lock:
+                self._entries[clave] = (generacion, valor)
+                self._entries.move_to_end(clave)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return copy.copy(valor)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "aciertos": self.hits,
+                "fallos": self.misses,
+                "tasa_aciertos": round(self.hits / total, 3) if total else 0.0,
+                "entradas": len(self._entries),
+                "max_entradas": self.max_entries,
+            }
+
+    def resize(self, max_entries):
+        with self._lock:
+            self.max_entries = max_entries
+            while len(self._entries) > max(0, max_entries):
+                self._entries.popitem(last=False)
+
+    def clear(self, reset_stats=False):
+        with self._lock:
+            self._entries.clear()
+            if reset_stats:
+                self.hits = 0
+                self.misses = 0
@@ -0,0 +1,304 @@
+"""
+Importación y exportación masiva en CSV y JSON Lines.
+
+Tres tipos de datos, cada uno con sus columnas:
+
+    ingredientes   nombre, categoria
+    recetas        receta, ingrediente, cantidad, unidad   (una fila por ingrediente)
+    plan           fecha, momento, receta, raciones
+
+La exportación lee por páginas de BATCH_SIZE filas, ordenadas por clave, y
+escribe según lee: la memoria no depende del tamaño del catálogo y la conexión
+vuelve al pool entre página y página, aunque quien consuma el generador tarde
+(una descarga lenta) o lo abandone a medias. La importación lee por lotes,
+resuelve los nombres a ids con una consulta por lote y escribe con
+executemany; todo el fichero va en una única transacción. Las filas que no valen no detienen la
+importación: se devuelven con su número de línea y el motivo.
+"""
+import csv
+import io
+import json
+from datetime import date
+
+from src import db, logic
+
+FORMATOS = ("csv", "jsonl")
+COLUMNAS = {
+    "ingredientes": ("nombre", "categoria"),
+    "recetas": ("receta", "ingrediente", "cantidad", "unidad"),
+    "plan": ("fecha", "momento", "receta", "raciones"),
+}
+BATCH_SIZE = 1000
+# Límite de parámetros por consulta al resolver nombres (SQLite antiguos: 999)
+MAX_PARAMS = 900
+# Errores que se devuelven con detalle; el resto solo se cuentan
+MAX_ERRORS = 200
+
+# Consulta de cada exportación y su clave (las primeras columnas de cada fila,
+# únicas): {despues} es la condición de "después de la última fila leída"
+_EXPORT_SQL = {
+    "ingredientes": ("""SELECT nombre, COALESCE(categoria, 'Otros') FROM ingredientes
+                        WHERE {despues} ORDER BY nombre LIMIT ?""", ("nombre",)),
+    "recetas": ("""SELECT r.nombre, i.nombre, ri.cantidad, ri.unidad
+                   FROM receta_ingredientes ri
+                   JOIN recetas r ON r.id = ri.receta_id
+                   JOIN ingredientes i ON i.id = ri.ingrediente_id
+                   WHERE {despues}
+                   ORDER BY r.nombre, i.nombre LIMIT ?""", ("r.nombre", "i.nombre")),
+    "plan": ("""SELECT p.fecha, p.momento, r.nombre, p.raciones
+                FROM planificacion p JOIN recetas r ON r.id = p.receta_id
+                WHERE p.fecha BETWEEN ? AND ? AND {despues}
+                ORDER BY p.fecha, p.momento LIMIT ?""", ("p.fecha", "p.momento")),
+}
+
+
+class TransferError(Exception):
+    pass
+
+
+def _check(tipo, formato):
+    if tipo not in COLUMNAS:
+        raise TransferError(f"Tipo desconocido: {tipo} (válidos: {', '.join(COLUMNAS)})")
+    if formato not in FORMATOS:
+        raise TransferError(f"Formato desconocido: {formato} (válidos: {', '.join(FORMATOS)})")
+
+
+# --- EXPORTACIÓN ---
+def iter_export(tipo, formato, inicio=None, fin=None):
+    """
+    Genera el fichero de exportación línea a línea (texto). Para ``plan`` se
+    puede acotar el rango de fechas; sin límites sale todo.
+    """
+    _check(tipo, formato)
+    columnas = COLUMNAS[tipo]
+    params = (str(inicio or "0000-01-01"), str(fin or "9999-12-31")) if tipo == "plan" else ()
+
+    if formato == "csv":
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer, lineterminator="\n")
+
+        def linea(valores):
+            escritor.writerow(valores)
+            texto = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return texto
+
+        yield linea(columnas)
+    else:
+        def linea(valores):
+            return json.dumps(dict(zip(columnas, valores)), ensure_ascii=False) + "\n"
+
+    sql, clave = _EXPORT_SQL[tipo]
+    ultima = None
+    while True:
+        despues = "1" if ultima is None else f"({', '.join(clave)}) > ({', '.join('?' * len(clave))})"
+        with db.get_connection() as conn:
+            pagina = conn.execute(sql.format(despues=despues),
+                                  params + (ultima or ()) + (BATCH_SIZE,)).fetchall()
+        for fila in pagina:
+            yield linea(fila)
+        if len(pagina) < BATCH_SIZE:
+            return
+        ultima = tuple(pagina[-1][:len(clave)])
+
+
+def write_export(tipo, formato, destino, inicio=None, fin=None):
+    """Escribe la exportación en ``destino`` (fichero de texto). Devuelve el número de filas."""
+    filas = -1 if formato == "csv" else 0
+    for texto in iter_export(tipo, formato, inicio, fin):
+        destino.write(texto)
+        filas += 1
+    return filas
+
+
+def export_bytes(tipo, formato, inicio=None, fin=None):
+    """Exportación completa como bytes UTF-8 (para st.download_button con datos diferidos)"""
+    salida = io.BytesIO()
+    texto = io.TextIOWrapper(salida, encoding="utf-8", newline="")
+    write_export(tipo, formato, texto, inicio, fin)
+    texto.flush()
+    return salida.getvalue()
+
+
+# --- IMPORTACIÓN ---
+def read_rows(formato, origen):
+    """
+    Lee ``origen`` (fichero de texto) de forma incremental.
+    Genera (linea, fila), donde fila es un dict o un mensaje de error (str).
+    """
+    if formato not in FORMATOS:
+        raise TransferError(f"Formato desconocido: {formato} (válidos: {', '.join(FORMATOS)})")
+    if formato == "csv":
+        lector = csv.DictReader(origen)
+        for fila in lector:
+            if None in fila:
+                yield lector.line_num, "Hay más valores que columnas"
+            else:
+                yield lector.line_num, fila
+        return
+    for n, texto in enumerate(origen, start=1):
+        if not texto.strip():
+            continue
+        try:
+            fila = json.loads(texto)
+        except ValueError as e:
+            yield n, f"JSON no válido: {e}"
+            continue
+        yield n, fila if isinstance(fila, dict) else "Se esperaba un objeto JSON"
+
+
+def _text(fila, campo, obligatorio=True):
+    valor = fila.get(campo)
+    valor = "" if valor is None else str(valor).strip()
+    if obligatorio and not valor:
+        raise ValueError(f"Falta '{campo}'")
+    return valor or None
+
+
+def _number(fila, campo, defecto=None):
+    valor = fila.get(campo)
+    if valor is None or (isinstance(valor, str) and not valor.strip()):
+        return defecto
+    try:
+        numero = float(valor)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{campo}' no es un número: {valor!r}")
+    if numero != numero or numero < 0:
+        raise ValueError(f"'{campo}' tiene que ser un número no negativo: {valor!r}")
+    return numero
+
+
+def _resolve(conn, tabla, nombres):
+    """{nombre: id} de los nombres que existen en ``tabla``, en bloques de MAX_PARAMS"""
+    nombres = list(nombres)
+    ids = {}
+    for i in range(0, len(nombres), MAX_PARAMS):
+        bloque = nombres[i:i + MAX_PARAMS]
+        marcas = ",".join("?" * len(bloque))
+        ids.update((nombre, id_) for id_, nombre in
+                   conn.execute(f"SELECT id, nombre FROM {tabla} WHERE nombre IN ({marcas})", bloque))
+    return ids
+
+
+def _import_ingredients(conn, lote, fallo):
+    valores = []
+    for linea, fila in lote:
+        try:
+            valores.append((_text(fila, "nombre"), _text(fila, "categoria", False) or "Otros"))
+        except ValueError as e:
+            fallo(linea, e)
+    conn.executemany("""INSERT INTO ingredientes (nombre, categoria) VALUES (?, ?)
+                        ON CONFLICT (nombre) DO UPDATE SET categoria = excluded.categoria""", valores)
+    return len(valores)
+
+
+def _import_recipes(conn, lote, fallo):
+    validas = []
+    for linea, fila in lote:
+        try:
+            unidad = _text(fila, "unidad", False)
+            if unidad is not None and unidad not in logic.UNIDADES:
+                raise ValueError(f"Unidad desconocida: {unidad}")
+            validas.append((linea, _text(fila, "receta"), _text(fila, "ingrediente"),
+                            _number(fila, "cantidad"), unidad))
+        except ValueError as e:
+            fallo(linea, e)
+
+    # Las recetas se crean si no existen; los ingredientes tienen que existir
+    ingredientes = _resolve(conn, "ingredientes", {v[2] for v in validas})
+    enlazables = []
+    for v in validas:
+        if v[2] in ingredientes:
+            enlazables.append(v)
+        else:
+            fallo(v[0], f"Ingrediente desconocido: {v[2]}")
+    conn.executemany("INSERT INTO recetas (nombre) VALUES (?) ON CONFLICT (nombre) DO NOTHING",
+                     [(nombre,) for nombre in {v[1] for v in enlazables}])
+    recetas = _resolve(conn, "recetas", {v[1] for v in enlazables})
+    conn.executemany("""INSERT INTO receta_ingredientes (receta_id, ingrediente_id, cantidad, unidad)
+                        VALUES (?, ?, ?, ?)
+                        ON CONFLICT (receta_id, ingrediente_id)
+                        DO UPDATE SET cantidad = excluded.cantidad, unidad = excluded.unidad""",
+                     [(recetas[r], ingredientes[i], cantidad, unidad) for _, r, i, cantidad, unidad in enlazables])
+    return len(enlazables)
+
+
+def _import_plan(conn, lote, fallo):
+    validas = []
+    for linea, fila in lote:
+        try:
+            fecha = _text(fila, "fecha")
+            try:
+                fecha = date.fromisoformat(fecha).isoformat()
+            except ValueError:
+                raise ValueError(f"Fecha no válida (AAAA-MM-DD): {fecha}")
+            momento = _text(fila, "momento")
+            if momento not in logic.MOMENTOS:
+                raise ValueError(f"Momento desconocido: {momento} (válidos: {', '.join(logic.MOMENTOS)})")
+            validas.append((linea, fecha, momento, _text(fila, "receta"), _number(fila, "raciones", 1.0)))
+        except ValueError as e:
+            fallo(linea, e)
+
+    recetas = _resolve(conn, "recetas", {v[3] for v in validas})
+    valores = []
+    for linea, fecha, momento, receta, raciones in validas:
+        if receta in recetas:
+            valores.append((fecha, momento, recetas[receta], raciones))
+        else:
+            fallo(linea, f"Receta desconocida: {receta}")
+    conn.executemany("""INSERT INTO planificacion (fecha, momento, receta_id, raciones) VALUES (?, ?, ?, ?)
+                        ON CONFLICT (fecha, momento)
+                        DO UPDATE SET receta_id = excluded.receta_id, raciones = excluded.raciones""", valores)
+    return len(valores)
+
+
+_IMPORTADORES = {
+    "ingredientes": _import_ingredients,
+    "recetas": _import_recipes,
+    "plan": _import_plan,
+}
+
+
+def import_rows(tipo, filas, batch_size=BATCH_SIZE):
+    """
+    Importa ``filas`` (iterable de (linea, dict|mensaje de error), como las de
+    read_rows) en una única transacción. Lo que ya existe se actualiza: el
+    nombre es la clave de ingredientes y recetas, y (fecha, momento) la del plan.
+    Devuelve {"filas", "importadas", "errores": [(linea, motivo)...], "total_errores"}.
+    """
+    if tipo not in COLUMNAS:
+        raise TransferError(f"Tipo desconocido: {tipo} (válidos: {', '.join(COLUMNAS)})")
+    importador = _IMPORTADORES[tipo]
+    resultado = {"filas": 0, "importadas": 0, "errores": [], "total_errores": 0}
+
+    def fallo(linea, motivo):
+        resultado["total_errores"] += 1
+        if len(resultado["errores"]) < MAX_ERRORS:
+            resultado["errores"].append((linea, str(motivo)))
+
+    # Lo que haya en la cola de escrituras va antes que la importación
+    db.flush_writes()
+    with db.transaction() as conn:
+        lote = []
+        for linea, fila in filas:
+            resultado["filas"] += 1
+            if isinstance(fila, str):
+                fallo(linea, fila)
+                continue
+            lote.append((linea, fila))
+            if len(lote) >= batch_size:
+                resultado["importadas"] += importador(conn, lote, fallo)
+                lote = []
+        if lote:
+            resultado["importadas"] += importador(conn, lote, fallo)
+
+    # Recetas e ingredientes han cambiado por debajo del índice en memoria
+    db.invalidate_recipe_graph()
+    resultado["errores"].sort()
+    return resultado
+
+
+def import_file(tipo, formato, origen, batch_size=BATCH_SIZE):
+    """Importa desde un fichero de texto abierto (CSV con cabecera o JSON Lines)"""
+    return import_rows(tipo, read_rows(formato, origen), batch_size)
@@ -0,0 +1,138 @@
+"""
+Cola de escrituras con un único hilo escritor.
+
+Las escrituras se encolan con una clave; si llega otra con la misma clave antes
+de aplicarse, sustituye a la anterior (p.ej. cambiar varias veces la misma
+celda del planificador). db.py incluye la sesión en la clave, así que solo se
+sustituyen escrituras de la misma sesión, que es la que espera por ellas en
+wait_for. El hilo escritor las aplica en grupos, cada grupo en una sola
+transacción, para que los reruns de la interfaz nunca esperen a un COMMIT.
+
+Quien necesita el resultado de su escritura (un compare-and-set que puede
+dar conflicto) pasa un ``concurrent.futures.Future``: se resuelve tras el
+COMMIT del grupo con lo que devolvió la operación o con su excepción.
+
+Este módulo no conoce db.py: recibe una función ``apply_batch(operaciones)``
+que aplica una lista de ``(funcion, args)`` en una transacción y devuelve una
+lista con el resultado de cada una (una excepción si esa operación falló sin
+estropear a las demás) o None.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class WriteQueue:
+    def __init__(self, apply_batch, max_batch=200, max_delay_ms=20):
+        self._apply_batch = apply_batch
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self._pending = OrderedDict()   # {clave: (secuencia, funcion, args, futuros)}
+        self._cond = threading.Condition()
+        self._submitted = 0             # última secuencia encolada
+        self._applied = 0               # todas las secuencias <= esta están aplicadas
+        self._stopping = False
+        self.errors = []
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    @property
+    def thread(self):
+        return self._thread
+
+    def submit(self, clave, funcion, args, futuro=None):
+        """Encola una escritura y devuelve su número de secuencia. ``futuro`` recibe su resultado"""
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError("La cola de escrituras está detenida")
+            self._submitted += 1
+            # Si sustituye a otra, quien esperaba aquella recibe el resultado de esta
+            anterior = self._pending.get(clave)
+            futuros = (anterior[3] if anterior else []) + ([futuro] if futuro is not None else [])
+            self._pending[clave] = (self._submitted, funcion, args, futuros)
+            # La clave pasa al final: se conserva el orden respecto a las demás
+            self._pending.move_to_end(clave)
+            self._cond.notify_all()
+            return self._submitted
+
+    def wait_for(self, secuencia, timeout=None):
+        """Bloquea hasta que la escritura ``secuencia`` (y todas las anteriores) esté confirmada"""
+        limite = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._applied < secuencia:
+                restante = None if limite is None else limite - time.monotonic()
+                if restante is not None and restante <= 0:
+                    return False
+                self._cond.wait(restante)
+            return True
+
+    def flush(self, timeout=None):
+        """Barrera: espera a que se confirme todo lo encolado hasta ahora"""
+        with self._cond:
+            objetivo = self._submitted
+        return self.wait_for(objetivo, timeout)
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._pending)
+
+    def stop(self, timeout=None):
+        """Aplica lo pendiente y detiene el hilo escritor"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def _take_batch(self):
+        # Espera un poco tras la primera escritura para agrupar las que lleguen
+        # juntas, salvo si alguien está bloqueado esperando el resultado: en ese
+        # caso el grupo es lo que se acumuló mientras se aplicaba el anterior
+        with self._cond:
+            while not self._pending and not self._stopping:
+                self._cond.wait()
+            if not self._pending:
+                return None
+            esperando = any(futuros for _, _, _, futuros in self._pending.values())
+        if self.max_delay and not self._stopping and not esperando:
+            time.sleep(self.max_delay)
+        with self._cond:
+            lote = []
+            while self._pending and len(lote) < self.max_batch:
+                _, entrada = self._pending.popitem(last=False)
+                lote.append(entrada)
+            return lote
+
+    def _run(self):
+        while True:
+            lote = self._take_batch()
+            if lote is None:
+                return
+            operaciones = [(funcion, args) for _, funcion, args, _ in lote]
+            try:
+                resultados = self._apply_batch(operaciones) or [None] * len(operaciones)
+            except Exception as e:
+                # Si el grupo falla, se reintenta de una en una para no perder las demás
+                print(f"Error aplicando grupo de escrituras: {e}")
+                resultados = []
+                for funcion, args in operaciones:
+                    try:
+                        resultados.append((self._apply_batch([(funcion, args)]) or [None])[0])
+                    except Exception as e_op:
+                        self.errors.append((funcion.__name__, args, repr(e_op)))
+                        print(f"Error en escritura {funcion.__name__}{args}: {e_op}")
+                        resultados.append(e_op)
+            for (_, _, _, futuros), resultado in zip(lote, resultados):
+                for futuro in futuros:
+                    if isinstance(resultado, BaseException):
+                        futuro.set_exception(resultado)
+                    else:
+                        futuro.set_result(resultado)
+            with self._cond:
+                # Todo lo que ya no está pendiente y es anterior a lo pendiente
+                # está confirmado (o sustituido por una escritura posterior)
+                minimo_pendiente = min((s for s, _, _, _ in self._pending.values()), default=None)
+                if minimo_pendiente is None:
+                    self._applied = self._submitted
+                else:
+                    self._applied = max(self._applied, minimo_pendiente - 1)
+                self._cond.notify_all()
@@ -0,0 +1,13 @@
+import pytest
+
+from src import db
+
+
+@pytest.fixture
+def base(tmp_path):
+    """Base de datos vacía con el esquema al día; todas las llamadas a db.py del test van a ella"""
+    ruta = str(tmp_path / "planner.db")
+    with db.using_db(ruta):
+        db.init_db()
+        yield ruta
+    db.close_all_connections()
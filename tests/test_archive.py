@@ -0,0 +1,145 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+
+from src import archive, db
+
+HOY = date(2026, 6, 3)
+ANTIGUA = date(2025, 1, 6)      # lunes, muy anterior al corte
+RECIENTE = date(2026, 6, 1)     # lunes de la semana actual
+
+
+def _datos():
+    db.add_ingredient("Arroz")
+    arroz = db.get_all_ingredients()[0][0]
+    db.create_recipe("Paella", [arroz])
+    paella = {nombre: id_r for id_r, nombre in db.get_all_recipes()}["Paella"]
+    for semana in range(10):
+        db.save_meal_plan(ANTIGUA + timedelta(weeks=semana), "Comida", paella)
+    db.save_meal_plan(RECIENTE, "Cena", paella)
+    db.save_meal_servings(ANTIGUA, "Comida", 2)
+    db.update_shopping_statuses(ANTIGUA, {arroz: True})
+    db.update_shopping_statuses(RECIENTE, {arroz: True})
+    return arroz
+
+
+def test_archiva_lo_anterior_al_corte(base):
+    arroz = _datos()
+    corte = archive.cutoff(4, hoy=HOY)
+    resultado = archive.archive_before(corte, batch_weeks=3)
+
+    assert resultado["comidas"] == 10 and resultado["compras"] == 1
+    assert resultado["lotes"] == 4
+    assert archive.archive_path() == os.path.splitext(base)[0] + "_archivo.db"
+    # En la activa solo queda lo reciente
+    assert [(f, m) for f, m, _, _ in db.get_plan_range_details(date(2000, 1, 1), date(2100, 1, 1))] \
+        == [(str(RECIENTE), "Cena")]
+    assert db.get_shopping_status(ANTIGUA) == {}
+    assert db.get_shopping_status(RECIENTE) == {arroz: True}
+    # Y lo archivado se lee con los nombres ya resueltos
+    assert archive.get_archived_plan(ANTIGUA, ANTIGUA) == [(str(ANTIGUA), "Comida", "Paella", 2.0)]
+    assert len(archive.get_archived_plan(date(2000, 1, 1), corte)) == 10
+    assert archive.get_archived_shopping_status(ANTIGUA + timedelta(days=3)) == {"Arroz": True}
+
+
+def test_repetir_no_duplica(base):
+    _datos()
+    corte = archive.cutoff(4, hoy=HOY)
+    archive.archive_before(corte)
+    assert archive.archive_before(corte) == {"comidas": 0, "compras": 0, "lotes": 0}
+    assert archive.get_archive_stats()["comidas"] == 10
+
+
+def test_sin_nada_que_archivar_no_crea_el_archivo(base):
+    assert archive.get_archived_plan(ANTIGUA, HOY) == []
+    assert archive.archive_before(archive.cutoff(4, hoy=HOY))["lotes"] == 0
+    assert not os.path.exists(archive.archive_path())
+
+
+def test_semanas_cero_solo_recupera_espacio(base):
+    _datos()
+    resultado = archive.run_maintenance(0)
+    assert (resultado["comidas"], resultado["compras"]) == (0, 0)
+    assert len(db.get_plan_range_details(ANTIGUA, RECIENTE)) == 11
+
+
+def test_recupera_el_espacio_de_lo_borrado(base):
+    _datos()
+    db.run_query("CREATE TABLE relleno (x BLOB)")
+    db.run_query("INSERT INTO relleno SELECT randomblob(4000) FROM (SELECT 1 UNION ALL SELECT 2) a, "
+                 "(SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3 UNION ALL SELECT 4 UNION ALL SELECT 5) b")
+    db.run_query("DROP TABLE relleno")
+    stats = archive.get_archive_stats()
+    assert stats["auto_vacuum_incremental"] and stats["paginas_libres"] > 0
+
+    assert archive.reclaim_space(paginas=1, pausa=0) > 0
+    assert archive.get_archive_stats()["paginas_libres"] == 0
+
+
+def test_sin_auto_vacuum_incremental_no_se_queda_en_bucle(tmp_path):
+    # Base de datos creada antes de auto_vacuum incremental, con páginas libres
+    ruta = str(tmp_path / "antigua.db")
+    conn = sqlite3.connect(ruta)
+    conn.execute("CREATE TABLE relleno (x BLOB)")
+    conn.execute("CREATE TABLE queda (x)")
+    conn.execute("INSERT INTO relleno VALUES (randomblob(200000))")
+    conn.commit()
+    conn.execute("DROP TABLE relleno")
+    conn.commit()
+    conn.close()
+    with db.using_db(ruta):
+        db.init_db()
+        try:
+            assert archive.get_archive_stats()["paginas_libres"] > 0
+            assert not archive.get_archive_stats()["auto_vacuum_incremental"]
+            assert archive.reclaim_space(pausa=0) == 0
+            assert archive.run_maintenance(0)["pasos_vacuum"] == 0
+        finally:
+            db.close_all_connections()
+
+
+def test_lo_escrito_mientras_se_archiva_no_se_pierde(base, monkeypatch):
+    _datos()
+    paella = db.get_all_recipes()[0][0]
+    abrir = archive._open_archive
+    escritor = []
+
+    def escribir():
+        with db.using_db(base):
+            db.save_meal_plan(ANTIGUA, "Cena", paella)
+
+    def abrir_y_escribir(crear=True):
+        # Otra sesión escribe en una semana que se está archivando
+        if not escritor:
+            escritor.append(threading.Thread(target=escribir))
+            escritor[0].start()
+            time.sleep(0.1)
+        return abrir(crear)
+
+    monkeypatch.setattr(archive, "_open_archive", abrir_y_escribir)
+    archive.archive_before(archive.cutoff(4, hoy=HOY))
+    escritor[0].join()
+
+    archivada = (str(ANTIGUA), "Cena") in {(f, m) for f, m, _, _ in archive.get_archived_plan(ANTIGUA, ANTIGUA)}
+    activa = (str(ANTIGUA), "Cena") in db.get_plan_range_servings(ANTIGUA, ANTIGUA)
+    assert archivada or activa
+
+
+def test_el_mantenimiento_no_hace_vacuum_completo(tmp_path):
+    ruta = str(tmp_path / "antigua.db")
+    conn = sqlite3.connect(ruta)
+    conn.execute("CREATE TABLE queda (x)")
+    conn.commit()
+    conn.close()
+    with db.using_db(ruta):
+        try:
+            archive._maintain(0, ruta)
+            assert not archive.get_archive_stats()["auto_vacuum_incremental"]
+            # Solo a petición
+            assert db.enable_incremental_vacuum()
+            assert archive.get_archive_stats()["auto_vacuum_incremental"]
+            assert not db.enable_incremental_vacuum()
+        finally:
+            db.close_all_connections()
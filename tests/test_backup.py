@@ -0,0 +1,63 @@
+import gzip
+import io
+import sqlite3
+
+import pytest
+
+from src import backup, db
+
+
+def _copia(comprimir=True):
+    return io.BytesIO(backup.create_backup_bytes(comprimir=comprimir))
+
+
+@pytest.mark.parametrize("comprimir", [True, False])
+def test_restaurar_deja_la_base_como_en_la_copia(base, comprimir):
+    db.add_ingredient("Arroz")
+    copia = _copia(comprimir)
+    assert (copia.getvalue()[:2] == b"\x1f\x8b") == comprimir
+
+    db.add_ingredient("Tomate")
+    assert [nombre for _, nombre in db.search_ingredients("tom")] == ["Tomate"]
+    backup.restore_backup(copia)
+    assert [nombre for _, nombre, _ in db.get_all_ingredients()] == ["Arroz"]
+    # Lo que estaba en la caché de lecturas ya no se sirve
+    assert db.search_ingredients("tom") == []
+
+
+def test_restaura_una_copia_de_esquema_antiguo(base, tmp_path):
+    antigua = tmp_path / "antigua.db"
+    conn = sqlite3.connect(antigua)
+    with db.get_connection() as activa:
+        activa.backup(conn)
+    conn.execute("DROP INDEX idx_ingredientes_nombre_nocase")
+    conn.execute("PRAGMA user_version = 9")
+    conn.commit()
+    conn.close()
+
+    with open(antigua, "rb") as f:
+        backup.restore_backup(f)
+    with db.get_connection() as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == 10
+        assert conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'idx_ingredientes_nombre_nocase'").fetchone()
+
+
+@pytest.mark.parametrize("contenido, motivo", [
+    (b"esto no es una base de datos" * 100, "no es una base de datos SQLite"),
+    (gzip.compress(b"x" * 100)[:-8], "comprimido está dañado"),
+])
+def test_copia_invalida_no_toca_la_activa(base, contenido, motivo):
+    db.add_ingredient("Arroz")
+    with pytest.raises(backup.BackupError, match=motivo):
+        backup.restore_backup(io.BytesIO(contenido))
+    assert [nombre for _, nombre, _ in db.get_all_ingredients()] == ["Arroz"]
+
+
+def test_copia_de_otra_aplicacion(base, tmp_path):
+    otra = tmp_path / "otra.db"
+    conn = sqlite3.connect(otra)
+    conn.execute("CREATE TABLE cosas (x)")
+    conn.commit()
+    conn.close()
+    with open(otra, "rb") as f, pytest.raises(backup.BackupError, match="faltan tablas"):
+        backup.restore_backup(f)
@@ -0,0 +1,104 @@
+from datetime import date
+
+import pytest
+
+from src import db
+
+LUNES = date(2026, 1, 5)
+
+
+def _receta(nombre, ingredientes=()):
+    db.create_recipe(nombre, list(ingredientes))
+    return {nombre: id_r for id_r, nombre in db.get_all_recipes()}[nombre]
+
+
+def _ingrediente(nombre):
+    db.add_ingredient(nombre)
+    return {nombre: id_i for id_i, nombre, _ in db.get_all_ingredients()}[nombre]
+
+
+def test_celda_nueva_con_version_cero(base):
+    lentejas = _receta("Lentejas")
+    assert db.save_meal_plan(LUNES, "Comida", lentejas, version=0) == 1
+    assert db.get_plan_versions(LUNES, LUNES) == {(str(LUNES), "Comida"): 1}
+
+
+def test_version_vieja_lanza_conflicto_sin_escribir(base):
+    lentejas, paella = _receta("Lentejas"), _receta("Paella")
+    db.save_meal_plan(LUNES, "Comida", lentejas, version=0)
+    # Otra sesión cambia la celda después de que esta la leyera
+    db.save_meal_plan(LUNES, "Comida", paella, version=1)
+
+    with pytest.raises(db.ConflictError) as e:
+        db.save_meal_plan(LUNES, "Comida", lentejas, version=1)
+    assert e.value.actual == paella
+    assert e.value.version == 2
+    assert [fila[2] for fila in db.get_plan_range_details(LUNES, LUNES)] == [paella]
+
+
+def test_celda_nueva_ocupada_entretanto(base):
+    lentejas, paella = _receta("Lentejas"), _receta("Paella")
+    db.save_meal_plan(LUNES, "Cena", paella)
+    with pytest.raises(db.ConflictError):
+        db.save_meal_plan(LUNES, "Cena", lentejas, version=0)
+
+
+def test_escritura_sin_version_sube_la_version(base):
+    lentejas, paella = _receta("Lentejas"), _receta("Paella")
+    db.save_meal_plan(LUNES, "Comida", lentejas, version=0)
+    db.save_meal_plan(LUNES, "Comida", paella)
+    with pytest.raises(db.ConflictError):
+        db.save_meal_plan(LUNES, "Comida", lentejas, version=1)
+
+
+def test_raciones_con_version(base):
+    lentejas = _receta("Lentejas")
+    db.save_meal_plan(LUNES, "Comida", lentejas, version=0)
+    assert db.save_meal_servings(LUNES, "Comida", 3, version=1) == 2
+    with pytest.raises(db.ConflictError):
+        db.save_meal_servings(LUNES, "Comida", 4, version=1)
+    assert db.get_plan_range_servings(LUNES, LUNES) == {(str(LUNES), "Comida"): 3}
+
+
+def test_casillas_en_conflicto_no_se_pisan(base):
+    arroz, tomate = _ingrediente("Arroz"), _ingrediente("Tomate")
+    vistas = db.get_shopping_versions(LUNES)
+    # Otra sesión marca el arroz con las mismas versiones
+    assert db.update_shopping_statuses(LUNES, {arroz: True}, versiones=vistas) == []
+
+    conflictos = db.update_shopping_statuses(LUNES, {arroz: False, tomate: True}, versiones=vistas)
+    assert conflictos == [arroz]
+    assert db.get_shopping_status(LUNES) == {arroz: True, tomate: True}
+
+
+def test_mismo_valor_no_es_conflicto(base):
+    arroz = _ingrediente("Arroz")
+    vistas = db.get_shopping_versions(LUNES)
+    db.update_shopping_statuses(LUNES, {arroz: True}, versiones=vistas)
+    assert db.update_shopping_statuses(LUNES, {arroz: True}, versiones=vistas) == []
+
+
+def test_conflicto_a_traves_de_la_cola(base):
+    lentejas, paella = _receta("Lentejas"), _receta("Paella")
+    db.enable_write_queue(True)
+    try:
+        db.save_meal_plan(LUNES, "Comida", lentejas, version=0)
+        db.save_meal_plan(LUNES, "Comida", paella, version=1)
+        with pytest.raises(db.ConflictError):
+            db.save_meal_plan(LUNES, "Comida", lentejas, version=1)
+    finally:
+        db.enable_write_queue(False)
+    assert [fila[2] for fila in db.get_plan_range_details(LUNES, LUNES)] == [paella]
+
+
+def test_casilla_en_conflicto_a_traves_de_la_cola(base):
+    arroz = _ingrediente("Arroz")
+    db.enable_write_queue(True)
+    try:
+        assert db.update_shopping_statuses(LUNES, {arroz: True}, versiones={arroz: 0}) == []
+        # Visible para las demás sesiones en cuanto vuelve, sin guardar nada más
+        assert db.get_shopping_status(LUNES) == {arroz: True}
+        assert db.update_shopping_statuses(LUNES, {arroz: False}, versiones={arroz: 0}) == [arroz]
+    finally:
+        db.enable_write_queue(False)
+    assert db.get_shopping_status(LUNES) == {arroz: True}
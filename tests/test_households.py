@@ -0,0 +1,80 @@
+import gzip
+import os
+import sqlite3
+
+import pytest
+
+from src import db, households, migrations
+
+
+@pytest.fixture
+def hogares(tmp_path, monkeypatch):
+    directorios = [str(tmp_path / "disco1"), str(tmp_path / "disco2")]
+    monkeypatch.setattr(households, "HOUSEHOLDS_DIRS", directorios)
+    yield directorios
+    db.close_all_connections()
+
+
+@pytest.mark.parametrize("hogar", ["", "García", "../planner", "a/b", "x" * 65, None, "garcia_archivo"])
+def test_identificadores_no_validos(hogar):
+    with pytest.raises(households.HouseholdError):
+        households.validate_id(hogar)
+
+
+def test_cada_hogar_tiene_sus_datos(hogares):
+    households.create_household("garcia")
+    households.create_household("piso-3b")
+    with households.use_household("garcia"):
+        db.add_ingredient("Arroz")
+    with households.use_household("piso-3b"):
+        assert db.get_all_ingredients() == []
+        db.add_ingredient("Tomate")
+    with households.use_household("garcia"):
+        assert [nombre for _, nombre, _ in db.get_all_ingredients()] == ["Arroz"]
+    assert all(os.path.dirname(h["ruta"]) in hogares for h in households.list_households())
+
+
+def test_hogar_inexistente_o_repetido(hogares):
+    with pytest.raises(households.HouseholdError, match="no existe"):
+        households.resolve("garcia")
+    households.create_household("garcia")
+    with pytest.raises(households.HouseholdError, match="ya existe"):
+        households.create_household("garcia")
+
+
+def test_listar_y_migrar(hogares):
+    households.create_household("garcia")
+    # Un hogar que se quedó en un esquema antiguo
+    os.makedirs(hogares[1], exist_ok=True)
+    conn = sqlite3.connect(os.path.join(hogares[1], "viejo.db"))
+    for migracion in migrations.MIGRATIONS[:6]:
+        migracion(conn)
+    conn.execute("PRAGMA user_version = 6")
+    conn.commit()
+    conn.close()
+    # El archivo de un hogar no es un hogar
+    open(os.path.join(hogares[1], "viejo_archivo.db"), "wb").close()
+
+    assert [(h["hogar"], h["version_esquema"]) for h in households.list_households()] \
+        == [("garcia", migrations.SCHEMA_VERSION), ("viejo", 6)]
+    assert households.migrate_households() == {"garcia": (10, 10), "viejo": (6, 10)}
+
+
+def test_copias_por_hogar(hogares, tmp_path):
+    households.create_household("garcia")
+    copias = households.backup_households(str(tmp_path / "copias"))
+    assert list(copias) == ["garcia"]
+    with gzip.open(copias["garcia"]) as f:
+        assert f.read(16) == b"SQLite format 3\x00"
+
+
+def test_pools_abiertos_acotados(hogares, monkeypatch):
+    monkeypatch.setattr(db, "MAX_OPEN_SHARDS", 2)
+    for hogar in ("a", "b", "c"):
+        households.create_household(hogar)
+        with households.use_household(hogar):
+            db.add_ingredient(f"Ingrediente {hogar}")
+    assert [os.path.basename(ruta) for ruta in db.get_open_shards()] == ["b.db", "c.db"]
+    # Un hogar cuyo pool se cerró se vuelve a abrir sin perder nada
+    with households.use_household("a"):
+        assert [nombre for _, nombre, _ in db.get_all_ingredients()] == ["Ingrediente a"]
@@ -0,0 +1,35 @@
+import pytest
+
+from src import db
+
+NOMBRES = ["x@1", "X@2", "x[1", "x_1", "x`1", "xa1", "XA2", "xb1", "x1", "y@1", "@1", "A1", "[1", "á1", "Á1"]
+
+
+def _esperados(prefijo):
+    # 'Empieza por' sin distinguir mayúsculas ASCII, como LIKE
+    def plegar(texto):
+        return "".join(ch.lower() if ch.isascii() else ch for ch in texto)
+    return sorted(n for n in NOMBRES if plegar(n).startswith(plegar(prefijo)))
+
+
+@pytest.mark.parametrize("prefijo", ["x@", "X@", "x`", "x[", "xa", "XA", "x", "@", "a", "[", "á", "Á"])
+def test_filtro_empieza_por(base, prefijo):
+    for nombre in NOMBRES:
+        db.add_ingredient(nombre)
+    pagina, total = db.get_ingredients_page(prefijo=prefijo, limite=100)
+    assert sorted(nombre for _, nombre, _ in pagina) == _esperados(prefijo)
+    assert total == len(_esperados(prefijo))
+
+
+def test_paginas_con_filtro(base):
+    for n in range(7):
+        db.add_ingredient(f"Tomate {n}")
+    db.add_ingredient("Pepino")
+    vistos, despues = [], None
+    while True:
+        pagina, total = db.get_ingredients_page(despues=despues, limite=3, prefijo="tom")
+        if not pagina:
+            break
+        vistos += [nombre for _, nombre, _ in pagina]
+        despues = (pagina[-1][1], pagina[-1][0])
+    assert vistos == [f"Tomate {n}" for n in range(7)] and total == 7
@@ -0,0 +1,82 @@
+import sqlite3
+
+from src import migrations
+
+
+def _conexion(ruta):
+    conn = sqlite3.connect(ruta)
+    conn.execute("PRAGMA foreign_keys = ON")
+    return conn
+
+
+def _objetos(conn, tipo):
+    return {nombre for (nombre,) in conn.execute("SELECT name FROM sqlite_master WHERE type = ?", (tipo,))}
+
+
+def test_base_nueva_aplica_todas(tmp_path):
+    conn = _conexion(tmp_path / "nueva.db")
+    assert migrations.migrate(conn) == list(range(1, migrations.SCHEMA_VERSION + 1))
+    assert migrations.get_version(conn) == migrations.SCHEMA_VERSION == 10
+    assert {"ingredientes", "recetas", "receta_ingredientes", "planificacion",
+            "compras_estado", "compra_semanal", "ingredientes_fts", "recetas_fts"} <= _objetos(conn, "table")
+    assert {"idx_receta_ingredientes_ingrediente", "idx_planificacion_receta",
+            "idx_compras_estado_ingrediente", "idx_ingredientes_categoria_nombre",
+            "idx_ingredientes_nombre_nocase"} <= _objetos(conn, "index")
+    assert {"trg_plan_version", "trg_compras_version"} <= _objetos(conn, "trigger")
+    # La receta especial de la migración 3
+    assert conn.execute("SELECT COUNT(*) FROM recetas WHERE nombre = 'Compra'").fetchone()[0] == 1
+
+
+def test_al_dia_no_hace_nada(tmp_path):
+    conn = _conexion(tmp_path / "nueva.db")
+    migrations.migrate(conn)
+    assert migrations.migrate(conn) == []
+
+
+def test_desde_la_version_3_conserva_los_datos(tmp_path):
+    # Base de datos como las de antes de la migración 4: compras por nombre y fecha
+    conn = _conexion(tmp_path / "antigua.db")
+    for migracion in migrations.MIGRATIONS[:3]:
+        migracion(conn)
+    conn.execute("PRAGMA user_version = 3")
+    conn.execute("INSERT INTO ingredientes (nombre, categoria) VALUES ('Arroz', 'Despensa')")
+    conn.execute("INSERT INTO recetas (nombre) VALUES ('Paella')")
+    conn.execute("INSERT INTO receta_ingredientes VALUES (2, 1)")
+    conn.execute("INSERT INTO planificacion VALUES ('2026-01-07', 'Comida', 2)")
+    conn.executemany("INSERT INTO compras_estado VALUES (?, ?, ?)",
+                     [("2026-01-05", "Arroz", 1), ("2026-01-05", "Borrado", 1)])
+    conn.commit()
+
+    assert migrations.migrate(conn) == list(range(4, migrations.SCHEMA_VERSION + 1))
+    assert migrations.get_version(conn) == migrations.SCHEMA_VERSION
+
+    # Cantidades, raciones y versión con sus valores por defecto
+    assert conn.execute("SELECT fecha, momento, receta_id, raciones, version FROM planificacion").fetchall() \
+        == [("2026-01-07", "Comida", 2, 1.0, 1)]
+    assert conn.execute("SELECT cantidad, unidad FROM receta_ingredientes").fetchall() == [(None, None)]
+    # Las casillas pasan a (semana, ingrediente_id); las de ingredientes que ya no existen se descartan
+    semana = conn.execute(f"SELECT {migrations._week_number(repr('2026-01-05'))}").fetchone()[0]
+    assert conn.execute("SELECT semana, ingrediente_id, comprado FROM compras_estado").fetchall() \
+        == [(semana, 1, 1)]
+    # La lista materializada se rellena con lo que ya estaba planificado
+    assert conn.execute("SELECT ingrediente_id, veces FROM compra_semanal").fetchall() == [(1, 1)]
+    # Y la búsqueda indexa los nombres existentes
+    assert conn.execute("SELECT rowid FROM recetas_fts WHERE recetas_fts MATCH 'paell*'").fetchall() == [(2,)]
+
+
+def test_una_migracion_que_falla_no_deja_nada_a_medias(tmp_path, monkeypatch):
+    conn = _conexion(tmp_path / "nueva.db")
+
+    def rota(c):
+        raise sqlite3.OperationalError("fallo simulado")
+
+    monkeypatch.setattr(migrations, "MIGRATIONS", migrations.MIGRATIONS[:2] + [rota])
+    monkeypatch.setattr(migrations, "SCHEMA_VERSION", 3)
+    try:
+        migrations.migrate(conn)
+    except sqlite3.OperationalError:
+        pass
+    else:
+        raise AssertionError("la migración tenía que fallar")
+    assert migrations.get_version(conn) == 0
+    assert _objetos(conn, "table") == set()
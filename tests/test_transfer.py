@@ -0,0 +1,77 @@
+import io
+from datetime import date
+
+import pytest
+
+from src import db, transfer
+
+
+def _importar(tipo, texto, formato="csv", **kwargs):
+    return transfer.import_file(tipo, formato, io.StringIO(texto), **kwargs)
+
+
+def test_errores_del_plan_con_su_linea(base):
+    db.create_recipe("Paella", [])
+    resultado = _importar("plan", "fecha,momento,receta,raciones\n"
+                                  "2026-01-05,Comida,Paella,2\n"
+                                  "2026-13-01,Comida,Paella,\n"
+                                  "2026-01-06,Merienda,Paella,\n"
+                                  "2026-01-07,Cena,Lentejas,\n"
+                                  "2026-01-08,Cena,Paella,-1\n"
+                                  "2026-01-09,Cena,,\n"
+                                  "2026-01-10,Cena,Paella,1,sobra\n")
+    assert resultado["filas"] == 7 and resultado["importadas"] == 1
+    assert resultado["total_errores"] == 6
+    lineas = dict(resultado["errores"])
+    assert sorted(lineas) == [3, 4, 5, 6, 7, 8]
+    assert lineas[3].startswith("Fecha no válida")
+    assert lineas[4].startswith("Momento desconocido: Merienda")
+    assert lineas[5] == "Receta desconocida: Lentejas"
+    assert "no negativo" in lineas[6]
+    assert lineas[7] == "Falta 'receta'"
+    assert lineas[8] == "Hay más valores que columnas"
+    assert db.get_plan_range_servings(date(2026, 1, 5), date(2026, 1, 11)) == {("2026-01-05", "Comida"): 2.0}
+
+
+def test_errores_de_recetas_jsonl(base):
+    db.add_ingredient("Arroz")
+    resultado = _importar("recetas", '{"receta": "Paella", "ingrediente": "Arroz", "cantidad": 300, "unidad": "g"}\n'
+                                     '\n'
+                                     '{"receta": "Paella", "ingrediente": "Azafrán"}\n'
+                                     '{"receta": "Paella", "ingrediente": "Arroz", "unidad": "puñado"}\n'
+                                     '{"receta": "Paella",\n'
+                                     '["Paella"]\n', formato="jsonl")
+    assert resultado["importadas"] == 1
+    lineas = dict(resultado["errores"])
+    assert lineas[3] == "Ingrediente desconocido: Azafrán"
+    assert lineas[4] == "Unidad desconocida: puñado"
+    assert lineas[5].startswith("JSON no válido")
+    assert lineas[6] == "Se esperaba un objeto JSON"
+
+
+def test_los_errores_se_acotan_pero_se_cuentan(base, monkeypatch):
+    monkeypatch.setattr(transfer, "MAX_ERRORS", 3)
+    resultado = _importar("plan", "fecha,momento,receta,raciones\n" + "mal,Comida,X,\n" * 10, batch_size=4)
+    assert resultado["total_errores"] == 10
+    assert [linea for linea, _ in resultado["errores"]] == [2, 3, 4]
+
+
+def test_tipo_o_formato_desconocido(base):
+    with pytest.raises(transfer.TransferError, match="Tipo desconocido"):
+        _importar("menus", "")
+    with pytest.raises(transfer.TransferError, match="Formato desconocido"):
+        _importar("plan", "", formato="xml")
+
+
+@pytest.mark.parametrize("formato", transfer.FORMATOS)
+def test_exportar_e_importar_da_lo_mismo(base, monkeypatch, formato):
+    # Páginas de 2 filas: la exportación tiene que recorrer varias
+    monkeypatch.setattr(transfer, "BATCH_SIZE", 2)
+    ingredientes = "".join(f"Ingrediente {n},Categoría {n % 2}\n" for n in range(5))
+    _importar("ingredientes", "nombre,categoria\n" + ingredientes)
+    exportado = transfer.export_bytes("ingredientes", formato).decode()
+
+    assert transfer.write_export("ingredientes", formato, io.StringIO()) == 5
+    db.run_query("DELETE FROM ingredientes")
+    assert _importar("ingredientes", exportado, formato=formato)["importadas"] == 5
+    assert transfer.export_bytes("ingredientes", formato).decode() == exportado
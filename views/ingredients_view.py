@@ -1,8 +1,14 @@
 import streamlit as st
-import pandas as pd
-from src import db
+from src import db, profiling
+
+CATEGORIAS = [
+    "🥦 Frutería", "🥩 Carnicería", "🧀 Charcuteria", "🐟 Pescaderia", "🥛 Frescos", "🥖 Panadería",
+    "🥫 Despensa", "🧼 Limpieza", "❄️ Congelados", "Otros"
+]
+
 
 def show_ingredients_page(es_editor):
+    lap = profiling.laps("ingredientes")
     st.header("Gestión de la Despensa")
 
     tab1, tab2 = st.tabs(["➕ Añadir Nuevo", "✏️ Editar / Ver Listado"])
@@ -29,61 +35,79 @@ def show_ingredients_page(es_editor):
             with col1:
                 st.text_input("Nombre del nuevo ingrediente", key="nuevo_ing_nombre")
             with col2:
-                st.selectbox("Categoría", [
-                    "🥦 Frutería", "🥩 Carnicería", "🧀 Charcuteria", "🐟 Pescaderia", "🥛 Frescos", "🥖 Panadería",
-                    "🥫 Despensa", "🧼 Limpieza", "❄️ Congelados", "Otros"
-                ], key="nueva_cat_sel")
+                st.selectbox("Categoría", CATEGORIAS, key="nueva_cat_sel")
 
             st.button("Añadir a la lista", on_click=save_new_ingredient)
 
+    lap("alta")
+
     # --- TAB 2: EDITAR Y LISTADO ---
     with tab2:
-        all_ings = db.get_all_ingredients()
-
-        if not all_ings:
-            st.info("La despensa está vacía.")
+        # Filtros y paginación por clave: solo se lee y se envía la página visible
+        col_f1, col_f2 = st.columns([2, 1])
+        prefijo = col_f1.text_input("🔎 Empieza por", key="ings_filtro_prefijo", on_change=_reiniciar_paginas)
+        categoria = col_f2.selectbox("Categoría", ["Todas"] + CATEGORIAS, key="ings_filtro_cat",
+                                     on_change=_reiniciar_paginas)
+        categoria = None if categoria == "Todas" else categoria
+
+        cursores = st.session_state.setdefault("ings_cursores", [None])
+        pagina = len(cursores) - 1
+        filas, total = db.get_ingredients_page(cursores[-1], db.INGREDIENTS_PAGE_SIZE, categoria, prefijo.strip())
+        if not filas and pagina > 0:
+            # Se borró lo último de la última página: se vuelve a la anterior
+            _pagina_anterior()
+            st.rerun()
+        lap("datos")
+
+        if not total:
+            st.info("La despensa está vacía." if not (prefijo or categoria) else "Ningún ingrediente coincide.")
         else:
-            lista_categorias = [
-                "🥦 Frutería", "🥩 Carnicería", "🧀 Charcuteria", "🐟 Pescaderia", "🥛 Frescos", "🥖 Panadería",
-                "🥫 Despensa", "🧼 Limpieza", "❄️ Congelados", "Otros"
-            ]
-
-            df_ings = pd.DataFrame(all_ings, columns=["ID", "Nombre", "Categoría"])
+            # Número de recetas que usan cada ingrediente (desde el índice en memoria)
+            usos = db.get_ingredient_usage_counts()
+            tabla = [{"Nombre": nombre, "Categoría": cat, "Recetas": usos.get(id_ing, 0)}
+                     for id_ing, nombre, cat in filas]
 
             col_list, col_edit = st.columns([1, 1])
 
             with col_list:
                 st.subheader("Ingredientes")
                 event = st.dataframe(
-                    df_ings,
-                    column_order=("Nombre", "Categoría"),
+                    tabla,
                     use_container_width=True,
                     height=450,
                     hide_index=True,
                     on_select="rerun",
                     selection_mode="single-row",
-                    key="tabla_ings_lateral"
+                    # Clave por página: la selección no salta a otra fila al pasar de página
+                    key=f"tabla_ings_lateral_{pagina}_{categoria}_{prefijo}"
                 )
 
+                paginas = -(-total // db.INGREDIENTS_PAGE_SIZE)
+                hay_siguiente = len(filas) == db.INGREDIENTS_PAGE_SIZE and pagina + 1 < paginas
+                c_prev, c_info, c_next = st.columns([1, 2, 1])
+                c_prev.button("⬅️", key="btn_ings_prev", disabled=pagina == 0, on_click=_pagina_anterior,
+                              use_container_width=True)
+                c_info.caption(f"Página {pagina + 1} de {paginas} · {total} ingredientes")
+                c_next.button("➡️", key="btn_ings_next", disabled=not hay_siguiente, on_click=_pagina_siguiente,
+                              args=((filas[-1][1], filas[-1][0]),), use_container_width=True)
+
             with col_edit:
                 st.subheader("Editar Selección")
                 indices = event.selection.rows
 
                 if indices:
-                    row_idx = indices[0]
-                    id_i = int(df_ings.iloc[row_idx]["ID"])
-                    nombre_i = df_ings.iloc[row_idx]["Nombre"]
-                    cat_i = df_ings.iloc[row_idx]["Categoría"]
+                    id_i, nombre_i, cat_i = filas[indices[0]]
+                    recetas_afectadas = db.get_ingredient_usage(id_i)
 
                     with st.form(key=f"form_side_edit_{id_i}"):
                         nuevo_nom = st.text_input("Nombre", value=nombre_i, disabled=not es_editor)
 
                         try:
-                            idx_cat = lista_categorias.index(cat_i)
+                            idx_cat = CATEGORIAS.index(cat_i)
                         except:
-                            idx_cat = lista_categorias.index("Otros")
+                            idx_cat = CATEGORIAS.index("Otros")
 
-                        nueva_cat = st.selectbox("Categoría", options=lista_categorias, index=idx_cat, disabled=not es_editor)
+                        nueva_cat = st.selectbox("Categoría", options=CATEGORIAS, index=idx_cat, disabled=not es_editor)
 
                         if es_editor:
                             c1, c2 = st.columns(2)
@@ -99,5 +123,27 @@ def show_ingredients_page(es_editor):
                                 st.rerun()
                         else:
                             st.info("Modo lectura: No se permiten cambios.")
+
+                    # Vista previa de lo que arrastraría el borrado en cascada
+                    if recetas_afectadas:
+                        st.warning(
+                            f"⚠️ Se usa en {len(recetas_afectadas)} receta(s): {', '.join(recetas_afectadas)}. "
+                            "Al borrarlo desaparecerá de todas ellas.")
+                    else:
+                        st.caption("No se usa en ninguna receta.")
                 else:
-                    st.info("👈 Selecciona un ingrediente de la lista.")
\ No newline at end of file
+                    st.info("👈 Selecciona un ingrediente de la lista.")
+
+
+def _reiniciar_paginas():
+    # Un filtro nuevo empieza en la primera página
+    st.session_state["ings_cursores"] = [None]
+
+
+def _pagina_siguiente(cursor):
+    st.session_state["ings_cursores"].append(cursor)
+
+
+def _pagina_anterior():
+    if len(st.session_state["ings_cursores"]) > 1:
+        st.session_state["ings_cursores"].pop()
@@ -1,17 +1,34 @@
 import streamlit as st
-from datetime import timedelta
-from src import db, logic
+from datetime import date, timedelta
+from src import db, logic, plan_cache, profiling
+
+
+MOMENTOS_CONFIG = dict(zip(logic.MOMENTOS, ["☕", "🍏", "🍲", "🥪", "🥗", "🛒"]))
+
+DIAS_NOMBRES = ["Momentos", "Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
 
 
 def show_planner_page(es_editor, change_date):
+    lap = profiling.laps("planner")
     st.header("Planificación Semanal")
 
+    # Horizonte visible: 1, 2 o 4 semanas o el mes completo
+    etiqueta_horizonte = st.radio(
+        "Vista",
+        list(logic.PLANNER_HORIZONS.keys()),
+        horizontal=True,
+        key="planner_horizonte",
+        label_visibility="collapsed"
+    )
+    horizonte = logic.PLANNER_HORIZONS[etiqueta_horizonte]
+    unidad = "Mes" if horizonte == "mes" else ("Semana" if horizonte == 1 else "Bloque")
+
     # --- NAVEGACIÓN UNIFICADA (Planificador) ---
     col_nav1, col_nav2, col_nav3 = st.columns([1, 2, 1])
 
     with col_nav1:
-        if st.button("⬅️ Semana Anterior", key="btn_prev_plan", use_container_width=True, disabled=not es_editor):
-            change_date(dias=-7)
+        if st.button(f"⬅️ {unidad} Anterior", key="btn_prev_plan", use_container_width=True, disabled=not es_editor):
+            change_date(nueva_fecha=logic.shift_planner_range(st.session_state["fecha_global"], horizonte, -1))
             st.rerun()
 
     with col_nav2:
@@ -27,42 +44,75 @@ def show_planner_page(es_editor, change_date):
         )
 
     with col_nav3:
-        if st.button("Semana Siguiente ➡️", key="btn_next_plan", use_container_width=True, disabled=not es_editor):
-            change_date(dias=7)
+        if st.button(f"{unidad} Siguiente ➡️", key="btn_next_plan", use_container_width=True, disabled=not es_editor):
+            change_date(nueva_fecha=logic.shift_planner_range(st.session_state["fecha_global"], horizonte, 1))
             st.rerun()
 
-    # Usamos la fecha global para calcular la semana
+    lap("navegacion")
+
+    # Usamos la fecha global para calcular el rango visible
     start_of_week = logic.get_start_of_week(st.session_state["fecha_global"])
+    inicio, fin = logic.get_planner_range(start_of_week, horizonte)
 
     st.info(
-        f"📅 Semana del **{start_of_week.strftime('%d/%m/%Y')}** al **{(start_of_week + timedelta(days=6)).strftime('%d/%m/%Y')}**")
+        f"📅 Del **{inicio.strftime('%d/%m/%Y')}** al **{fin.strftime('%d/%m/%Y')}**")
 
-    # 1. Obtenemos fechas y datos
-    plan_data = db.get_plan_range_details(start_of_week, start_of_week + timedelta(days=6))
+    # 1. Una sola consulta para todo el rango (o memoria, si ya se precargó)
+    plan_data = plan_cache.get_plan_range(inicio, fin)
     plan_dict = {(fecha, mom): rec_nombre for fecha, mom, _, rec_nombre in plan_data}
 
-    momentos_config = {
-        "Desayuno": "☕",
-        "Media Mañana": "🍏",
-        "Comida": "🍲",
-        "Media Tarde": "🥪",
-        "Cena": "🥗",
-        "Compra General": "🛒"
-    }
-
-    raw_recipes = db.get_all_recipes()
-    opciones_recetas = {nombre: id_rec for id_rec, nombre in raw_recipes}
+    # Mientras se mira este rango, se precargan el anterior y el siguiente
+    vecinos = []
+    for pasos in (-1, 1):
+        inicio_vecino = logic.shift_planner_range(start_of_week, horizonte, pasos)
+        vecinos.append(logic.get_planner_range(inicio_vecino, horizonte))
+    plan_cache.prefetch(vecinos)
+
+    # Los selectores solo llevan las recetas que coinciden con la búsqueda
+    # (acotadas en el servidor) más las ya planificadas en el rango
+    busqueda = st.text_input("🔎 Buscar receta", key="planner_buscar_receta",
+                             placeholder="Escribe para filtrar las recetas de los selectores",
+                             disabled=not es_editor)
+    opciones_recetas = {nombre: id_rec for id_rec, nombre in db.search_recipes(busqueda)}
+    for _, _, id_rec, nombre in plan_data:
+        opciones_recetas.setdefault(nombre, id_rec)
     lista_nombres_recetas = [""] + list(opciones_recetas.keys())
-
+    lap("datos")
+
+    # Versión de cada celda tal como se muestra: los cambios se guardan solo si
+    # nadie la ha tocado desde entonces (compare-and-set)
+    versiones = db.get_plan_versions(inicio, fin) if es_editor else {}
+
+    semana = inicio
+    while semana <= fin:
+        if semana != inicio:
+            st.divider()
+        _render_week(semana, plan_dict, versiones, opciones_recetas, lista_nombres_recetas, es_editor)
+        semana += timedelta(days=7)
+    lap("rejilla")
+
+    if es_editor and plan_data:
+        _render_servings(inicio, fin, plan_data)
+
+    # Las semanas antiguas pueden estar ya en el archivo: se muestran aparte, solo lectura
+    if inicio < logic.get_start_of_week(date.today()):
+        from src import archive
+        archivadas = archive.get_archived_plan(inicio, fin)
+        if archivadas:
+            with st.expander(f"🗄️ {len(archivadas)} comidas archivadas en este rango"):
+                st.dataframe([{"Fecha": fecha, "Momento": momento, "Receta": receta, "Raciones": raciones}
+                              for fecha, momento, receta, raciones in archivadas],
+                             hide_index=True, use_container_width=True)
+
+
+def _render_week(start_of_week, plan_dict, versiones, opciones_recetas, lista_nombres_recetas, es_editor):
     # 2. Definimos las columnas: 7 para los días y 1 para la leyenda
     columnas = st.columns([0.8, 1, 1, 1, 1, 1, 1, 1])
 
-    dias_nombres = ["Momentos", "Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
-
     # 3. Dibujamos la LEYENDA (Momentos)
     with columnas[0]:
         st.markdown('<div style="height:80px;margin-top:1px;"></div>', unsafe_allow_html=True)
-        for momento, emoji in momentos_config.items():
+        for momento, emoji in MOMENTOS_CONFIG.items():
             st.markdown(f"""
                         <div style="height:38px; display:flex; align-items:center; background-color:#e1f5fe; border-radius:5px; padding-left:10px; margin-bottom:18px; border: 1px solid #b3e5fc;">
                             <span style="font-size:0.9em;">{emoji} <b>{momento}</b></span>
@@ -78,24 +128,105 @@ def show_planner_page(es_editor, change_date):
             # Encabezado del día (usamos i+1 para sacar el nombre del día Lunes, Martes...)
             st.markdown(f"""
                     <div style="background-color:#f0f2f6; padding:10px; border-radius:5px; text-align:center; height:70px; margin-bottom:10px; display:flex; flex-direction:column; justify-content:center;">
-                        <p style="margin:0; font-weight:bold; line-height:1.2;">{dias_nombres[i + 1]}</p>
+                        <p style="margin:0; font-weight:bold; line-height:1.2;">{DIAS_NOMBRES[i + 1]}</p>
                         <p style="margin:0; font-size:0.8em;">{current_date.strftime('%d/%m')}</p>
                     </div>
                 """, unsafe_allow_html=True)
 
-            # Selectores de comida
-            for momento in momentos_config.keys():
-                val_actual = plan_dict.get((date_str, momento), "")
-                idx = lista_nombres_recetas.index(val_actual) if val_actual in lista_nombres_recetas else 0
-
-                seleccion = st.selectbox(
-                    f"{momento}_{date_str}",
-                    lista_nombres_recetas,
-                    index=idx,
-                    key=f"plan_{date_str}_{momento}",
-                    label_visibility="collapsed",
-                    disabled=not es_editor
-                )
-
-                if seleccion != val_actual:
-                    db.save_meal_plan(current_date, momento, opciones_recetas.get(seleccion))
\ No newline at end of file
+            # Selectores de comida: cada celda es un fragmento independiente
+            for momento in MOMENTOS_CONFIG.keys():
+                if es_editor:
+                    _sincronizar_celda(f"plan_{date_str}_{momento}", versiones.get((date_str, momento), 0))
+                _render_cell(current_date, momento, plan_dict.get((date_str, momento), ""),
+                             opciones_recetas, lista_nombres_recetas, es_editor)
+
+
+def _sincronizar_celda(key, version):
+    # Si otra sesión cambió la celda desde que se mostró, el selector se vuelve
+    # a crear con el valor de la base de datos en lugar de conservar el antiguo
+    vistas = st.session_state.setdefault("plan_versiones", {})
+    if vistas.get(key, version) != version:
+        st.session_state.pop(key, None)
+    vistas[key] = version
+
+
+def _guardar_celda(fecha, momento, opciones_recetas, key):
+    # Solo se escribe la celda que ha cambiado, y solo si sigue en la versión que se vio
+    vistas = st.session_state.setdefault("plan_versiones", {})
+    avisos = st.session_state.setdefault("plan_avisos", {})
+    try:
+        vistas[key] = db.save_meal_plan(fecha, momento, opciones_recetas.get(st.session_state[key]),
+                                        version=vistas.get(key, 0))
+        return
+    except db.ConflictError as e:
+        vistas[key] = e.version
+        avisos[key] = "✋ Otra persona cambió esta comida: se muestra su versión"
+    except db.DatabaseBusyError:
+        avisos[key] = "⏳ Base de datos ocupada: el cambio no se guardó"
+    # El selector vuelve a mostrar lo que hay guardado (en una ejecución completa,
+    # por si la receta no está entre las opciones filtradas)
+    st.session_state.pop(key, None)
+    st.session_state["plan_recargar"] = True
+
+
+@st.fragment
+def _render_cell(fecha, momento, val_actual, opciones_recetas, lista_nombres_recetas, es_editor):
+    """
+    Selector de una comida. Al cambiarlo solo se vuelve a ejecutar esta celda:
+    ni el resto de la rejilla ni las consultas de la página.
+    """
+    if st.session_state.pop("plan_recargar", False):
+        st.rerun()
+    date_str = str(fecha)
+    key = f"plan_{date_str}_{momento}"
+    idx = lista_nombres_recetas.index(val_actual) if val_actual in lista_nombres_recetas else 0
+    st.selectbox(
+        f"{momento}_{date_str}",
+        lista_nombres_recetas,
+        index=idx,
+        key=key,
+        label_visibility="collapsed",
+        disabled=not es_editor,
+        on_change=_guardar_celda,
+        args=(fecha, momento, opciones_recetas, key)
+    )
+    aviso = st.session_state.get("plan_avisos", {}).pop(key, None)
+    if aviso:
+        st.warning(aviso)
+
+
+def _render_servings(inicio, fin, plan_data):
+    # Raciones por comida: multiplican las cantidades de la receta en la lista de la compra
+    with st.expander("🍽️ Raciones"):
+        raciones = db.get_plan_range_servings(inicio, fin)
+        orden = {momento: i for i, momento in enumerate(MOMENTOS_CONFIG)}
+        filas = [
+            {"Fecha": fecha, "Momento": momento, "Receta": receta, "Raciones": raciones.get((fecha, momento), 1.0)}
+            for fecha, momento, _, receta in sorted(plan_data, key=lambda r: (r[0], orden.get(r[1], 99)))
+        ]
+        editadas = st.data_editor(
+            filas,
+            column_config={"Raciones": st.column_config.NumberColumn(min_value=0.0, step=0.5, format="%g")},
+            disabled=["Fecha", "Momento", "Receta"],
+            hide_index=True,
+            key=f"raciones_{inicio}_{fin}",
+        )
+        # Versiones de las filas tal como se mostraron en la ejecución anterior
+        clave_versiones = f"raciones_versiones_{inicio}_{fin}"
+        vistas = st.session_state.get(clave_versiones, {})
+        if st.button("💾 Guardar raciones", key=f"btn_raciones_{inicio}_{fin}"):
+            try:
+                # Un único COMMIT para todos los cambios: si una fila cambió en otra
+                # sesión no se guarda ninguna
+                with db.transaction():
+                    for antes, despues in zip(filas, editadas):
+                        if despues["Raciones"] is not None and despues["Raciones"] != antes["Raciones"]:
+                            db.save_meal_servings(despues["Fecha"], despues["Momento"], despues["Raciones"],
+                                                  version=vistas.get((despues["Fecha"], despues["Momento"]), 0))
+            except db.ConflictError as e:
+                st.warning(f"✋ No se guardaron las raciones: {e}. Revisa los valores actuales.")
+            except db.DatabaseBusyError:
+                st.warning("⏳ Base de datos ocupada: no se guardaron las raciones")
+            else:
+                st.toast("✅ Raciones guardadas")
+        st.session_state[clave_versiones] = dict(db.get_plan_versions(inicio, fin))
@@ -1,7 +1,8 @@
 import streamlit as st
-from src import db
+from src import db, logic, profiling
 
 def show_recipes_page(es_editor):
+    lap = profiling.laps("recetas")
     st.header("Gestión de Recetas")
 
     # Aseguramos que exista la receta especial "Compra"
@@ -11,6 +12,7 @@ def show_recipes_page(es_editor):
     # Diccionario para mapear nombres a IDs
     opciones_ingredientes = {nombre: id_ing for id_ing, nombre, _ in all_ings}
     recetas_existentes = db.get_all_recipes()
+    lap("datos")
 
     tab1, tab2 = st.tabs(["➕ Crear Nueva", "✏️ Editar / Ver Recetas"])
 
@@ -35,7 +37,10 @@ def show_recipes_page(es_editor):
                     st.warning("Escribe un nombre y elige ingredientes.")
 
             st.text_input("Nombre del Plato", key="crear_receta_nombre")
-            st.multiselect("Ingredientes", options=opciones_ingredientes.keys(), key="crear_receta_ings")
+            st.multiselect("Ingredientes",
+                           options=_ingredient_options("crear_receta_buscar",
+                                                       st.session_state.get("crear_receta_ings", [])),
+                           key="crear_receta_ings")
             st.button("Guardar Nueva Receta", on_click=save_new_recipe)
 
     # --- TAB 2: EDITAR ---
@@ -67,15 +72,24 @@ def show_recipes_page(es_editor):
                 es_receta_especial = (nombre_r == "Compra")
                 ings_actuales = db.get_recipe_ingredients(id_r)
 
-                # 4. Formulario de edición
+                # 4. Ingredientes: fuera del formulario, con clave propia, para que
+                # lo elegido se conserve entre búsquedas (dentro de un formulario
+                # la selección solo llega al enviarlo y cada búsqueda la perdía)
+                key_ings = f"editar_receta_ings_{id_r}"
+                if key_ings not in st.session_state or not es_editor:
+                    st.session_state[key_ings] = ings_actuales
+                opciones_edicion = _ingredient_options(f"editar_receta_buscar_{id_r}",
+                                                       st.session_state[key_ings], disabled=not es_editor)
+                nuevos_ings = st.multiselect(
+                    "Editar ingredientes",
+                    options=opciones_edicion,
+                    key=key_ings,
+                    disabled=not es_editor
+                )
+
+                # 5. Formulario de edición
                 with st.form(key=f"form_edit_receta_{id_r}"):
                     nuevo_nombre = st.text_input("Editar nombre", value=nombre_r, disabled=es_receta_especial or not es_editor)
-                    nuevos_ings = st.multiselect(
-                        "Editar ingredientes",
-                        options=opciones_ingredientes.keys(),
-                        default=ings_actuales,
-                        disabled=not es_editor
-                    )
 
                     col_btn1, col_btn2 = st.columns(2)
 
@@ -83,16 +97,67 @@ def show_recipes_page(es_editor):
                         if col_btn1.form_submit_button("💾 Guardar Cambios", use_container_width=True):
                             ids_n = [opciones_ingredientes[x] for x in nuevos_ings]
                             if db.update_recipe(id_r, nuevo_nombre, ids_n):
+                                # Se vuelve a tomar de la base de datos en el siguiente rerun
+                                st.session_state.pop(key_ings, None)
                                 st.success(f"✅ '{nuevo_nombre}' actualizada")
                                 st.rerun()
 
                         if col_btn2.form_submit_button("🗑️ Eliminar Receta", use_container_width=True,
                                                        disabled=es_receta_especial):
                             db.delete_recipe(id_r)
+                            st.session_state.pop(key_ings, None)
                             st.session_state["selector_editar_receta"] = recetas_existentes[0]
                             st.rerun()
                     else:
                         st.info("Modo lectura: No se pueden realizar cambios.")
 
+                # 6. Cantidades (se multiplican por las raciones de cada comida planificada)
+                if ings_actuales:
+                    _render_quantities(id_r, ings_actuales, opciones_ingredientes, es_editor)
+
                 if es_receta_especial:
-                    st.info("ℹ️ Estás editando la **Compra General**. Los ingredientes aquí guardados aparecerán siempre en tu lista semanal.")
\ No newline at end of file
+                    st.info("ℹ️ Estás editando la **Compra General**. Los ingredientes aquí guardados aparecerán siempre en tu lista semanal.")
+
+
+def _ingredient_options(key, seleccionados, disabled=False):
+    """
+    Opciones de un selector de ingredientes: los ya elegidos más los que
+    coinciden con la búsqueda, acotados en el servidor en lugar de enviar el
+    catálogo entero al navegador.
+    """
+    busqueda = st.text_input("🔎 Buscar ingrediente", key=key, disabled=disabled,
+                             placeholder="Escribe para filtrar los ingredientes")
+    encontrados = [nombre for _, nombre in db.search_ingredients(busqueda)]
+    return list(dict.fromkeys(list(seleccionados) + encontrados))
+
+
+def _render_quantities(id_r, ings_actuales, opciones_ingredientes, es_editor):
+    with st.expander("⚖️ Cantidades"):
+        guardadas = db.get_recipe_quantities(id_r)
+        filas = []
+        for nombre in ings_actuales:
+            cantidad, unidad = guardadas.get(opciones_ingredientes.get(nombre), (None, None))
+            filas.append({"Ingrediente": nombre, "Cantidad": cantidad, "Unidad": unidad})
+
+        editadas = st.data_editor(
+            filas,
+            column_config={
+                "Cantidad": st.column_config.NumberColumn(min_value=0.0, format="%g"),
+                "Unidad": st.column_config.SelectboxColumn(options=list(logic.UNIDADES)),
+            },
+            disabled=["Ingrediente"] if es_editor else True,
+            hide_index=True,
+            key=f"cantidades_receta_{id_r}",
+        )
+        st.caption("Por ración: en la lista de la compra se multiplican por las raciones de cada comida.")
+
+        if es_editor and st.button("💾 Guardar cantidades", key=f"btn_cantidades_{id_r}"):
+            cambios = {}
+            for fila in editadas:
+                cantidad = fila["Cantidad"]
+                # Celdas vacías: None o NaN según la versión de Streamlit
+                if cantidad is not None and cantidad != cantidad:
+                    cantidad = None
+                cambios[opciones_ingredientes[fila["Ingrediente"]]] = (cantidad, fila["Unidad"] or None)
+            db.set_recipe_quantities(id_r, cambios)
+            st.toast("✅ Cantidades guardadas")
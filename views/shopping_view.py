@@ -1,10 +1,10 @@
 import streamlit as st
 from datetime import timedelta
-from src import db, logic
+from src import db, logic, plan_cache, profiling
 
 def show_shopping_list_page(change_date):
+    lap = profiling.laps("compra")
     st.header("Lista de la Compra")
-    db.init_shopping_db()
 
     # --- 1. NAVEGACIÓN UNIFICADA ---
     c_nav1, c_nav2, c_nav3 = st.columns([1, 2, 1])
@@ -30,61 +30,118 @@ def show_shopping_list_page(change_date):
             change_date(dias=7)
             st.rerun()
 
+    lap("navegacion")
+
     # --- 2. LÓGICA DE DATOS ---
     start_w = logic.get_start_of_week(st.session_state["fecha_global"])
     end_w = start_w + timedelta(days=6)
     st.info(f"📋 Listado del **{start_w.strftime('%d/%m')}** al **{end_w.strftime('%d/%m/%Y')}**")
 
-    datos_plan = db.get_plan_range_details(start_w, end_w)
-    lista_bruta = logic.extract_ingredients_from_plan(datos_plan, db)
-    conteo_ingredientes = logic.aggregate_ingredients(lista_bruta)
-
-    if not conteo_ingredientes:
+    # Id, ingrediente, categoría y veces: cacheado por semana hasta que cambie la planificación
+    agregado = plan_cache.get_shopping_aggregate(start_w, end_w)
+    # Cantidades sumadas (en g/ml/ud, multiplicadas por las raciones)
+    cantidades = {}
+    for ing_id, _, _, _, total, unidad in plan_cache.get_shopping_quantities(start_w, end_w):
+        texto = logic.format_quantity(total, unidad)
+        if texto:
+            cantidades.setdefault(ing_id, []).append(texto)
+    lap("datos")
+
+    if not agregado:
         st.warning("📭 No hay comidas planificadas para esta semana.")
     else:
-        estado_compras = db.get_shopping_status(start_w)
-        categorias_dict = db.get_ingredients_categories()
-
-        # --- 3. BARRA DE PROGRESO ---
-        total_items = len(conteo_ingredientes)
-        comprados_count = sum(1 for ing in conteo_ingredientes if estado_compras.get(ing, False))
-        progreso = comprados_count / total_items if total_items > 0 else 0
-        st.progress(progreso, text=f"Progreso: {comprados_count} de {total_items}")
-
-        # --- 4. LISTA POR CATEGORÍAS ---
-        agrupados = {}
-        for ing, cant in conteo_ingredientes.items():
-            cat = categorias_dict.get(ing, "Otros")
-            if cat not in agrupados: agrupados[cat] = []
-            agrupados[cat].append((ing, cant))
-
-        for cat in sorted(agrupados.keys()):
-            with st.expander(f"{cat}", expanded=True):
-                c1, c2 = st.columns(2)
-                for idx, (ingrediente, cantidad) in enumerate(sorted(agrupados[cat])):
-                    col = c1 if idx % 2 == 0 else c2
-                    esta_marcado = estado_compras.get(ingrediente, False)
-
-                    nuevo_estado = col.checkbox(
-                        f"{ingrediente} (x{cantidad})",
-                        value=esta_marcado,
-                        key=f"chk_{start_w}_{ingrediente}"
-                    )
-
-                    if nuevo_estado != esta_marcado:
-                        db.update_shopping_status(start_w, ingrediente, nuevo_estado)
-                        st.rerun()
-
-        st.divider()
-
-        # --- 5. BOTÓN DE RESET ---
-        col_reset, _ = st.columns([1, 2])
-        with col_reset:
-            if st.button("🗑️ Vaciar lista de esta semana", key="btn_reset_compra_final"):
-                db.clear_shopping_status(start_w)
-                # Limpiar las claves de los checkboxes del session_state para que se desmarquen visualmente
-                prefijo = f"chk_{start_w}"
-                for key in list(st.session_state.keys()):
-                    if key.startswith(prefijo):
-                        del st.session_state[key]
-                st.rerun()
\ No newline at end of file
+        _render_lista(start_w, agregado, cantidades)
+        lap("lista")
+
+
+def _marcar(start_w, ingrediente_id, key):
+    """
+    Guarda la casilla al marcarla, con compare-and-set sobre la versión que se
+    mostró: si otra persona la cambió entretanto no se pisa y se avisa. Con la
+    cola de escrituras activa va al hilo escritor, agrupada con las escrituras
+    de las demás sesiones (y con la anterior de esta casilla si aún no se escribió).
+    """
+    versiones = st.session_state.setdefault(f"compra_versiones_{start_w}", {})
+    vista = versiones.get(ingrediente_id, 0)
+    try:
+        conflictos = db.update_shopping_statuses(start_w, {ingrediente_id: st.session_state[key]},
+                                                 versiones={ingrediente_id: vista})
+        ocupada = False
+    except db.DatabaseBusyError:
+        conflictos, ocupada = [ingrediente_id], True
+    if conflictos:
+        # Se vuelve a crear con el valor guardado
+        st.session_state.pop(key, None)
+        st.session_state[f"compra_avisos_{start_w}"] = (len(conflictos), ocupada)
+    else:
+        versiones[ingrediente_id] = vista + 1
+
+
+def _vaciar(start_w):
+    # En el callback: el fragmento se redibuja después ya con las casillas vacías
+    db.clear_shopping_status(start_w)
+    # Limpiar las claves de los checkboxes del session_state para que se desmarquen visualmente
+    prefijo = f"chk_{start_w}_"
+    for key in list(st.session_state.keys()):
+        if key.startswith(prefijo):
+            del st.session_state[key]
+
+
+@st.fragment
+def _render_lista(start_w, agregado, cantidades):
+    """
+    Progreso y casillas por categoría. Es un fragmento: marcar una casilla
+    solo vuelve a ejecutar esta función, no la aplicación entera.
+    """
+    aviso = st.session_state.pop(f"compra_avisos_{start_w}", None)
+    if aviso and aviso[1]:
+        st.warning("⏳ Base de datos ocupada: no se guardó la casilla")
+    elif aviso:
+        st.warning(f"✋ {aviso[0]} casillas las cambió otra persona a la vez: se muestra su versión")
+
+    # Versiones de las casillas tal como se mostraron: una casilla que otra
+    # persona ha cambiado entretanto no se pisa (compare-and-set)
+    clave_versiones = f"compra_versiones_{start_w}"
+    vistas = st.session_state.get(clave_versiones, {})
+    estado_compras = db.get_shopping_status(start_w)
+    versiones = db.get_shopping_versions(start_w)
+    # Las casillas que han cambiado en otra sesión se vuelven a crear con el valor guardado
+    cambiadas = {ing_id for ing_id, version in versiones.items() if vistas.get(ing_id, 0) != version}
+    for ing_id in cambiadas:
+        st.session_state.pop(f"chk_{start_w}_{ing_id}", None)
+    st.session_state[clave_versiones] = versiones
+
+    # --- 3. BARRA DE PROGRESO ---
+    total_items = len(agregado)
+    comprados_count = sum(1 for ing_id, _, _, _ in agregado if estado_compras.get(ing_id, False))
+    progreso = comprados_count / total_items if total_items > 0 else 0
+    st.progress(progreso, text=f"Progreso: {comprados_count} de {total_items}")
+
+    # --- 4. LISTA POR CATEGORÍAS ---
+    agrupados = {}
+    for ing_id, ing, cat, cant in agregado:
+        if cat not in agrupados: agrupados[cat] = []
+        agrupados[cat].append((ing, cant, ing_id))
+
+    for cat in sorted(agrupados.keys()):
+        with st.expander(f"{cat}", expanded=True):
+            c1, c2 = st.columns(2)
+            for idx, (ingrediente, cantidad, ing_id) in enumerate(sorted(agrupados[cat])):
+                col = c1 if idx % 2 == 0 else c2
+                key = f"chk_{start_w}_{ing_id}"
+                detalle = " + ".join(cantidades.get(ing_id, []))
+                col.checkbox(
+                    f"{ingrediente} (x{cantidad} · {detalle})" if detalle else f"{ingrediente} (x{cantidad})",
+                    value=estado_compras.get(ing_id, False),
+                    key=key,
+                    on_change=_marcar,
+                    args=(start_w, ing_id, key)
+                )
+
+    st.divider()
+
+    # --- 5. BOTÓN DE RESET ---
+    col_reset, _ = st.columns([1, 2])
+    with col_reset:
+        st.button("🗑️ Vaciar lista de esta semana", key="btn_reset_compra_final",
+                  on_click=_vaciar, args=(start_w,))